@@ -0,0 +1,98 @@
+"""Benchmark thông lượng embedding (texts/giây): engine hiện tại so với cách làm cũ.
+
+Cách cũ: tokenize cả danh sách với padding=True, đọc lại tên input mỗi lần gọi và
+mean pooling trên mọi vị trí (kể cả padding). Chạy từ thư mục gốc của repo (cần
+./tokenizer và ./onnx_model/model.onnx):
+
+    PYTHONPATH=src python benchmarks/bench_embedding.py --batch-sizes 1 8 32 64
+
+Kết quả (JSON) được in ra stdout hoặc ghi vào --output.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+from search_module.utilities.db_helper import LocalEmbeddingFunction
+
+
+def legacy_embed(engine, texts):
+    inputs = engine.tokenizer(texts, padding=True, truncation=True, return_tensors="np")
+    ort_inputs = {k: v for k, v in inputs.items() if k in [i.name for i in engine.session.get_inputs()]}
+    ort_outs = engine.session.run(None, ort_inputs)
+    return np.mean(ort_outs[0], axis=1).tolist()
+
+
+def make_texts(n, seed):
+    # Độ dài lệch nhau như chunk thật: phần lớn ngắn, một số chunk đầy 250 từ
+    rng = random.Random(seed)
+    words = "the model learns a representation of tokens from gradient descent over many lecture slides".split()
+    lengths = [rng.choice([5, 10, 20, 40, 80, 250]) for _ in range(n)]
+    return [" ".join(rng.choice(words) for _ in range(length)) for length in lengths]
+
+
+def throughput(fn, texts, batch_size, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            fn(texts[i:i + batch_size])
+        best = min(best, time.perf_counter() - start)
+    return round(len(texts) / best, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    parser.add_argument("--optimization-level", default="all")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    engine = LocalEmbeddingFunction(
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+        optimization_level=args.optimization_level,
+    )
+    texts = make_texts(args.texts, args.seed)
+    engine(texts[:8])  # warmup
+
+    results = []
+    for batch_size in args.batch_sizes:
+        # Engine mới nhận cả danh sách, tự sắp theo độ dài rồi chia batch_size
+        entry = {
+            "batch_size": batch_size,
+            "legacy_texts_per_s": throughput(lambda batch: legacy_embed(engine, batch), texts, batch_size, args.repeats),
+            "engine_texts_per_s": throughput(lambda batch: engine.embed(batch, batch_size), texts, len(texts), args.repeats),
+        }
+        entry["speedup"] = round(entry["engine_texts_per_s"] / entry["legacy_texts_per_s"], 2)
+        results.append(entry)
+        print(json.dumps(entry), file=sys.stderr)
+
+    report = {
+        "benchmark": "embedding_throughput",
+        "texts": args.texts,
+        "session": {
+            "intra_op_threads": args.intra_op_threads,
+            "inter_op_threads": args.inter_op_threads,
+            "optimization_level": args.optimization_level,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark độ trễ word search: index từ khóa so với quét toàn bộ collection.
+
+Chạy offline, không cần mô hình ONNX hay Chroma:
+
+    PYTHONPATH=src python benchmarks/bench_keyword_index.py --sizes 1000 10000 100000 1000000
+
+Kết quả (JSON) được in ra stdout hoặc ghi vào --output.
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from search_module.utilities.keyword_index import KeywordIndex
+
+
+def make_vocab(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def make_corpus(n_chunks, words_per_chunk, vocab, rng):
+    # Phân bố Zipf xấp xỉ: từ phổ biến xuất hiện nhiều hơn nhiều lần
+    weights = [1.0 / (rank + 1) for rank in range(len(vocab))]
+    for i in range(n_chunks):
+        yield f"chunk_{i}", " ".join(rng.choices(vocab, weights=weights, k=words_per_chunk))
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def time_queries(fn, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "p50_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(percentile(samples, 0.95), 4),
+        "p99_ms": round(percentile(samples, 0.99), 4),
+    }
+
+
+def indexed(index, texts, query, k):
+    # Như VectorDatabase._word_hits: index thu hẹp ứng viên, text được kiểm tra lại
+    hits = []
+    q = query.lower()
+    for chunk_id in index.candidates("scope_bench", query):
+        if q in texts[chunk_id].lower():
+            hits.append(texts[chunk_id])
+            if len(hits) >= k:
+                break
+    return hits
+
+
+def run(sizes, words_per_chunk, n_queries, k, scan_limit, seed):
+    rng = random.Random(seed)
+    vocab = make_vocab(20000, rng)
+    results = []
+    for size in sizes:
+        docs = list(make_corpus(size, words_per_chunk, vocab, rng))
+        queries = []
+        for _ in range(n_queries):
+            words = rng.choice(docs)[1].split()
+            start = rng.randrange(len(words) - 1)
+            queries.append(" ".join(words[start:start + rng.choice([1, 2])]))
+
+        texts = dict(docs)
+        with tempfile.TemporaryDirectory() as tmp:
+            index = KeywordIndex(tmp)
+            start = time.perf_counter()
+            index.build("scope_bench", docs)
+            build_s = time.perf_counter() - start
+            entry = {
+                "chunks": size,
+                "words_per_chunk": words_per_chunk,
+                "index_build_s": round(build_s, 3),
+                "index": time_queries(lambda q: indexed(index, texts, q, k), queries),
+            }
+
+        # Cách cũ: lower() + tìm chuỗi con trên toàn bộ tài liệu của scope
+        if size <= scan_limit:
+            def scan(query):
+                hits = []
+                q = query.lower()
+                for _, doc in docs:
+                    if q in doc.lower():
+                        hits.append(doc)
+                        if len(hits) >= k:
+                            break
+                return hits
+            entry["full_scan"] = time_queries(scan, queries)
+        results.append(entry)
+        print(json.dumps(entry), file=sys.stderr)
+    return {"benchmark": "keyword_index", "k": k, "queries": n_queries, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--words-per-chunk", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--scan-limit", type=int, default=100000, help="bỏ qua quét toàn bộ với corpus lớn hơn")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.words_per_chunk, args.queries, args.k, args.scan_limit, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
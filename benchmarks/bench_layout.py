@@ -0,0 +1,106 @@
+"""Benchmark độ trễ truy vấn theo số tenant: layout mỗi scope một collection so với layout shard.
+
+Mỗi tenant (scope) có một số chunk với vector ngẫu nhiên được ghi thẳng vào storage
+(không chạy mô hình khi ingest). Đo ba kiểu truy vấn semantic: chỉ scope của người gọi,
+semantic_search (kết quả theo từng scope) và global_search (một top-k chung). Cache kết
+quả bị tắt; vector của câu truy vấn được embed trước để chỉ đo phần truy vấn storage.
+Chạy từ thư mục gốc của repo (cần ./tokenizer và ./onnx_model/model.onnx):
+
+    PYTHONPATH=src python benchmarks/bench_layout.py --tenants 10 100 1000
+
+Kết quả (JSON) được in ra stdout hoặc ghi vào --output.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from search_module.utilities.db_helper import SHARD_COUNT, VectorDatabase
+
+QUERIES = ["what is a tokenizer", "gradient descent", "final exam", "attention layers", "see you next time"]
+
+
+def latency(fn, queries, repeats):
+    samples = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "mean_ms": round(float(np.mean(samples)), 3),
+    }
+
+
+def bench(layout, tenants, args, rng):
+    with tempfile.TemporaryDirectory() as workdir:
+        db = VectorDatabase(
+            storage_path=os.path.join(workdir, "vector_storage"),
+            layout=layout,
+            shard_count=args.shard_count,
+            embedding_cache_path=None,
+            keyword_index_path=os.path.join(workdir, "keyword_index"),
+            result_cache_size=0,
+            search_deadline_s=600.0,
+        )
+        dim = len(db.embed_query(QUERIES[0]))
+        start = time.perf_counter()
+        for t in range(tenants):
+            scope = f"scope_T{t}"
+            vectors = rng.normal(size=(args.chunks_per_tenant, dim)).astype(np.float32)
+            db.get_collection_by_scope(scope).upsert(
+                ids=[f"{scope}_{i}" for i in range(args.chunks_per_tenant)],
+                documents=[f"tenant {t} chunk {i}" for i in range(args.chunks_per_tenant)],
+                embeddings=vectors.tolist(),
+                metadatas=[{"chunk_scope": f"T{t}", "chunk_id": i} for i in range(args.chunks_per_tenant)],
+            )
+        ingest_s = time.perf_counter() - start
+        for query in QUERIES:
+            db.embed_query(query)
+
+        def own_scope(query):
+            db._semantic_hits(db.get_collection_by_scope("scope_T0"), db.embed_query(query), args.k)
+
+        collections = len(db.client.list_collections())
+        return {
+            "layout": layout,
+            "tenants": tenants,
+            "chunks": tenants * args.chunks_per_tenant,
+            "collections": collections,
+            "ingest_s": round(ingest_s, 3),
+            "own_scope": latency(own_scope, QUERIES, args.repeats),
+            "semantic_search": latency(lambda q: db.semantic_search(q, "T0", k=args.k), QUERIES, args.repeats),
+            "global_search": latency(lambda q: db.global_search(q, "T0", k=args.k), QUERIES, args.repeats),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tenants", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--layouts", nargs="+", choices=["per_scope", "sharded"], default=["per_scope", "sharded"])
+    parser.add_argument("--chunks-per-tenant", type=int, default=20)
+    parser.add_argument("--shard-count", type=int, default=SHARD_COUNT)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = [bench(layout, tenants, args, rng) for tenants in args.tenants for layout in args.layouts]
+    report = {"benchmark": "storage_layout", "config": vars(args), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
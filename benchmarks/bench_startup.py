@@ -0,0 +1,77 @@
+"""Benchmark thời gian khởi động: import app, khởi tạo DB, warmup và truy vấn đầu tiên.
+
+Mỗi lần đo chạy trong một tiến trình Python mới để không bị ảnh hưởng bởi module đã
+import. Chạy từ thư mục gốc của repo (cần ./tokenizer và ./onnx_model/model.onnx):
+
+    PYTHONPATH=src python benchmarks/bench_startup.py --runs 5 --max-import-ms 1000
+
+Kết quả (JSON, trung vị và lớn nhất theo từng giai đoạn, ms) được in ra stdout hoặc
+ghi vào --output. Với --max-import-ms, script trả exit code 1 khi trung vị thời gian
+import vượt ngưỡng, dùng để bắt regression trong CI.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+import search_module.app as app
+imported = time.perf_counter()
+app.get_db()
+initialized = time.perf_counter()
+app.warmup()
+warmed = time.perf_counter()
+app.get_db().embed_query("what is a tokenizer")
+queried = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "init_ms": (initialized - imported) * 1000,
+    "warmup_ms": (warmed - initialized) * 1000,
+    "first_query_ms": (queried - warmed) * 1000,
+    "ready_ms": (warmed - start) * 1000,
+}))
+"""
+
+
+def run_once():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    result = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    stages = {
+        stage: {
+            "median_ms": round(statistics.median(run[stage] for run in runs), 1),
+            "max_ms": round(max(run[stage] for run in runs), 1),
+        }
+        for stage in runs[0]
+    }
+    report = {"benchmark": "startup", "runs": args.runs, "stages": stages}
+    failed = args.max_import_ms is not None and stages["import_ms"]["median_ms"] > args.max_import_ms
+    if args.max_import_ms is not None:
+        report["max_import_ms"] = args.max_import_ms
+        report["passed"] = not failed
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
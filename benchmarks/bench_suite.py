@@ -0,0 +1,217 @@
+"""Bộ benchmark offline: ingestion, độ trễ search theo kích thước corpus, embedding và PDF.
+
+Không cần mạng: corpus, câu truy vấn và file PDF đều được sinh ngẫu nhiên (seed cố
+định). Mỗi corpus được ghi vào Chroma/index từ khóa trong thư mục tạm, cache
+embedding trên đĩa, cache câu truy vấn và cache kết quả search bị tắt để đo đúng
+chi phí thật. Chạy từ thư mục gốc của repo (cần ./tokenizer và ./onnx_model/model.onnx):
+
+    PYTHONPATH=src python benchmarks/bench_suite.py --sizes 1000 10000 100000 --output bench.json
+
+Các phần: embedding (texts/giây theo batch size), add_chunk (thêm từng chunk),
+corpora (bulk add + p50/p95/p99 của word_search và semantic_search, với ít và nhiều
+scope) và pdf (process_pdf trên PDF sinh sẵn). Chọn phần bằng --sections. Kết quả
+(JSON) kèm commit hiện tại để so sánh giữa các lần chạy.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from search_module.utilities.db_helper import LocalEmbeddingFunction, VectorDatabase
+from search_module.utilities.pdf import process_pdf
+from sample_pdf import make_pdf
+
+SECTIONS = ("embedding", "add_chunk", "corpora", "pdf")
+
+# Số scope của hai kiểu corpus: ít scope (vài môn học) và nhiều scope (nhiều user)
+SCOPE_LAYOUTS = {"few": 2, "many": 50}
+
+
+def make_vocab(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def make_texts(n, vocab, rng, min_words=20, max_words=80):
+    # Phân bố Zipf xấp xỉ: từ phổ biến xuất hiện nhiều hơn nhiều lần
+    weights = [1.0 / (rank + 1) for rank in range(len(vocab))]
+    return [" ".join(rng.choices(vocab, weights=weights, k=rng.randint(min_words, max_words))) for _ in range(n)]
+
+
+def make_chunks(texts, n_scopes):
+    return [
+        {
+            "location": f"page {i // 4 + 1}",
+            "text": text,
+            "chunk_source": f"bench_{i % n_scopes}.pdf",
+            "chunk_scope": f"S{i % n_scopes}",
+            "chunk_source_type": "pdf",
+            "chunk_id": i,
+        }
+        for i, text in enumerate(texts)
+    ]
+
+
+def latency_summary(samples_ms):
+    return {
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples_ms, 99)), 3),
+        "mean_ms": round(float(np.mean(samples_ms)), 3),
+    }
+
+
+def time_calls(fn, inputs):
+    samples = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        samples.append((time.perf_counter() - start) * 1000)
+    return latency_summary(samples)
+
+
+def open_db(workdir):
+    return VectorDatabase(
+        storage_path=os.path.join(workdir, "vector_storage"),
+        embedding_cache_path=None,
+        keyword_index_path=os.path.join(workdir, "keyword_index"),
+        query_cache_size=0,
+        result_cache_size=0,
+        search_deadline_s=60.0,
+    )
+
+
+def bench_embedding(args, vocab, rng):
+    engine = LocalEmbeddingFunction()
+    texts = make_texts(args.embed_texts, vocab, rng, 5, 250)
+    engine(texts[:8])  # warmup
+    results = []
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            engine(texts[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        results.append({"batch_size": batch_size, "texts_per_s": round(len(texts) / elapsed, 2)})
+    return results
+
+
+def bench_add_chunk(args, vocab, rng):
+    chunks = make_chunks(make_texts(args.single_adds, vocab, rng), 1)
+    with tempfile.TemporaryDirectory() as workdir:
+        db = open_db(workdir)
+        start = time.perf_counter()
+        for chunk in chunks:
+            db.add_chunk(chunk)
+        elapsed = time.perf_counter() - start
+    return {"chunks": len(chunks), "seconds": round(elapsed, 3), "chunks_per_s": round(len(chunks) / elapsed, 2)}
+
+
+def bench_corpus(args, size, layout, vocab, rng):
+    n_scopes = SCOPE_LAYOUTS[layout]
+    texts = make_texts(size, vocab, rng)
+    chunks = make_chunks(texts, n_scopes)
+    # Truy vấn word: hai từ liên tiếp lấy từ chunk có thật để luôn có kết quả
+    word_queries = []
+    for text in rng.sample(texts, min(args.queries, len(texts))):
+        words = text.split()
+        i = rng.randrange(len(words) - 1)
+        word_queries.append(" ".join(words[i:i + 2]))
+    semantic_queries = [" ".join(rng.choices(vocab, k=6)) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db = open_db(workdir)
+        start = time.perf_counter()
+        db.add_chunks(chunks)
+        add_s = time.perf_counter() - start
+        db.warmup()
+        return {
+            "chunks": size,
+            "layout": layout,
+            "scopes": n_scopes,
+            "bulk_add_s": round(add_s, 3),
+            "bulk_add_chunks_per_s": round(size / add_s, 2),
+            "word_search": time_calls(lambda q: db.word_search(q, "S0", k=args.k), word_queries),
+            "semantic_search": time_calls(lambda q: db.semantic_search(q, "S0", k=args.k), semantic_queries),
+        }
+
+
+def bench_pdf(args, vocab, rng):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for pages in args.pdf_pages:
+            path = os.path.join(workdir, f"bench_{pages}.pdf")
+            with open(path, "wb") as f:
+                f.write(make_pdf(make_texts(pages, vocab, rng, 150, 300)))
+            start = time.perf_counter()
+            chunks, _ = process_pdf(path, "bench")
+            elapsed = time.perf_counter() - start
+            results.append({
+                "pages": pages,
+                "chunks": len(chunks or []),
+                "seconds": round(elapsed, 3),
+                "pages_per_s": round(pages / elapsed, 2),
+            })
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", nargs="+", choices=SECTIONS, default=list(SECTIONS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--layouts", nargs="+", choices=sorted(SCOPE_LAYOUTS), default=sorted(SCOPE_LAYOUTS))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--embed-texts", type=int, default=512)
+    parser.add_argument("--single-adds", type=int, default=200)
+    parser.add_argument("--pdf-pages", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--vocab", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocab = make_vocab(args.vocab, rng)
+    report = {
+        "benchmark": "suite",
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+    }
+    if "embedding" in args.sections:
+        report["embedding"] = bench_embedding(args, vocab, rng)
+    if "add_chunk" in args.sections:
+        report["add_chunk"] = bench_add_chunk(args, vocab, rng)
+    if "corpora" in args.sections:
+        report["corpora"] = [
+            bench_corpus(args, size, layout, vocab, rng) for size in args.sizes for layout in args.layouts
+        ]
+    if "pdf" in args.sections:
+        report["pdf"] = bench_pdf(args, vocab, rng)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""So sánh mô hình INT8 với fp32: độ trùng top-k trên một tập truy vấn cố định, offline.
+
+Cần cả ./onnx_model/model.onnx và bản INT8 (tạo bằng
+`python -m search_module.utilities.quantize`). Chạy từ thư mục gốc của repo:
+
+    PYTHONPATH=src python benchmarks/quantization_accuracy.py -k 5
+
+Kết quả (JSON) gồm overlap@k trung bình/nhỏ nhất, cosine giữa vector fp32 và INT8,
+và thông lượng của mỗi mô hình.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from search_module.utilities.db_helper import LocalEmbeddingFunction
+
+CORPUS = [
+    "A tokenizer maps between strings and sequences of integer token ids.",
+    "Byte pair encoding repeatedly merges the most frequent pair of adjacent symbols.",
+    "Gradient descent updates parameters in the direction of the negative gradient.",
+    "The learning rate controls the step size of each optimization update.",
+    "Overfitting happens when a model memorizes the training data instead of generalizing.",
+    "Dropout randomly zeroes activations during training as a form of regularization.",
+    "Attention computes a weighted sum of values using query and key similarity.",
+    "The transformer encoder stacks self-attention and feed-forward layers.",
+    "Convolutional networks share weights across spatial positions of an image.",
+    "Recurrent networks process sequences one step at a time with a hidden state.",
+    "Precision is the fraction of predicted positives that are truly positive.",
+    "Recall is the fraction of actual positives that the model retrieves.",
+    "A hash table offers expected constant time lookup by key.",
+    "Binary search finds an element in a sorted array in logarithmic time.",
+    "Dijkstra's algorithm computes shortest paths in graphs with non-negative weights.",
+    "A relational database stores data in tables related by keys.",
+    "An index speeds up queries at the cost of extra storage and slower writes.",
+    "Unit tests check small pieces of code in isolation.",
+    "Continuous integration runs the test suite on every push.",
+    "Docker images package an application together with its dependencies.",
+    "Quantum bits can be in a superposition of zero and one.",
+    "Entanglement correlates the measurement outcomes of two qubits.",
+    "The Fourier transform decomposes a signal into its frequencies.",
+    "Principal component analysis projects data onto directions of maximal variance.",
+    "K-means clustering alternates between assigning points and updating centroids.",
+    "Cross-entropy loss measures the difference between predicted and true distributions.",
+    "Batch normalization normalizes layer inputs over a mini-batch.",
+    "Word embeddings place semantically similar words close together in vector space.",
+    "See you next time, and remember to review the lecture notes.",
+    "The final exam covers all chapters discussed during the semester.",
+]
+
+QUERIES = [
+    "how does a tokenizer work",
+    "byte pair encoding merges",
+    "optimization step size",
+    "regularization to avoid overfitting",
+    "self attention in transformers",
+    "image models with shared weights",
+    "precision and recall metrics",
+    "fast lookup data structure",
+    "shortest path algorithm",
+    "database indexes",
+    "testing and continuous integration",
+    "qubits and superposition",
+    "dimensionality reduction",
+    "clustering algorithm",
+    "loss function for classification",
+    "what is on the final exam",
+]
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def top_k(queries, corpus, k):
+    return [set(np.argsort(-row)[:k]) for row in queries @ corpus.T]
+
+
+def timed_embed(engine, texts, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        vectors = engine(texts)
+        best = min(best, time.perf_counter() - start)
+    return vectors, round(len(texts) / best, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = {}
+    vectors = {}
+    for name, quantized in (("fp32", False), ("int8", True)):
+        engine = LocalEmbeddingFunction(quantized=quantized)
+        corpus, corpus_rate = timed_embed(engine, CORPUS)
+        queries, _ = timed_embed(engine, QUERIES)
+        vectors[name] = (normalize(corpus), normalize(queries))
+        results[name] = {"model": engine.model_path, "texts_per_s": corpus_rate}
+
+    fp32_top = top_k(vectors["fp32"][1], vectors["fp32"][0], args.k)
+    int8_top = top_k(vectors["int8"][1], vectors["int8"][0], args.k)
+    overlaps = [len(a & b) / args.k for a, b in zip(fp32_top, int8_top)]
+    cosines = np.sum(vectors["fp32"][0] * vectors["int8"][0], axis=1)
+
+    report = {
+        "benchmark": "quantization_accuracy",
+        "k": args.k,
+        "queries": len(QUERIES),
+        "corpus": len(CORPUS),
+        "mean_overlap_at_k": round(float(np.mean(overlaps)), 4),
+        "min_overlap_at_k": round(float(np.min(overlaps)), 4),
+        "mean_vector_cosine": round(float(np.mean(cosines)), 6),
+        "min_vector_cosine": round(float(np.min(cosines)), 6),
+        "models": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
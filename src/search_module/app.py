@@ -110,30 +110,500 @@
 #         raise HTTPException(status_code=400, detail="Nội dung không phải là JSON hợp lệ")
 
 
-from search_module.utilities.youtube import process_youtube
-from search_module.utilities.pdf import process_pdf
+from search_module.utilities.youtube import extraction_params as youtube_extraction_params
+from search_module.utilities.youtube import (
+    expand_youtube_urls, iter_process_youtube, process_youtube, youtube_playlist_id, youtube_video_id,
+)
+from search_module.utilities.pdf import extraction_params as pdf_extraction_params
+from search_module.utilities.pdf import INGEST_WINDOW, iter_chunk_windows, iter_process_pdf, sanitize_filename
+from search_module.utilities.source_registry import SourceRegistry, file_sha256, source_key
+from search_module.utilities.upload import PdfUploadReceiver, UploadError
+from search_module.utilities.response import HIT_FIELDS, dumps, shape_hits, shape_results
 from search_module.utilities.db_helper import *
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from search_module.utilities.jobs import JobManager, JobQueueFull
+from search_module.utilities.log import configure_logging
+from search_module.utilities.metrics import METRICS
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 
 import json
+import logging
 import os
 import base64
 import hashlib
+import threading
+import time
 
-app = FastAPI()
-db = VectorDatabase()
+configure_logging()
+logger = logging.getLogger(__name__)
+
+jobs = JobManager()
+# Nguồn đã ingest (video id / sha256 của PDF) → scope và tóm tắt chunk, để không xử lý lại
+sources = SourceRegistry()
 CACHE_DIR = "./cache"
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+# Giới hạn kích thước file PDF upload qua multipart và kích thước mỗi lần đọc/ghi
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Phần body multipart ngoài nội dung file (boundary, header của part, các field nhỏ)
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+# Số truy vấn tối đa trong một request search dạng danh sách
+MAX_BATCH_QUERIES = 32
+
+# Số video tối đa trong một request ingest nhiều URL / playlist (sau khi mở playlist)
+MAX_YOUTUBE_URLS = 200
+
+# Giới hạn "k" (số kết quả mỗi trang) và "offset" của một request search
+MAX_SEARCH_K = 100
+MAX_SEARCH_OFFSET = 1000
+
+# Bucket cho tốc độ ingest PDF (trang/giây)
+PDF_PAGES_PER_SECOND_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_REQUEST_SECONDS = METRICS.histogram(
+    "request_duration_seconds", "Thời gian xử lý request theo mode (giây)", labelnames=("mode",)
+)
+_PDF_PAGES_PER_SECOND = METRICS.histogram(
+    "pdf_ingest_pages_per_second", "Tốc độ ingest một file PDF: đọc, chunk, embed và ghi (trang/giây)",
+    PDF_PAGES_PER_SECOND_BUCKETS,
+)
+_PDF_PAGES = METRICS.counter("pdf_pages_total", "Tổng số trang PDF đã đọc")
+
+# Nạp DB + mô hình và chạy thử inference ở nền ngay khi server khởi động
+WARMUP_ON_STARTUP = True
+
+# VectorDatabase dùng chung, chỉ được tạo khi cần (import app không mở Chroma hay ONNX)
+_db = None
+_db_lock = threading.Lock()
+_startup = {"status": "starting", "init_ms": None, "warmup_ms": None, "error": None}
+# Được set trong lúc warmup nền đang nạp DB và mô hình
+_warming = threading.Event()
+
+
+def get_db():
+    """VectorDatabase dùng chung, khởi tạo ở lần dùng đầu tiên."""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                start = time.perf_counter()
+                _db = VectorDatabase()
+                _startup["init_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return _db
+
+
+def warmup():
+    """Khởi tạo DB và chạy thử inference; /readyz trả 200 sau khi hàm này xong."""
+    try:
+        _startup["warmup_ms"] = round(get_db().warmup(), 1)
+        _startup["status"] = "ready"
+    except Exception as e:
+        logger.exception("warmup failed")
+        _startup["status"] = "failed"
+        _startup["error"] = str(e)
+    finally:
+        _warming.clear()
+
+
+def require_ready():
+    """Route search/ingest trả 503 trong lúc warmup nền chưa xong, thay vì chờ khởi tạo DB."""
+    if _warming.is_set():
+        raise HTTPException(status_code=503, detail="Server đang khởi động, thử lại sau", headers={"Retry-After": "1"})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if WARMUP_ON_STARTUP:
+        # Chạy ở thread riêng để server bind port và trả lời /healthz ngay
+        _warming.set()
+        threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Số scope và chunk được tính lúc scrape /metrics, bỏ qua khi DB chưa được khởi tạo
+METRICS.gauge("vector_db_scopes", "Số scope trong vector DB", lambda: len(_db.get_all_scopes()) if _db else None)
+METRICS.gauge("vector_db_chunks", "Tổng số chunk trên mọi scope", lambda: _db.counts()["chunks"] if _db else None)
+METRICS.gauge("result_cache_hits", "Số lần search trả kết quả từ cache", lambda: _db.result_cache.hits if _db else None)
+METRICS.gauge("result_cache_misses", "Số lần search phải tính lại", lambda: _db.result_cache.misses if _db else None)
+METRICS.gauge(
+    "result_cache_hit_rate", "Tỉ lệ hit của cache kết quả search",
+    lambda: _db.result_cache_stats()["hit_rate"] if _db else None,
+)
+METRICS.gauge("result_cache_bytes", "Kích thước ước lượng của cache kết quả", lambda: _db.result_cache.bytes if _db else None)
+
+
+def salt_user(user):
+    """salted_user: username + phần đầu của sha256(username) sao cho đủ 20 kí tự."""
+    hash_hex = hashlib.sha256(user.encode("utf-8")).hexdigest()
+    if len(user) >= 20:
+        return user[:20]
+    needed = 20 - len(user)
+    return user + hash_hex[:needed]
+
+
+def user_dir_for(salted_user):
+    """Folder của user bên trong CACHE_DIR."""
+    user_dir = os.path.join(CACHE_DIR, salted_user)
+    os.makedirs(user_dir, exist_ok=True)
+    return user_dir
+
+
+def _job_progress(job, stage):
+    """Callback progress(done, total) ghi tiến độ vào job (nếu chạy trong job)."""
+    if job is None:
+        return None
+    return lambda done, total: job.progress(stage, done, total)
+
+
+def _ingest_response(first_chunk, num_chunks, message):
+    if num_chunks < 2:
+        return {
+            "status": "warning",
+            "message": "Độ dài transcript quá ngắn, có thể không đầy đủ hoặc bị lỗi.",
+            "first_chunk": first_chunk,
+            "num_chunks": num_chunks
+        }, 200
+    return {"status": "success", "message": message, "first_chunk": first_chunk, "num_chunks": num_chunks}, 200
+
+
+def youtube_source_key(url):
+    video_id = youtube_video_id(url)
+    return source_key("youtube", video_id, youtube_extraction_params()) if video_id else None
+
+
+def pdf_source_key(sha256):
+    return source_key("pdf", sha256, pdf_extraction_params())
+
+
+def existing_source(key, scope, message):
+    """Response cho nguồn đã có sẵn trong scope (không làm gì thêm), hoặc None."""
+    summary = sources.lookup(key, scope) if key else None
+    if summary is None:
+        return None
+    content, status_code = _ingest_response(summary["first_chunk"], summary["num_chunks"], message)
+    content["deduplicated"] = "existing"
+    return content, status_code
+
+
+def reuse_source(key, scope, chunk_source, message):
+    """Nguồn đã có trong scope → trả tóm tắt; có ở scope khác → chép vector + metadata sang.
+
+    Trả về None nếu phải ingest từ đầu (nguồn mới, hoặc dữ liệu ở scope cũ không còn đủ).
+    """
+    if key is None:
+        return None
+    existing = existing_source(key, scope, message)
+    if existing is not None:
+        return existing
+    db = get_db()
+    for other_scope, summary in sources.get(key).items():
+        copied = db.copy_source(key, other_scope, scope, chunk_source)
+        if copied["copied"] == summary["num_chunks"]:
+            if chunk_source:
+                # Cùng nguồn (vd. cùng tên file) đã có trong scope với nội dung khác: bỏ bản cũ
+                forget_replaced_sources(db.delete_source(scope, chunk_source, keep_ids=copied["ids"]), scope, key)
+            summary = dict(summary, first_chunk=copied["first_chunk"])
+            sources.add(key, scope, summary)
+            content, status_code = _ingest_response(summary["first_chunk"], summary["num_chunks"], message)
+            content["deduplicated"] = "copied"
+            return content, status_code
+    return None
+
+
+def forget_replaced_sources(removed, scope, key):
+    """Bỏ khỏi registry các nguồn cũ (khác key) có chunk vừa bị xóa khỏi scope."""
+    for old_key in removed.get("source_keys", []):
+        if old_key != key:
+            sources.remove(old_key, scope)
+
+
+def ingest_youtube(url, scope, job=None):
+    """Lấy transcript, chunk, embed và ghi vào DB. Trả về (nội dung response, status code)."""
+    message = "Youtube transcript added successfully"
+    key = youtube_source_key(url)
+    reused = reuse_source(key, scope, url, message)
+    if reused is not None:
+        return reused
+
+    if job is not None:
+        job.progress("fetching", 0)
+    chunks, title = process_youtube(url, scope)
+    if not chunks:
+        return {"status": "error", "message": "Không thể xử lý Youtube URL"}, 500
+
+    for chunk in chunks:
+        if chunk.get("chunk_scope") is None:
+            return {"status": "error", "message": "Chunk scope không hợp lệ"}, 400
+        if key:
+            chunk["source_key"] = key
+    # Cùng URL đã được ingest với nội dung khác (transcript đổi, cách chunk đổi): thay bản cũ
+    result = get_db().replace_source(chunks, progress=_job_progress(job, "embedding"))
+    forget_replaced_sources(result, scope, key)
+    if key and not result.get("errors"):
+        sources.add(key, scope, {"first_chunk": chunks[0], "num_chunks": len(chunks), "title": title})
+    return _ingest_response(chunks[0], len(chunks), message)
+
+
+def ingest_youtube_many(urls, scope, job=None):
+    """Ingest nhiều video (URL video và/hoặc playlist) trong một request.
+
+    Transcript được lấy song song; chunk của các video được gom chung thành cửa sổ
+    INGEST_WINDOW chunk trước khi embed + ghi, nên batch của mô hình luôn đầy kể cả khi
+    mỗi video chỉ có vài chunk. Mỗi video có trạng thái riêng trong response, video lỗi
+    không làm dừng các video khác.
+    """
+    message = "Youtube transcript added successfully"
+    urls, playlist_errors = expand_youtube_urls(urls)
+    if len(urls) > MAX_YOUTUBE_URLS:
+        return {"status": "error", "message": f"Tối đa {MAX_YOUTUBE_URLS} video mỗi request"}, 400
+
+    videos = {}
+    for url, error in playlist_errors.items():
+        videos[url] = {"url": url, "status": "error", "message": f"Không đọc được playlist: {error}"}
+    pending = []
+    for url in urls:
+        reused = reuse_source(youtube_source_key(url), scope, url, message)
+        if reused is not None:
+            content = reused[0]
+            videos[url] = {"url": url, "status": content["status"], "num_chunks": content["num_chunks"],
+                           "deduplicated": content["deduplicated"]}
+        else:
+            pending.append(url)
+
+    db = get_db()
+    # url → {"key", "title", "num_chunks", "first_chunk", "failed"} của các video đã lấy được transcript
+    written = {}
+    buffer = []
+    chunk_ids = []
+    fetched = 0
+    total_chunks = 0
+
+    def flush():
+        result = db.add_chunks(buffer)
+        chunk_ids.extend(result["chunk_ids"])
+        if result.get("errors"):
+            for chunk in buffer:
+                written[chunk["chunk_source"]]["failed"] = True
+        buffer.clear()
+
+    if job is not None:
+        job.progress("fetching", 0, len(pending))
+    for url, chunks, title in iter_process_youtube(pending, scope):
+        fetched += 1
+        if not chunks:
+            videos[url] = {"url": url, "status": "error", "message": "Không thể xử lý Youtube URL"}
+        else:
+            key = youtube_source_key(url)
+            if key:
+                for chunk in chunks:
+                    chunk["source_key"] = key
+            written[url] = {"key": key, "title": title, "num_chunks": len(chunks), "first_chunk": chunks[0], "failed": False}
+            total_chunks += len(chunks)
+            buffer.extend(chunks)
+            if len(buffer) >= INGEST_WINDOW:
+                flush()
+        if job is not None:
+            job.progress("fetching", fetched, len(pending))
+    if buffer:
+        flush()
+
+    for url, info in written.items():
+        if info["failed"]:
+            videos[url] = {"url": url, "status": "error", "message": "Không ghi được chunk vào DB", "title": info["title"]}
+            continue
+        # Bỏ chunk cũ của cùng URL không còn trong bản vừa ghi
+        forget_replaced_sources(db.delete_source(scope, url, keep_ids=chunk_ids), scope, info["key"])
+        if info["key"]:
+            sources.add(info["key"], scope, {k: info[k] for k in ("first_chunk", "num_chunks", "title")})
+        content, _ = _ingest_response(info["first_chunk"], info["num_chunks"], message)
+        videos[url] = {"url": url, "status": content["status"], "num_chunks": info["num_chunks"], "title": info["title"]}
+
+    # Giữ thứ tự như trong request (playlist không đọc được đứng trước)
+    ordered = [videos[url] for url in list(playlist_errors) + urls]
+    failed = sum(1 for video in ordered if video["status"] == "error")
+    if failed == len(ordered):
+        status, status_code = "error", 500
+    else:
+        status, status_code = ("partial" if failed else "success"), 200
+    return {
+        "status": status,
+        "message": f"{len(ordered) - failed}/{len(ordered)} video added",
+        "num_videos": len(ordered),
+        "num_chunks": total_chunks,
+        "videos": ordered,
+    }, status_code
+
+
+def ingest_pdf(file_path, filename, scope, job=None, sha256=None):
+    """Đọc PDF đã lưu, chunk, embed và ghi vào DB. Trả về (nội dung response, status code).
+
+    Các trang được đọc song song và chunk được embed + ghi theo từng cửa sổ trong khi
+    các trang sau vẫn đang được đọc; tiến độ là số trang đã đọc / tổng số trang.
+    PDF có cùng nội dung (sha256) đã được ingest thì không đọc lại.
+    """
+    message = f"PDF '{filename}' added successfully"
+    key = pdf_source_key(sha256 or file_sha256(file_path))
+    reused = reuse_source(key, scope, file_path, message)
+    if reused is not None:
+        return reused
+
+    db = get_db()
+    failed = False
+    first_chunk = None
+    num_chunks = 0
+    chunk_ids = []
+    pages = [0]
+    job_progress = _job_progress(job, "ingesting")
+
+    def pages_progress(done, total):
+        pages[0] = done
+        if job_progress:
+            job_progress(done, total)
+
+    started = time.perf_counter()
+    try:
+        for window in iter_chunk_windows(iter_process_pdf(file_path, scope, pages_progress)):
+            for chunk in window:
+                chunk["source_key"] = key
+            result = db.add_chunks(window)
+            chunk_ids.extend(result["chunk_ids"])
+            failed = bool(result.get("errors")) or failed
+            if first_chunk is None:
+                # token_ids chỉ dùng để embed, không đưa vào response / registry nguồn
+                first_chunk = {k: v for k, v in window[0].items() if k != "token_ids"}
+            num_chunks += len(window)
+    except Exception as e:
+        logger.exception("pdf ingestion failed", extra={"pdf": filename, "scope": scope})
+        return {"status": "error", "message": f"Không thể xử lý PDF: {e}", "num_chunks": num_chunks}, 500
+    elapsed = time.perf_counter() - started
+    _PDF_PAGES.inc(pages[0])
+    if pages[0] and elapsed > 0:
+        _PDF_PAGES_PER_SECOND.observe(pages[0] / elapsed)
+    if not num_chunks:
+        return {"status": "error", "message": "Không thể xử lý PDF"}, 500
+
+    if not failed:
+        # File cùng tên được upload lại với nội dung khác: xóa chunk của bản cũ
+        forget_replaced_sources(db.delete_source(scope, file_path, keep_ids=chunk_ids), scope, key)
+        sources.add(key, scope, {"first_chunk": first_chunk, "num_chunks": num_chunks, "title": filename})
+    return _ingest_response(first_chunk, num_chunks, message)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serialize bằng orjson (nếu có), dùng cho kết quả search."""
+
+    def render(self, content):
+        return dumps(content)
+
+
+def search_options(json_data):
+    """Đọc các tùy chọn rút gọn response của search; None nếu request không dùng tùy chọn nào.
+
+    ``k`` (số kết quả mỗi trang), ``offset`` (phân trang), ``snippet`` (trả đoạn text quanh
+    chỗ khớp kèm vị trí highlight thay vì cả chunk), ``fields`` (chỉ trả các trường này).
+    """
+    if not any(name in json_data for name in ("k", "offset", "snippet", "fields")):
+        return None
+    k = json_data.get("k", 5)
+    offset = json_data.get("offset", 0)
+    fields = json_data.get("fields")
+    if type(k) is not int or not 1 <= k <= MAX_SEARCH_K:
+        raise HTTPException(status_code=400, detail=f"'k' phải là số nguyên trong [1, {MAX_SEARCH_K}]")
+    if type(offset) is not int or not 0 <= offset <= MAX_SEARCH_OFFSET:
+        raise HTTPException(status_code=400, detail=f"'offset' phải là số nguyên trong [0, {MAX_SEARCH_OFFSET}]")
+    if not isinstance(json_data.get("snippet", False), bool):
+        raise HTTPException(status_code=400, detail="'snippet' phải là true/false")
+    if fields is not None and (
+        not isinstance(fields, list) or not fields or not all(field in HIT_FIELDS for field in fields)
+    ):
+        raise HTTPException(status_code=400, detail=f"'fields' phải là danh sách con của {list(HIT_FIELDS)}")
+    return {"k": k, "offset": offset, "snippet": json_data.get("snippet", False), "fields": fields}
+
+
+def search_deadline(json_data):
+    """"deadline_ms" của request search đổi ra giây; None nếu client không gửi."""
+    deadline_ms = json_data.get("deadline_ms")
+    if deadline_ms is None:
+        return None
+    if type(deadline_ms) not in (int, float) or not 0 < deadline_ms < float("inf"):
+        raise HTTPException(status_code=400, detail="'deadline_ms' phải là số dương")
+    return deadline_ms / 1000
+
+
+def _fetch_k(options):
+    # Lấy dư một kết quả để biết còn trang sau hay không
+    return options["offset"] + options["k"] + 1 if options else 5
+
+
+def search_response(results, query, options):
+    if options is None:
+        return FastJSONResponse(content=results)
+    content, next_offset = shape_results(results, query, **options)
+    headers = {"X-Next-Offset": str(next_offset)} if next_offset is not None else None
+    return FastJSONResponse(content=content, headers=headers)
+
+
+# Định dạng streaming của search: NDJSON (mỗi dòng một JSON) hoặc server-sent events
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def _stream_event(fmt, event, data):
+    payload = dumps(data).decode("utf-8")
+    if fmt == "sse":
+        return f"event: {event}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+def stream_search(db, query, scope, mod, fmt, deadline_s=None, options=None):
+    """Sinh từng sự kiện ``scope`` (kết quả của một scope, scope của người gọi trước) rồi ``done``."""
+    started = time.perf_counter()
+    scopes = 0
+    try:
+        for sc, hits in db.iter_search(query, scope, mod, k=_fetch_k(options), deadline_s=deadline_s):
+            scopes += 1
+            if options:
+                hits, _ = shape_hits(hits, query, **options)
+            yield _stream_event(fmt, "scope", {"scope": sc, "results": hits})
+    except Exception as e:
+        logger.exception("stream search failed", extra={"scope": scope, "mode": mod})
+        yield _stream_event(fmt, "error", {"status": "error", "message": str(e)})
+        return
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    yield _stream_event(fmt, "done", {"done": True, "scopes": scopes, "elapsed_ms": elapsed_ms})
+
+
+def run_ingestion(kind, fn, run_async=True):
+    """Xếp ingestion vào hàng đợi và trả job id ngay, hoặc chạy luôn nếu run_async=False.
+
+    Trả về (nội dung response, status code).
+    """
+    if not run_async:
+        return fn(None)
+    try:
+        job = jobs.submit(kind, lambda job: fn(job)[0])
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"status": "queued", "job_id": job.id, "status_url": f"/jobs/{job.id}"}, 202
+
 
+# Hàm sync: FastAPI chạy trong threadpool, nên các request search/ingest chạy song song thay
+# vì lần lượt trên event loop (và query embedding của chúng được gom batch với nhau)
 @app.post("/")
-async def aggregate_function(file: UploadFile = File(...)):
+def aggregate_function(file: UploadFile = File(...)):
     if not file.filename.endswith(".json"):
         raise HTTPException(status_code=400, detail="File cần phải có định dạng .json!")
 
+    # mode chỉ nhận các giá trị cố định để số label của histogram không tăng theo input
+    started = time.perf_counter()
+    mode = "other"
     try:
-        contents = await file.read()
+        contents = file.file.read()
         json_data = json.loads(contents.decode("utf-8"))
 
         # Kiểm tra trường "user"
@@ -141,24 +611,19 @@ async def aggregate_function(file: UploadFile = File(...)):
         if not user:
             raise HTTPException(status_code=400, detail="Missing 'user' field in JSON")
 
-        # Tạo salted_user: username + phần đầu của sha256(username) sao cho đủ 20 kí tự
-        hash_hex = hashlib.sha256(user.encode("utf-8")).hexdigest()
-        if len(user) >= 20:
-            salted_user = user[:20]
-        else:
-            needed = 20 - len(user)
-            salted_user = user + hash_hex[:needed]
-
-        # Tạo folder cho user bên trong CACHE_DIR
-        user_dir = os.path.join(CACHE_DIR, salted_user)
-        os.makedirs(user_dir, exist_ok=True)
+        # Tạo salted_user và folder cho user bên trong CACHE_DIR
+        salted_user = salt_user(user)
+        user_dir = user_dir_for(salted_user)
 
         # Gán lại scope = original_scope + "_" + salted_user
         original_scope = json_data.get("scope", "")
         new_scope = f"{original_scope}_{salted_user}"
 
-        print("Dữ liệu nhận được:", json_data)
-        print(f"Salted user: {salted_user}, New scope: {new_scope}")
+        # Chỉ log các key và kích thước, không bao giờ log nội dung (có thể là cả file PDF base64)
+        logger.debug(
+            "request received",
+            extra={"user": salted_user, "scope": new_scope, "keys": sorted(json_data), "bytes": len(contents)},
+        )
 
         # Khởi tạo kết quả mặc định (chỉ trả về các key trong JSON và số lượng key)
         result = {
@@ -166,40 +631,36 @@ async def aggregate_function(file: UploadFile = File(...)):
             "num_keys": len(json_data)
         }
 
+        if any(action in json_data for action in ("add", "delete", "search")):
+            require_ready()
+
         if "add" in json_data:
+            # Mặc định xử lý nền và trả job id ngay; "async": false để chờ kết quả như trước
+            run_async = json_data.get("async", True) is not False
             if json_data["add"] == "youtube":
+                mode = "add_youtube"
                 # Xử lý YouTube với new_scope
-                chunks, title = process_youtube(json_data["data"], new_scope)
-                if not chunks:
-                    return JSONResponse(
-                        content={"status": "error", "message": "Không thể xử lý Youtube URL"},
-                        status_code=500
-                    )
-
-                for chunk in chunks:
-                    if chunk.get("chunk_scope") is None:
-                        raise HTTPException(status_code=400, detail="Chunk scope không hợp lệ")
-                    db.add_chunk(chunk)
-
-                if len(chunks) < 2:
-                    return JSONResponse(
-                        content={
-                            "status": "warning",
-                            "message": "Độ dài transcript quá ngắn, có thể không đầy đủ hoặc bị lỗi.",
-                            "first_chunk": chunks[0] if chunks else None
-                        },
-                        status_code=200
+                url = json_data["data"]
+                # Danh sách URL hoặc URL playlist: lấy song song, trạng thái riêng cho từng video
+                if isinstance(url, list) or youtube_playlist_id(url):
+                    urls = url if isinstance(url, list) else [url]
+                    if not urls or not all(isinstance(u, str) for u in urls):
+                        raise HTTPException(status_code=400, detail="'data' phải là URL hoặc danh sách URL")
+                    content, status_code = run_ingestion(
+                        "youtube", lambda job: ingest_youtube_many(urls, new_scope, job), run_async
                     )
-
-                return JSONResponse(
-                    content={
-                        "status": "success",
-                        "message": "Youtube transcript added successfully",
-                        "first_chunk": chunks[0]
-                    }
+                    return JSONResponse(content=content, status_code=status_code)
+                # Video đã có trong scope thì trả kết quả cũ ngay, không tạo job
+                existing = existing_source(youtube_source_key(url), new_scope, "Youtube transcript added successfully")
+                if existing is not None:
+                    return JSONResponse(content=existing[0], status_code=existing[1])
+                content, status_code = run_ingestion(
+                    "youtube", lambda job: ingest_youtube(url, new_scope, job), run_async
                 )
+                return JSONResponse(content=content, status_code=status_code)
 
             elif json_data["add"] == "pdf":
+                mode = "add_pdf"
                 # 1. Giải mã base64
                 pdf_bytes = base64.b64decode(json_data["data"])
 
@@ -207,38 +668,21 @@ async def aggregate_function(file: UploadFile = File(...)):
                 filename = json_data.get("filename", "uploaded.pdf")
                 file_path = os.path.join(user_dir, filename)
 
+                # PDF cùng nội dung đã có trong scope thì trả kết quả cũ ngay, không ghi file
+                pdf_sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+                existing = existing_source(pdf_source_key(pdf_sha256), new_scope, f"PDF '{filename}' added successfully")
+                if existing is not None:
+                    return JSONResponse(content=existing[0], status_code=existing[1])
+
                 # 3. Ghi nội dung ra file
                 with open(file_path, "wb") as f:
                     f.write(pdf_bytes)
 
                 # 4. Gọi process_pdf với đường dẫn file và new_scope
-                chunks, title = process_pdf(pdf_path=file_path, scope=new_scope)
-                if not chunks:
-                    return JSONResponse(
-                        content={"status": "error", "message": "Không thể xử lý PDF"},
-                        status_code=500
-                    )
-
-                for chunk in chunks:
-                    db.add_chunk(chunk)
-
-                if len(chunks) < 2:
-                    return JSONResponse(
-                        content={
-                            "status": "warning",
-                            "message": "Độ dài transcript quá ngắn, có thể không đầy đủ hoặc bị lỗi.",
-                            "first_chunk": chunks[0] if chunks else None
-                        },
-                        status_code=200
-                    )
-
-                return JSONResponse(
-                    content={
-                        "status": "success",
-                        "message": f"PDF '{filename}' added successfully",
-                        "first_chunk": chunks[0]
-                    }
+                content, status_code = run_ingestion(
+                    "pdf", lambda job: ingest_pdf(file_path, filename, new_scope, job, pdf_sha256), run_async
                 )
+                return JSONResponse(content=content, status_code=status_code)
 
             else:
                 return JSONResponse(
@@ -246,20 +690,201 @@ async def aggregate_function(file: UploadFile = File(...)):
                     status_code=400
                 )
 
+        elif "delete" in json_data:
+            mode = "delete"
+            db = get_db()
+            if json_data["delete"] == "scope":
+                # Xóa cả scope của user (mọi nguồn trong scope)
+                removed = db.delete_scope(new_scope)
+                sources.remove_scope(new_scope)
+                return {"status": "success", "deleted": removed["deleted"]}
+
+            if json_data["delete"] == "youtube":
+                chunk_source = json_data.get("data")
+            elif json_data["delete"] == "pdf":
+                # chunk_source của PDF là đường dẫn file trong folder của user
+                filename = json_data.get("filename") or ""
+                chunk_source = os.path.join(user_dir, filename)
+                if not filename or os.path.dirname(os.path.abspath(chunk_source)) != os.path.abspath(user_dir):
+                    raise HTTPException(status_code=400, detail="Tên file không hợp lệ")
+            else:
+                return JSONResponse(content={"status": "error", "message": "Invalid delete type"}, status_code=400)
+            if not chunk_source:
+                raise HTTPException(status_code=400, detail="Missing 'data' field")
+
+            removed = db.delete_source(new_scope, chunk_source)
+            forget_replaced_sources(removed, new_scope, None)
+            if json_data["delete"] == "pdf" and os.path.exists(chunk_source):
+                os.remove(chunk_source)
+            return {"status": "success", "deleted": removed["deleted"]}
+
         elif "search" in json_data:
             # Gán lại new_scope cho search
             mod = json_data.get("mod", "word")
-            if mod not in ["word", "semantic"]:
+            if mod not in ["word", "semantic", "hybrid"]:
                 raise HTTPException(status_code=400, detail="Invalid search mode")
+            mode = mod
+
+            db = get_db()
+            options = search_options(json_data)
+            k = _fetch_k(options)
+            # deadline_ms: thời gian tối đa cho cả lượt truy vấn các scope
+            deadline_s = search_deadline(json_data)
+
+            # "stream": "ndjson" | "sse" → trả kết quả từng scope ngay khi scope đó xong
+            stream = json_data.get("stream")
+            if stream:
+                if stream not in STREAM_MEDIA_TYPES:
+                    raise HTTPException(status_code=400, detail="'stream' phải là 'ndjson' hoặc 'sse'")
+                if mod == "hybrid" or json_data.get("merge") == "global" or not isinstance(json_data["search"], str):
+                    raise HTTPException(status_code=400, detail="Streaming chỉ hỗ trợ một truy vấn word/semantic theo scope")
+                mode = f"stream_{mod}"
+                return StreamingResponse(
+                    stream_search(db, json_data["search"], new_scope, mod, stream, deadline_s, options),
+                    media_type=STREAM_MEDIA_TYPES[stream],
+                )
 
-            if mod == "word":
-                tmp = db.word_search(json_data["search"], new_scope)
-                return tmp
+            # Danh sách truy vấn: embed chung một batch, mỗi collection chỉ được truy vấn một lần;
+            # trả về danh sách kết quả theo đúng thứ tự truy vấn
+            if isinstance(json_data["search"], list):
+                queries = json_data["search"]
+                if not queries or not all(isinstance(query, str) for query in queries):
+                    raise HTTPException(status_code=400, detail="'search' phải là chuỗi hoặc danh sách chuỗi")
+                if len(queries) > MAX_BATCH_QUERIES:
+                    raise HTTPException(status_code=400, detail=f"Tối đa {MAX_BATCH_QUERIES} truy vấn mỗi request")
+                mode = f"batch_{mod}"
+                batch = db.batch_search(
+                    queries, new_scope, k=k, mod=mod, merge=json_data.get("merge"), deadline_s=deadline_s
+                )
+                if options:
+                    batch = [shape_results(results, query, **options)[0] for results, query in zip(batch, queries)]
+                return FastJSONResponse(content=batch)
+
+            # "merge": "global" → một top-k chung cho mọi scope thay vì dict theo scope
+            if json_data.get("merge") == "global":
+                result = db.global_search(json_data["search"], new_scope, k=k, mod=mod, deadline_s=deadline_s)
+            elif mod == "word":
+                result = db.word_search(json_data["search"], new_scope, k=k, deadline_s=deadline_s)
+            elif mod == "hybrid":
+                result = db.hybrid_search(json_data["search"], new_scope, k=k, deadline_s=deadline_s)
             else:
-                return db.semantic_search(json_data["search"], new_scope)
+                result = db.semantic_search(json_data["search"], new_scope, k=k, deadline_s=deadline_s)
+            return search_response(result, json_data["search"], options)
 
         # Nếu không phải "add" hay "search", trả về thông tin về keys
         return JSONResponse(content=result)
 
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Nội dung không phải là JSON hợp lệ")
+    finally:
+        _REQUEST_SECONDS.labels(mode).observe(time.perf_counter() - started)
+
+
+def _form_bool(value, name):
+    normalized = value.strip().lower()
+    if normalized in ("1", "true", "yes", "on"):
+        return True
+    if normalized in ("0", "false", "no", "off"):
+        return False
+    raise HTTPException(status_code=400, detail=f"'{name}' phải là true/false")
+
+
+@app.post("/upload/pdf")
+async def upload_pdf(request: Request):
+    """Upload PDF dạng multipart (binary), không cần base64 trong JSON.
+
+    Field: ``file`` (PDF), ``user``, ``scope``, ``async``. Body được parse ngay trong lúc
+    nhận: file được ghi thẳng vào một file tạm riêng theo từng khối UPLOAD_CHUNK_SIZE và
+    sha256 được tính trong lúc ghi. Request bị từ chối (413) khi Content-Length hoặc số
+    byte đã nhận vượt quá giới hạn, nên cả bộ nhớ lẫn đĩa dùng cho mỗi upload đều bị chặn.
+    """
+    require_ready()
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"File vượt quá {MAX_UPLOAD_BYTES} bytes")
+    started = time.perf_counter()
+    try:
+        receiver = PdfUploadReceiver(request.headers.get("content-type", ""), CACHE_DIR, MAX_UPLOAD_BYTES)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    try:
+        buffer = bytearray()
+        async for block in request.stream():
+            buffer += block
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                # Ghi đĩa trong threadpool để không chặn event loop
+                await run_in_threadpool(receiver.write, bytes(buffer))
+                buffer.clear()
+        await run_in_threadpool(receiver.write, bytes(buffer))
+        upload = await run_in_threadpool(receiver.finish)
+
+        user = upload["fields"].get("user")
+        if not user:
+            raise HTTPException(status_code=400, detail="Missing 'user' field")
+        run_async = _form_bool(upload["fields"].get("async", "true"), "async")
+        salted_user = salt_user(user)
+        new_scope = f"{upload['fields'].get('scope', '')}_{salted_user}"
+        filename = sanitize_filename(os.path.basename(upload["filename"] or "")) or "uploaded.pdf"
+        file_path = os.path.join(user_dir_for(salted_user), filename)
+        os.replace(upload["tmp_path"], file_path)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    finally:
+        receiver.cleanup()
+
+    pdf_sha256 = upload["sha256"]
+    existing = existing_source(pdf_source_key(pdf_sha256), new_scope, f"PDF '{filename}' added successfully")
+    if existing is not None:
+        content, status_code = existing
+    else:
+        # "async": false chạy ingestion ngay, trong threadpool để không chặn event loop
+        content, status_code = await run_in_threadpool(
+            run_ingestion, "pdf", lambda job: ingest_pdf(file_path, filename, new_scope, job, pdf_sha256), run_async
+        )
+    content.update({"filename": filename, "size": upload["size"], "sha256": pdf_sha256})
+    _REQUEST_SECONDS.labels("upload_pdf").observe(time.perf_counter() - started)
+    return JSONResponse(content=content, status_code=status_code)
+
+
+@app.get("/stats")
+def stats():
+    # Thống kê cache để chọn kích thước phù hợp
+    require_ready()
+    db = get_db()
+    return {
+        "query_cache": db.query_cache_stats(),
+        "result_cache": db.result_cache_stats(),
+        "query_batcher": db.query_batcher.stats(),
+        "ingest_queue": jobs.queue_size(),
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Trạng thái, tiến độ và kết quả của một job ingestion."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job không tồn tại")
+    return job.to_dict()
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: tiến trình còn chạy và event loop còn phản hồi."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 khi DB và mô hình đã nạp xong và đã warmup, 503 nếu chưa (hoặc lỗi)."""
+    return JSONResponse(content=dict(_startup), status_code=200 if _startup["status"] == "ready" else 503)
+
+
+@app.get("/metrics")
+def metrics():
+    """Metric theo định dạng text của Prometheus (histogram theo từng giai đoạn, số scope/chunk).
+
+    Hàm sync: gauge số chunk đếm trên Chroma, nên chạy trong threadpool thay vì chặn event loop.
+    """
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """LRU cache trong bộ nhớ, an toàn khi dùng từ nhiều thread, có đếm hit/miss."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = max(0, maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def json_size(value: Any) -> int:
+    """Kích thước ước lượng (byte) của một giá trị theo độ dài JSON."""
+    return len(json.dumps(value, ensure_ascii=False, default=str))
+
+
+class TTLCache:
+    """LRU cache có TTL và giới hạn tổng kích thước, an toàn khi dùng từ nhiều thread.
+
+    Mỗi entry hết hạn sau ``ttl_s`` giây; entry cũ nhất bị loại khi vượt ``maxsize``
+    entry hoặc ``max_bytes`` (ước lượng bằng ``sizeof``). ``get`` nhận thêm hàm kiểm
+    tra: entry không còn hợp lệ (vd. dữ liệu nguồn đã đổi) bị xóa và tính là miss.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_s: float = 60.0,
+        sizeof: Callable[[Any], int] = json_size,
+    ):
+        self.maxsize = max(0, maxsize)
+        self.max_bytes = max(0, max_bytes)
+        self.ttl_s = ttl_s
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.stale = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, is_valid: Optional[Callable[[Any], bool]] = None) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at, _ = entry
+                if time.monotonic() >= expires_at:
+                    self.expired += 1
+                    self._remove(key)
+                elif is_valid is not None and not is_valid(value):
+                    self.stale += 1
+                    self._remove(key)
+                else:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize == 0 or self.ttl_s <= 0:
+            return
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, time.monotonic() + self.ttl_s, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, size = self._data.pop(key)
+        self.bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+            self.hits = self.misses = self.expired = self.stale = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,126 @@
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from search_module.utilities.metrics import METRICS
+
+_CHUNK_TOKENIZE_SECONDS = METRICS.histogram(
+    "chunk_tokenize_seconds", "Thời gian tokenize một trang / transcript khi chunk theo token (giây)"
+)
+
+# Thư mục tokenizer đi kèm repo (cùng tokenizer mà mô hình embedding dùng)
+TOKENIZER_PATH = "./tokenizer"
+
+# Cách chia chunk: "tokens" (theo số token của tokenizer) hoặc "words" (theo số từ như trước)
+CHUNK_MODE = "tokens"
+
+# Số token tối đa mỗi chunk, tính cả [CLS] và [SEP] (không vượt quá giới hạn của mô hình)
+CHUNK_TOKENS = 256
+
+# Số token chunk sau lặp lại từ cuối chunk trước (0 = không chồng lấn)
+CHUNK_OVERLAP_TOKENS = 0
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """Tokenizer dùng chung, chỉ được nạp (và import transformers) ở lần chunk đầu tiên."""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                from transformers import AutoTokenizer
+
+                _tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_PATH)
+    return _tokenizer
+
+
+def chunk_params(chunk_size: int) -> Dict[str, Any]:
+    """Tham số chia chunk cho registry nguồn; chế độ "words" giữ nguyên khóa cũ."""
+    if CHUNK_MODE == "words":
+        return {"chunk_size": chunk_size}
+    return {"chunker": "tokens", "max_tokens": CHUNK_TOKENS, "overlap": CHUNK_OVERLAP_TOKENS}
+
+
+class TokenChunker:
+    """Chia text thành chunk theo ngân sách token, mỗi trang / transcript chỉ tokenize một lần.
+
+    Chunk chỉ bị cắt ở ranh giới từ (theo pre-tokenizer) nên text của chunk tokenize lại
+    cho đúng các token id đã tính; token id (đã gồm [CLS]/[SEP]) được trả kèm chunk để
+    embed thẳng bằng ONNX mà không tokenize lần nữa.
+    """
+
+    def __init__(self, tokenizer=None, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS):
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.max_tokens = min(max_tokens, self.tokenizer.model_max_length, 512)
+        # Số token nội dung, trừ phần token đặc biệt được thêm vào mỗi chunk
+        self.budget = self.max_tokens - self.tokenizer.num_special_tokens_to_add()
+        if self.budget < 1:
+            raise ValueError(f"max_tokens quá nhỏ: {max_tokens}")
+        if not 0 <= overlap < self.budget:
+            raise ValueError(f"overlap phải nằm trong [0, {self.budget})")
+        self.overlap = overlap
+
+    def _windows(self, word_ids: List[Optional[int]]) -> Iterator[Tuple[int, int]]:
+        """Các khoảng token [start, end) dài tối đa budget, cắt ở ranh giới từ nếu có thể."""
+        n = len(word_ids)
+
+        def word_start(i):
+            return i == 0 or i >= n or word_ids[i] != word_ids[i - 1]
+
+        start = 0
+        while start < n:
+            end = min(start + self.budget, n)
+            cut = end
+            while cut > start and not word_start(cut):
+                cut -= 1
+            # Một từ dài hơn cả ngân sách thì đành cắt giữa từ
+            end = cut if cut > start else end
+            yield start, end
+            if end >= n:
+                return
+            next_start = max(end - self.overlap, start + 1)
+            while next_start < end and not word_start(next_start):
+                next_start += 1
+            start = next_start
+
+    def chunk_spans(self, spans: Sequence[Tuple[Any, str]]) -> Iterator[Dict[str, Any]]:
+        """Nối các đoạn (location, text) (vd. các câu transcript) rồi chia theo token.
+
+        Mỗi chunk có ``text`` (cắt từ text gốc), ``location`` của đoạn chứa token đầu tiên
+        và ``token_ids``.
+        """
+        parts = []
+        starts = []
+        offset = 0
+        for _, text in spans:
+            starts.append(offset)
+            parts.append(text)
+            offset += len(text) + 1
+        text = " ".join(parts)
+        if not text.strip():
+            return
+
+        with _CHUNK_TOKENIZE_SECONDS.time():
+            encoding = self.tokenizer(
+                text, add_special_tokens=False, return_offsets_mapping=True, truncation=False, verbose=False
+            )
+        ids = encoding["input_ids"]
+        offsets = encoding["offset_mapping"]
+        word_ids = encoding.word_ids()
+
+        span = 0
+        for start, end in self._windows(word_ids):
+            char_start = offsets[start][0]
+            while span + 1 < len(starts) and starts[span + 1] <= char_start:
+                span += 1
+            yield {
+                "text": text[char_start:offsets[end - 1][1]],
+                "location": spans[span][0],
+                "token_ids": self.tokenizer.build_inputs_with_special_tokens(ids[start:end]),
+            }
+
+    def chunk_pages(self, pages_text) -> Iterator[Dict[str, Any]]:
+        """Chunk theo từng trang (chunk không vượt qua ranh giới trang), location là số trang."""
+        for page_num, text in pages_text:
+            yield from self.chunk_spans([(page_num, text)])
@@ -0,0 +1,182 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+from typing import Any, Callable, Dict, Optional
+
+from search_module.utilities.db_helper import SHARD_COUNT, VectorDatabase
+from search_module.utilities.keyword_index import KEYWORD_INDEX_PATH
+
+# Số bản ghi đọc/ghi mỗi lần khi dựng lại một collection
+COMPACT_PAGE_SIZE = 1000
+
+# Tiền tố tên collection tạm trong lúc dựng lại (tên tạm ngắn, cố định theo tên gốc)
+COMPACT_PREFIX = "compact_"
+
+# File (trong storage) ghi collection tạm → collection gốc, để lần chạy bị ngắt được tiếp tục
+COMPACT_STATE_FILE = "compact_state.json"
+
+_SEGMENT_DIR_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def temp_name(name: str) -> str:
+    """Tên collection tạm: tên gốc (có thể rất dài) được thay bằng hash ngắn."""
+    return COMPACT_PREFIX + hashlib.sha256(name.encode("utf-8")).hexdigest()[:16]
+
+
+def _load_state(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(path: str, state: Dict[str, str]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _copy_collection(source, target, page_size: int) -> int:
+    copied = 0
+    offset = 0
+    while True:
+        page = source.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not len(page["ids"]):
+            return copied
+        target.upsert(
+            ids=page["ids"], documents=page["documents"], embeddings=page["embeddings"], metadatas=page["metadatas"]
+        )
+        copied += len(page["ids"])
+        offset += len(page["ids"])
+
+
+def _remove_orphan_segments(storage_path: str) -> int:
+    """Xóa thư mục segment HNSW không còn thuộc collection nào (Chroma để lại khi xóa collection)."""
+    with sqlite3.connect(os.path.join(storage_path, "chroma.sqlite3")) as con:
+        live = {row[0] for row in con.execute("SELECT id FROM segments")}
+    removed = 0
+    for name in os.listdir(storage_path):
+        path = os.path.join(storage_path, name)
+        if _SEGMENT_DIR_RE.match(name) and os.path.isdir(path) and name not in live:
+            shutil.rmtree(path)
+            removed += 1
+    return removed
+
+
+def _vacuum(storage_path: str) -> None:
+    con = sqlite3.connect(os.path.join(storage_path, "chroma.sqlite3"))
+    try:
+        con.execute("VACUUM")
+    finally:
+        con.close()
+
+
+def compact_storage(
+    storage_path: str = "./vector_storage",
+    keyword_index_path: str = KEYWORD_INDEX_PATH,
+    page_size: int = COMPACT_PAGE_SIZE,
+    progress: Optional[Callable[[str, int], None]] = None,
+) -> Dict[str, Any]:
+    """Dựng lại mọi collection, dọn segment mồ côi và VACUUM sqlite; trả về dung lượng thu hồi.
+
+    Chroma không thu hồi chỗ của bản ghi đã xóa (index HNSW chỉ đánh dấu xóa), nên mỗi
+    collection được chép sang một collection mới rồi đổi tên lại; index từ khóa của mỗi
+    scope cũng được dựng lại từ dữ liệu còn sống. Chạy khi server đã dừng: id collection
+    thay đổi nên tiến trình đang chạy sẽ giữ handle cũ. Bị ngắt giữa chừng thì chạy lại
+    là an toàn. progress(tên collection, số bản ghi đã chép).
+    """
+    bytes_before = dir_size(storage_path) + dir_size(keyword_index_path)
+    layout = "sharded" if os.path.exists(os.path.join(storage_path, "layout.json")) else "per_scope"
+    shard_count = SHARD_COUNT
+    if layout == "sharded":
+        with open(os.path.join(storage_path, "layout.json"), encoding="utf-8") as f:
+            shard_count = json.load(f)["shard_count"]
+    db = VectorDatabase(
+        storage_path=storage_path,
+        layout=layout,
+        shard_count=shard_count,
+        embedding_cache_path=None,
+        keyword_index_path=keyword_index_path,
+    )
+    report: Dict[str, Any] = {"layout": layout, "collections": 0, "records": 0, "mismatched": []}
+
+    state_path = os.path.join(storage_path, COMPACT_STATE_FILE)
+    state = _load_state(state_path)
+    names = [getattr(col, "name", col) for col in db.client.list_collections()]
+    # Lần chạy trước bị ngắt: bản tạm đã đủ dữ liệu khi bản gốc đã bị xóa, ngược lại thì bỏ bản tạm
+    for temp, original in state.items():
+        if temp not in names:
+            continue
+        if original in names:
+            db.client.delete_collection(temp)
+        else:
+            db.client.get_collection(temp).modify(name=original)
+    _save_state(state_path, {})
+    names = [getattr(col, "name", col) for col in db.client.list_collections()]
+
+    for name in names:
+        temp = temp_name(name)
+        # Ghi lại ánh xạ trước khi tạo bản tạm
+        _save_state(state_path, {temp: name})
+        source = db.client.get_collection(name, embedding_function=db.embedding_fn)
+        target = db.client.create_collection(
+            temp, metadata=source.metadata or None, embedding_function=db.embedding_fn
+        )
+        copied = _copy_collection(source, target, page_size)
+        if target.count() != source.count():
+            db.client.delete_collection(temp)
+            report["mismatched"].append(name)
+            continue
+        db.client.delete_collection(name)
+        target.modify(name=name)
+        report["collections"] += 1
+        report["records"] += copied
+        if progress:
+            progress(name, copied)
+    os.remove(state_path)
+
+    # Index từ khóa: log chỉ ghi thêm nên vẫn giữ bản ghi của chunk đã xóa
+    for scope in db.refresh_scopes():
+        db.keyword_index.drop(scope)
+        db._ensure_keyword_index(scope, db.get_collection_by_scope(scope))
+
+    report["orphan_segments"] = _remove_orphan_segments(storage_path)
+    _vacuum(storage_path)
+    bytes_after = dir_size(storage_path) + dir_size(keyword_index_path)
+    report.update({
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "reclaimed_bytes": bytes_before - bytes_after,
+    })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dựng lại vector storage và index từ khóa để thu hồi chỗ của dữ liệu đã xóa.")
+    parser.add_argument("--storage-path", default="./vector_storage")
+    parser.add_argument("--keyword-index-path", default=KEYWORD_INDEX_PATH)
+    parser.add_argument("--page-size", type=int, default=COMPACT_PAGE_SIZE)
+    args = parser.parse_args()
+
+    report = compact_storage(args.storage_path, args.keyword_index_path, args.page_size)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
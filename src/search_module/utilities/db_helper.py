@@ -1,61 +1,363 @@
 import os,json
+import copy
+import hashlib
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from itertools import islice
 import numpy as np
 import onnxruntime
-from transformers import AutoTokenizer
-from typing import List, Dict, Any
-from chromadb import PersistentClient
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
+from search_module.utilities.cache import LRUCache, TTLCache
+from search_module.utilities.fanout import FANOUT_WORKERS, SEARCH_DEADLINE_S, ScopeFanout
+from search_module.utilities.embedding_cache import EMBEDDING_CACHE_PATH, EmbeddingCache, content_hash
+from search_module.utilities.keyword_index import KEYWORD_INDEX_PATH, KeywordIndex
+from search_module.utilities.metrics import BATCH_SIZE_BUCKETS, METRICS, Histogram
+from search_module.utilities.sharding import ScopedCollection, ScopeLog, check_layout, shard_index, shard_name
 
 
+
+logger = logging.getLogger(__name__)
+
+_TOKENIZE_SECONDS = METRICS.histogram("embedding_tokenize_seconds", "Thời gian tokenize một lượt embed (giây)")
+_INFERENCE_SECONDS = METRICS.histogram("onnx_inference_seconds", "Thời gian một lần chạy ONNX (giây)")
+_INFERENCE_BATCH_SIZE = METRICS.histogram(
+    "onnx_inference_batch_size", "Số text trong một lần chạy ONNX", BATCH_SIZE_BUCKETS
+)
+_CHROMA_SECONDS = METRICS.histogram(
+    "chroma_operation_seconds", "Thời gian gọi Chroma theo thao tác (giây)", labelnames=("op",)
+)
+
 # Đường dẫn lưu trữ tokenizer và mô hình ONNX
 TOKENIZER_PATH = "./tokenizer"
 ONNX_MODEL_PATH = "./onnx_model/model.onnx"
 
+# Bản INT8 (tạo bằng `python -m search_module.utilities.quantize`), bật bằng USE_QUANTIZED_MODEL
+ONNX_QUANTIZED_MODEL_PATH = "./onnx_model/model.int8.onnx"
+USE_QUANTIZED_MODEL = False
+
+# Kiểu dữ liệu của vector trong cache embedding trên đĩa ("float16" giảm một nửa dung lượng)
+EMBEDDING_CACHE_DTYPE = "float32"
+
+# Số chunk đưa vào ONNX trong một lần inference khi thêm hàng loạt
+EMBED_BATCH_SIZE = 32
+
+# Số text được sắp xếp theo độ dài cùng lúc trước khi chia thành các batch ONNX
+EMBED_SORT_WINDOW = 256
+
+# Cấu hình ONNX Runtime: số thread (0 = để ONNX Runtime tự chọn) và mức tối ưu đồ thị
+ONNX_INTRA_OP_THREADS = 0
+ONNX_INTER_OP_THREADS = 0
+ONNX_GRAPH_OPTIMIZATION = "all"  # "disable" | "basic" | "extended" | "all"
+
+_GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+# Micro-batching: số text tối đa mỗi lần inference và thời gian chờ gom thêm request (ms)
+BATCHER_MAX_BATCH_SIZE = 32
+BATCHER_MAX_WAIT_MS = 5.0
+
+# Số embedding của câu truy vấn gần đây được giữ lại trong bộ nhớ
+QUERY_CACHE_SIZE = 1024
+
+# Cache kết quả search: số entry, tổng kích thước ước lượng (byte) và thời gian sống (giây).
+# Entry còn bị loại ngay khi một scope nó đã đọc có dữ liệu mới (version của scope tăng).
+RESULT_CACHE_SIZE = 2048
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_TTL_S = 60.0
+
+# Cách lưu trữ: "per_scope" (mỗi scope một collection) hoặc "sharded" (SHARD_COUNT collection
+# cố định, scope là metadata và mọi truy vấn được lọc bằng where). Chuyển dữ liệu cũ sang
+# layout shard bằng `python -m search_module.utilities.migrate_layout`.
+STORAGE_LAYOUT = "per_scope"
+SHARD_COUNT = 16
+
+# Hằng số k của reciprocal-rank fusion trong tìm kiếm hybrid
+RRF_K = 60
+
+# Độ dài (số từ) của các text giả dùng để warmup mô hình trước khi nhận request
+WARMUP_TEXT_LENGTHS = (8, 64, 256)
+
+# Sau bao lâu (giây) danh sách scope được đọc lại từ Chroma, để thấy scope do tiến trình khác tạo
+SCOPE_REGISTRY_TTL_S = 30.0
+
 class LocalEmbeddingFunction:
-    """Custom embedding function dùng mô hình local (offline) với ONNX."""
+    """Custom embedding function dùng mô hình local (offline) với ONNX.
 
-    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    Text được sắp xếp theo số token rồi chia thành các batch có độ dài gần nhau, nên
+    một chunk dài không bắt mọi chunk ngắn phải pad theo. Vector là trung bình các
+    token thật (bỏ qua padding theo attention mask).
+    """
+
+    # Đổi giá trị này khi cách tính vector thay đổi để cache embedding cũ không bị dùng lại
+    POOLING = "masked-mean"
+
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        batch_size: int = EMBED_BATCH_SIZE,
+        intra_op_threads: int = ONNX_INTRA_OP_THREADS,
+        inter_op_threads: int = ONNX_INTER_OP_THREADS,
+        optimization_level: str = ONNX_GRAPH_OPTIMIZATION,
+        quantized: bool = USE_QUANTIZED_MODEL,
+    ):
         # Tải tokenizer từ thư mục nếu đã có
         if not os.path.exists(TOKENIZER_PATH):
             raise ValueError(f"Tokenizer không tìm thấy tại {TOKENIZER_PATH}")
         
         # Tải mô hình ONNX từ thư mục nếu đã có
-        if not os.path.exists(ONNX_MODEL_PATH):
-            raise ValueError(f"Mô hình ONNX không tìm thấy tại {ONNX_MODEL_PATH}")
-        
-        # Load mô hình ONNX và tokenizer
-        self.session = onnxruntime.InferenceSession(ONNX_MODEL_PATH)
+        self.model_path = ONNX_QUANTIZED_MODEL_PATH if quantized else ONNX_MODEL_PATH
+        if not os.path.exists(self.model_path):
+            hint = " (chạy `python -m search_module.utilities.quantize` để tạo)" if quantized else ""
+            raise ValueError(f"Mô hình ONNX không tìm thấy tại {self.model_path}{hint}")
+        if optimization_level not in _GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"optimization_level không hợp lệ: {optimization_level}")
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = _GRAPH_OPTIMIZATION_LEVELS[optimization_level]
+
+        # Load mô hình ONNX và tokenizer (transformers chỉ được import khi thật sự cần)
+        from transformers import AutoTokenizer
+
+        self.session = onnxruntime.InferenceSession(self.model_path, sess_options=options)
         self.tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_PATH)
+        self.batch_size = max(1, batch_size)
+        # Tên input của mô hình chỉ cần đọc một lần
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = min(self.tokenizer.model_max_length, 512)
+        self._model_version: Optional[str] = None
+
+    @property
+    def model_version(self) -> str:
+        """Định danh phiên bản mô hình (hash file ONNX + cách pooling), dùng làm namespace cho cache embedding."""
+        if self._model_version is None:
+            digest = hashlib.sha256()
+            with open(self.model_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            self._model_version = f"{digest.hexdigest()[:16]}-{self.POOLING}"
+        return self._model_version
 
     def __call__(self, input: List[str]) -> List[List[float]]:
-        # Tạo input cho mô hình
-        inputs = self.tokenizer(input, padding=True, truncation=True, return_tensors="np")
-        
-        # Lấy các input hợp lệ từ mô hình ONNX
-        ort_inputs = {k: v for k, v in inputs.items() if k in [i.name for i in self.session.get_inputs()]}
-        
+        return self.embed(input)
+
+    def tokenize(self, texts: List[str]) -> List[List[int]]:
+        """Token id (gồm [CLS]/[SEP], không pad, cắt ở max_length) của từng text."""
+        if not texts:
+            return []
+        with _TOKENIZE_SECONDS.time():
+            return self.tokenizer(list(texts), truncation=True, max_length=self.max_length, padding=False)["input_ids"]
+
+    def embed(self, texts: List[str], batch_size: Optional[int] = None) -> List[List[float]]:
+        """Tokenize (không pad) rồi embed theo các batch cùng độ dài."""
+        if not texts:
+            return []
+        return self.embed_token_ids(self.tokenize(texts), batch_size)
+
+    def embed_token_ids(self, token_ids: List[List[int]], batch_size: Optional[int] = None) -> List[List[float]]:
+        """Embed các dãy token id đã có (đã gồm [CLS]/[SEP]), giữ nguyên thứ tự đầu vào."""
+        batch_size = max(1, batch_size or self.batch_size)
+        order = sorted(range(len(token_ids)), key=lambda i: len(token_ids[i]))
+        embeddings: List[Optional[List[float]]] = [None] * len(token_ids)
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            vectors = self._run([token_ids[i] for i in bucket])
+            for i, vector in zip(bucket, vectors):
+                embeddings[i] = vector
+        return embeddings  # type: ignore[return-value]
+
+    def _run(self, token_ids: List[List[int]]) -> List[List[float]]:
+        # Pad đến độ dài dài nhất trong batch (các dãy đã được sắp gần bằng nhau)
+        length = max(len(ids) for ids in token_ids)
+        input_ids = np.zeros((len(token_ids), length), dtype=np.int64)
+        attention_mask = np.zeros((len(token_ids), length), dtype=np.int64)
+        for row, ids in enumerate(token_ids):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+        inputs = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.zeros_like(input_ids),
+        }
+        ort_inputs = {k: v for k, v in inputs.items() if k in self.input_names}
+
         # Chạy inference và lấy kết quả
-        ort_outs = self.session.run(None, ort_inputs)
-        
-        # Tính toán embeddings bằng cách sử dụng mean pooling
-        embeddings = np.mean(ort_outs[0], axis=1)
-        
+        _INFERENCE_BATCH_SIZE.observe(len(token_ids))
+        with _INFERENCE_SECONDS.time():
+            hidden = self.session.run(None, ort_inputs)[0]
+
+        # Mean pooling chỉ trên các token thật
+        mask = attention_mask[:, :, None].astype(hidden.dtype)
+        embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
         return embeddings.tolist()
 
 
+class EmbeddingBatcher:
+    """Gom text từ nhiều caller đồng thời thành một batch ONNX rồi trả vector về từng caller.
+
+    Một thread nền lấy request đầu tiên trong hàng đợi; nếu đang có request khác chờ thì
+    gom thêm trong tối đa ``max_wait_ms`` (hoặc tới khi đủ ``max_batch_size`` text), nếu
+    không thì chạy ngay. Request tới trong lúc inference đang chạy được gom vào batch sau.
+    Phân bố kích thước batch và thời gian chờ trong hàng đợi được ghi vào histogram.
+    """
+
+    def __init__(
+        self,
+        embedding_fn: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = BATCHER_MAX_BATCH_SIZE,
+        max_wait_ms: float = BATCHER_MAX_WAIT_MS,
+    ):
+        self.embedding_fn = embedding_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram()
+        self.inference_ms = Histogram()
+        self._queue: "queue.Queue[Tuple[List[str], Future, float]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, texts: List[str]) -> "Future[List[List[float]]]":
+        """Xếp texts vào hàng đợi, trả về Future của danh sách vector tương ứng."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+        future: "Future[List[List[float]]]" = Future()
+        self._queue.put((list(texts), future, time.monotonic()))
+        return future
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        return self.submit(input).result()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            "inference_ms": self.inference_ms.snapshot(),
+        }
+
+    def _collect(self) -> List[Tuple[List[str], Future, float]]:
+        requests = [self._queue.get()]
+        size = len(requests[0][0])
+        if self._queue.empty():
+            # Không có ai chờ cùng: chờ thêm chỉ làm tăng độ trễ
+            return requests
+        deadline = time.monotonic() + self.max_wait_s
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            requests.append(item)
+            size += len(item[0])
+        return requests
+
+    def _run(self) -> None:
+        while True:
+            requests = self._collect()
+            started = time.monotonic()
+            texts = [text for request_texts, _, _ in requests for text in request_texts]
+            for _, _, submitted in requests:
+                self.queue_wait_ms.observe((started - submitted) * 1000)
+            self.batch_sizes.observe(len(texts))
+            try:
+                # Request lớn có thể làm batch vượt max_batch_size, chia nhỏ khi chạy inference
+                vectors: List[List[float]] = []
+                for start in range(0, len(texts), self.max_batch_size):
+                    vectors.extend(self.embedding_fn(texts[start:start + self.max_batch_size]))
+            except Exception as e:
+                for _, future, _ in requests:
+                    future.set_exception(e)
+                continue
+            self.inference_ms.observe((time.monotonic() - started) * 1000)
+            offset = 0
+            for request_texts, future, _ in requests:
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
 
 class VectorDatabase:
     """Vector DB cho dữ liệu chunk hóa, dùng Chroma + offline embedding."""
 
-    def __init__(self, storage_path: str = "./vector_storage"):
+    def __init__(
+        self,
+        storage_path: str = "./vector_storage",
+        layout: str = STORAGE_LAYOUT,
+        shard_count: int = SHARD_COUNT,
+        embed_batch_size: int = EMBED_BATCH_SIZE,
+        query_cache_size: int = QUERY_CACHE_SIZE,
+        result_cache_size: int = RESULT_CACHE_SIZE,
+        result_cache_max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        result_cache_ttl_s: float = RESULT_CACHE_TTL_S,
+        embedding_cache_path: Optional[str] = EMBEDDING_CACHE_PATH,
+        embedding_cache_dtype: str = EMBEDDING_CACHE_DTYPE,
+        quantized: bool = USE_QUANTIZED_MODEL,
+        keyword_index_path: str = KEYWORD_INDEX_PATH,
+        fanout_workers: int = FANOUT_WORKERS,
+        search_deadline_s: Optional[float] = SEARCH_DEADLINE_S,
+        batcher_max_batch_size: int = BATCHER_MAX_BATCH_SIZE,
+        batcher_max_wait_ms: float = BATCHER_MAX_WAIT_MS,
+    ):
+        if layout not in ("per_scope", "sharded"):
+            raise ValueError(f"layout không hợp lệ: {layout}")
+        self.layout = layout
+        self.shard_count = max(1, shard_count)
+        # Layout shard: registry scope là file log, số shard được ghi lại để không bị đổi nhầm
+        self._scope_log: Optional[ScopeLog] = None
+        if layout == "sharded":
+            check_layout(storage_path, self.shard_count)
+            self._scope_log = ScopeLog(os.path.join(storage_path, "sharded_scopes.jsonl"))
+
+        # Import chromadb ở đây thay vì đầu module: import mất gần 1 giây
+        from chromadb import PersistentClient
+
         self.client = PersistentClient(path=storage_path)
-        self.embedding_fn = LocalEmbeddingFunction()
+        self.embedding_fn = LocalEmbeddingFunction(quantized=quantized)
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.query_cache = LRUCache(query_cache_size)
+        self.result_cache = TTLCache(result_cache_size, result_cache_max_bytes, result_cache_ttl_s)
+        # Embed câu truy vấn qua batcher để các request search đồng thời dùng chung inference
+        self.query_batcher = EmbeddingBatcher(self.embedding_fn, batcher_max_batch_size, batcher_max_wait_ms)
+        # embedding_cache_path=None để tắt cache embedding trên đĩa
+        self.embedding_cache = None
+        if embedding_cache_path:
+            self.embedding_cache = EmbeddingCache(
+                embedding_cache_path, self.embedding_fn.model_version, embedding_cache_dtype
+            )
+        self.keyword_index = KeywordIndex(keyword_index_path)
+        self.fanout = ScopeFanout(fanout_workers, search_deadline_s)
+
+        # Registry scope và cache handle collection, tránh list_collections/get_or_create mỗi request
+        self._registry_lock = threading.Lock()
+        self._scopes: Dict[str, None] = {}
+        # Scope tạo trong tiến trình này từ lần đọc registry trước (có thể chưa kịp có trong danh sách)
+        self._new_scopes: Dict[str, None] = {}
+        self._scopes_loaded_at: Optional[float] = None
+        self._collections: Dict[str, Any] = {}
+        self._shards: Dict[int, Any] = {}
+        # Version của từng scope, tăng sau mỗi lần ghi để cache kết quả biết dữ liệu đã đổi
+        self._scope_versions: Dict[str, int] = {}
         self.collection = self.client.get_or_create_collection(
             name="media_vectors",
             embedding_function=self.embedding_fn
         )
 
-    def get_all_scopes(self) -> List[str]:
+    def _list_scope_collections(self) -> Optional[List[str]]:
+        """Danh sách scope hiện có; None nếu không đọc được."""
+        if self._scope_log is not None:
+            return self._scope_log.scopes()
         scopes: List[str] = []
         try:
             names = self.client.list_collections()  # → Sequence[str] ở chroma≥0.6.0
@@ -69,133 +371,924 @@ class VectorDatabase:
                 if collection_name and collection_name.startswith("scope_"):
                     scopes.append(collection_name[len("scope_"):])
         except Exception as e:
-            print(f"Error listing collections: {e}")
+            logger.warning("list collections failed", extra={"error": str(e)})
+            return None
         return scopes
 
+    def refresh_scopes(self) -> List[str]:
+        """Đọc lại danh sách scope từ Chroma.
+
+        Scope bị tiến trình khác xóa thì bỏ khỏi registry (và bỏ handle collection cũ);
+        chỉ giữ thêm các scope tạo trong tiến trình này từ lần đọc trước.
+        """
+        scopes = self._list_scope_collections()
+        with self._registry_lock:
+            if scopes is not None:
+                self._scopes = dict.fromkeys(scopes) | self._new_scopes
+                self._new_scopes = {}
+                for scope in [sc for sc in self._collections if sc not in self._scopes]:
+                    del self._collections[scope]
+            self._scopes_loaded_at = time.monotonic()
+            return list(self._scopes)
+
+    def get_all_scopes(self) -> List[str]:
+        loaded_at = self._scopes_loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > SCOPE_REGISTRY_TTL_S:
+            return self.refresh_scopes()
+        with self._registry_lock:
+            return list(self._scopes)
+
+    def _shard(self, index: int):
+        collection = self._shards.get(index)
+        if collection is None:
+            collection = self.client.get_or_create_collection(
+                name=shard_name(index),
+                embedding_function=self.embedding_fn
+            )
+            self._shards[index] = collection
+        return collection
 
     def get_collection_by_scope(self, scope: str):
-        """Tạo hoặc lấy collection theo scope."""
-        return self.client.get_or_create_collection(
-            name=f"scope_{scope}",
-            embedding_function=self.embedding_fn
-        )
+        """Tạo hoặc lấy collection theo scope (handle được cache, scope mới được ghi vào registry).
+
+        Ở layout shard, kết quả là một ScopedCollection: shard chứa scope, lọc theo scope.
+        """
+        collection = self._collections.get(scope)
+        if collection is None:
+            if self._scope_log is not None:
+                shard = self._shard(shard_index(scope, self.shard_count))
+                collection = ScopedCollection(shard, [scope], on_write=self._scope_log.add)
+            else:
+                collection = self.client.get_or_create_collection(
+                    name=f"scope_{scope}",
+                    embedding_function=self.embedding_fn
+                )
+            with self._registry_lock:
+                self._collections[scope] = collection
+                self._scopes[scope] = None
+                self._new_scopes[scope] = None
+        return collection
+
+    def _bump_scope_version(self, scope: str) -> None:
+        with self._registry_lock:
+            self._scope_versions[scope] = self._scope_versions.get(scope, 0) + 1
+
+    def _scope_version_snapshot(self, scopes: List[str]) -> Tuple[int, ...]:
+        with self._registry_lock:
+            return tuple(self._scope_versions.get(sc, 0) for sc in scopes)
 
     def add_chunk(self, chunk: Dict[str, Any]) -> Dict[str, Any]:
         """Thêm 1 chunk vào collection tương ứng."""
-        print("chunk:", chunk)
+        token_ids = chunk.get("token_ids")
         if chunk.get("chunk_scope") is None:
-            print("errooorrr: chunk_scope is None.",chunk)
             raise ValueError("chunk_scope is None.")
             # return {"status": "error", "message": "chunk_scope is None."}
         try:
             scope = f"scope_{chunk['chunk_scope']}"
             # scope = chunk.get("chunk_scope")
             collection = self.get_collection_by_scope(scope)
-            print("collection name:", collection.name)
-            print("chunk:", chunk)
             chunk_text = chunk.get("text", "")
             if not chunk_text.strip():
-                print("errooorrr: Empty text.")
+                logger.warning("skip empty chunk", extra={"scope": scope, "chunk_id": chunk.get("chunk_id")})
                 return {"status": "error", "message": "Empty text."}
 
-            chunk_id = f"{scope}_{chunk.get('chunk_id')}_{hash(chunk_text)}"
-
-            chunk_metadata = {
-                "location": chunk.get("location"),
-                "chunk_source": chunk.get("chunk_source"),
-                "chunk_scope": chunk.get("chunk_scope"),
-                "chunk_source_type": chunk.get("chunk_source_type"),
-                "chunk_id": chunk.get("chunk_id"),
-            }
-            print("chunk_metadata:", chunk_metadata)
-            collection.add(
-                documents=[chunk_text],
-                metadatas=[chunk_metadata],
-                ids=[chunk_id]
-            )
-            print("add chunk_id ok:", chunk_id)
+            chunk_id = self._chunk_id(scope, chunk)
+            chunk_metadata = self._chunk_metadata(chunk)
+            embeddings = self.embed_texts([chunk_text], token_ids=[token_ids])
+            try:
+                with _CHROMA_SECONDS.labels("upsert").time():
+                    collection.upsert(
+                        documents=[chunk_text],
+                        embeddings=embeddings,
+                        metadatas=[chunk_metadata],
+                        ids=[chunk_id]
+                    )
+            finally:
+                self._bump_scope_version(scope)
+            self._ensure_keyword_index(scope, collection)
+            self.keyword_index.add(scope, [chunk_id], [chunk_text])
+            logger.debug("chunk added", extra={"scope": scope, "chunk_id": chunk_id})
             return {"status": "success", "chunk_id": chunk_id}
 
         except Exception as e:
-            print("Error adding chunk:", e)
+            logger.exception("add chunk failed", extra={"scope": chunk.get("chunk_scope")})
             return {"status": "error", "message": str(e)}
 
-    def semantic_search(self, query: str, scope: str, k: int = 5) -> Dict[str, List[Dict[str, Any]]]:
-        """Tìm kiếm semantic vector embedding trên nhiều scope cùng lúc."""
-        results_by_scope = {}
+    def add_chunks(
+        self,
+        chunks: List[Dict[str, Any]],
+        batch_size: Optional[int] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> Dict[str, Any]:
+        """Thêm nhiều chunk cùng lúc: gom theo scope, embed theo batch, mỗi scope một lần ghi.
 
-        # Lấy danh sách tất cả các scope (giả sử bạn có method này)
-        all_scopes = self.get_all_scopes()  # ví dụ trả về ['scope1', 'scope2', ...]
+        progress(done, total) được gọi sau mỗi batch embed với số chunk đã xử lý.
+        ``token_ids`` do chunker tính sẵn (nếu có) chỉ được dùng để embed, không ghi vào
+        metadata; chunk của người gọi không bị sửa.
+        """
+        batch_size = max(1, batch_size or self.embed_batch_size)
 
-        # Đảm bảo scope hiện tại nằm đầu tiên (tùy chọn)
-        scope = f"scope_{scope}"
-        ordered_scopes = [scope] + [s for s in all_scopes if s != scope]
+        # Gom chunk theo scope, giữ nguyên thứ tự xuất hiện
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        group_token_ids: Dict[str, List[Optional[List[int]]]] = {}
+        skipped = 0
+        for chunk in chunks:
+            if chunk.get("chunk_scope") is None:
+                raise ValueError("chunk_scope is None.")
+            token_ids = chunk.get("token_ids")
+            if not chunk.get("text", "").strip():
+                skipped += 1
+                continue
+            scope = f"scope_{chunk['chunk_scope']}"
+            groups.setdefault(scope, []).append(chunk)
+            group_token_ids.setdefault(scope, []).append(token_ids)
 
-        for sc in ordered_scopes:
+        chunk_ids: List[str] = []
+        errors: Dict[str, str] = {}
+        total = sum(len(group) for group in groups.values())
+        done = 0
+        for scope, group in groups.items():
             try:
-                collection = self.get_collection_by_scope(sc)
-                res = collection.query(
-                    query_texts=[query],
-                    n_results=k,
-                    include=["documents", "metadatas", "distances"]
-                )
-                chunks = []
-                for doc, meta, distance in zip(
-                    res["documents"][0],
-                    res["metadatas"][0],
-                    res["distances"][0]
-                ):
-                    chunks.append({
-                        "text": doc,
-                        "location": meta.get("location"),
-                        "chunk_id": meta.get("chunk_id"),
-                        "chunk_source": meta.get("chunk_source"),
-                        "chunk_scope": meta.get("chunk_scope"),
-                        "chunk_source_type": meta.get("chunk_source_type"),
-                        "similarity_score": round(1 - distance, 4)
-                    })
-                results_by_scope[sc] = chunks
+                collection = self.get_collection_by_scope(scope)
+                texts = [chunk["text"] for chunk in group]
+                ids = [self._chunk_id(scope, chunk) for chunk in group]
+                metadatas = [self._chunk_metadata(chunk) for chunk in group]
 
+                group_progress = None
+                if progress:
+                    group_progress = lambda n, _, offset=done: progress(offset + n, total)
+                embeddings = self.embed_texts(texts, batch_size, group_progress, group_token_ids[scope])
+
+                # Chroma giới hạn số bản ghi mỗi lần ghi, chỉ chia nhỏ khi vượt giới hạn này.
+                # Id ổn định theo nội dung nên upsert giúp việc upload lại không tạo bản trùng.
+                max_write = self.client.get_max_batch_size()
+                try:
+                    for start in range(0, len(ids), max_write):
+                        end = start + max_write
+                        with _CHROMA_SECONDS.labels("upsert").time():
+                            collection.upsert(
+                                documents=texts[start:end],
+                                embeddings=embeddings[start:end],
+                                metadatas=metadatas[start:end],
+                                ids=ids[start:end]
+                            )
+                finally:
+                    self._bump_scope_version(scope)
+                self._ensure_keyword_index(scope, collection)
+                self.keyword_index.add(scope, ids, texts)
+                chunk_ids.extend(ids)
             except Exception as e:
-                # Nếu lỗi thì vẫn báo về scope đó
-                results_by_scope[sc] = [{"status": "error", "message": str(e)}]
+                logger.exception("add chunks failed", extra={"scope": scope, "chunks": len(group)})
+                errors[scope] = str(e)
+            done += len(group)
 
-        return results_by_scope
+        result: Dict[str, Any] = {
+            "status": "error" if errors and not chunk_ids else "success",
+            "added": len(chunk_ids),
+            "skipped": skipped,
+            "chunk_ids": chunk_ids,
+        }
+        if errors:
+            result["errors"] = errors
+        return result
 
+    def copy_source(
+        self, source_key: str, from_chunk_scope: str, to_chunk_scope: str, chunk_source: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Chép mọi chunk của một nguồn (vector, text, metadata) từ scope này sang scope khác.
 
-    def word_search(self, query: str, scope: str, k: int = 5) -> Dict[str, List[Dict[str, Any]]]:
-        """Tìm kiếm theo từ khóa (exact match) trên nhiều scope cùng lúc."""
-        results_by_scope = {}
-        all_scopes = self.get_all_scopes()  # ví dụ ['scope1', 'scope2', ...]
+        Không đọc lại nguồn và không embed lại. chunk_source (vd. tên file mới) thay cho
+        giá trị cũ nếu được truyền. Trả về số chunk đã chép, id của chúng trong scope đích và
+        chunk đầu tiên (chunk_id nhỏ nhất).
+        """
+        source = self.get_collection_by_scope(f"scope_{from_chunk_scope}")
+        scope = f"scope_{to_chunk_scope}"
+        target = self.get_collection_by_scope(scope)
+        self._ensure_keyword_index(scope, target)
+        page_size = self.client.get_max_batch_size()
+        copied_ids: List[str] = []
+        first_chunk = None
+        offset = 0
+        try:
+            while True:
+                with _CHROMA_SECONDS.labels("get").time():
+                    page = source.get(
+                        where={"source_key": source_key},
+                        include=["embeddings", "documents", "metadatas"],
+                        limit=page_size,
+                        offset=offset,
+                    )
+                if not len(page["ids"]):
+                    break
+                offset += len(page["ids"])
+                metadatas = []
+                for meta in page["metadatas"]:
+                    meta = dict(meta, chunk_scope=to_chunk_scope)
+                    if chunk_source:
+                        meta["chunk_source"] = chunk_source
+                    metadatas.append(meta)
+                # Metadata đã mang chunk_id và chunk_source (mới) nên id khớp với khi add_chunks nguồn đó
+                ids = [self._chunk_id(scope, dict(meta, text=doc)) for meta, doc in zip(metadatas, page["documents"])]
+                with _CHROMA_SECONDS.labels("upsert").time():
+                    target.upsert(
+                        ids=ids, documents=page["documents"], embeddings=page["embeddings"], metadatas=metadatas
+                    )
+                self.keyword_index.add(scope, ids, page["documents"])
+                copied_ids.extend(ids)
+                for doc, meta in zip(page["documents"], metadatas):
+                    if first_chunk is None or (meta.get("chunk_id") or 0) < (first_chunk["chunk_id"] or 0):
+                        first_chunk = self._hit(doc, meta)
+        finally:
+            if copied_ids:
+                self._bump_scope_version(scope)
+        return {"copied": len(copied_ids), "ids": copied_ids, "first_chunk": first_chunk}
 
-        # Ưu tiên scope hiện tại, rồi mới đến các scope khác
-        ordered_scopes = [scope] + [s for s in all_scopes if s != scope]
+    def _has_scope(self, scope: str) -> bool:
+        # Không tạo collection chỉ để xóa; scope do tiến trình khác tạo thì đọc lại registry
+        return scope in self.get_all_scopes() or scope in self.refresh_scopes()
 
-        for sc in ordered_scopes:
-            try:
-                collection = self.get_collection_by_scope(sc)
-                all_docs = collection.get()
-                hits = []
-                for doc, meta in zip(all_docs["documents"], all_docs["metadatas"]):
-                    if query.lower() in doc.lower():
-                        hits.append({
-                            "text": doc,
-                            "location": meta.get("location"),
-                            "chunk_id": meta.get("chunk_id"),
-                            "chunk_source": meta.get("chunk_source"),
-                            "chunk_scope": meta.get("chunk_scope"),
-                            "chunk_source_type": meta.get("chunk_source_type")
-                        })
-                        if len(hits) >= k:
+    def delete_source(
+        self, chunk_scope: str, chunk_source: str, keep_ids: Optional[Iterable[str]] = None
+    ) -> Dict[str, Any]:
+        """Xóa mọi chunk có chunk_source đã cho trong scope, trừ các id trong keep_ids.
+
+        Dùng keep_ids để thay một nguồn: ghi chunk mới trước, rồi xóa các chunk cũ không
+        còn trong bản mới, nên search không bao giờ thấy nguồn bị thiếu. Trả về số chunk
+        đã xóa và các source_key (registry nguồn) của chúng.
+        """
+        scope = f"scope_{chunk_scope}"
+        if not self._has_scope(scope):
+            return {"deleted": 0, "source_keys": []}
+        collection = self.get_collection_by_scope(scope)
+        with _CHROMA_SECONDS.labels("get").time():
+            found = collection.get(where={"chunk_source": chunk_source}, include=["metadatas"])
+        keep = set(keep_ids or ())
+        ids = [chunk_id for chunk_id in found["ids"] if chunk_id not in keep]
+        source_keys = sorted({
+            meta["source_key"] for chunk_id, meta in zip(found["ids"], found["metadatas"])
+            if chunk_id not in keep and meta and meta.get("source_key")
+        })
+        if not ids:
+            return {"deleted": 0, "source_keys": source_keys}
+
+        max_write = self.client.get_max_batch_size()
+        try:
+            for start in range(0, len(ids), max_write):
+                with _CHROMA_SECONDS.labels("delete").time():
+                    collection.delete(ids=ids[start:start + max_write])
+        finally:
+            self._bump_scope_version(scope)
+        self.keyword_index.delete(scope, ids)
+        logger.info("source deleted", extra={"scope": scope, "chunks": len(ids)})
+        return {"deleted": len(ids), "source_keys": source_keys}
+
+    def replace_source(self, chunks: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        """Ghi chunk của một nguồn rồi xóa các chunk cũ của nguồn đó không còn trong bản mới.
+
+        Mọi chunk phải cùng chunk_scope và chunk_source. Chunk cũ chỉ bị xóa khi ghi
+        thành công, nên lỗi giữa chừng để lại bản cũ thay vì một nguồn rỗng.
+        """
+        pairs = {(chunk.get("chunk_scope"), chunk.get("chunk_source")) for chunk in chunks}
+        if len(pairs) != 1:
+            raise ValueError("replace_source cần chunk của đúng một nguồn trong một scope")
+        result = self.add_chunks(chunks, **kwargs)
+        if not result.get("errors"):
+            chunk_scope, chunk_source = pairs.pop()
+            removed = self.delete_source(chunk_scope, chunk_source, keep_ids=result["chunk_ids"])
+            result["deleted"] = removed["deleted"]
+            result["source_keys"] = removed["source_keys"]
+        return result
+
+    def delete_scope(self, chunk_scope: str) -> Dict[str, Any]:
+        """Xóa toàn bộ một scope: dữ liệu, index từ khóa và mục trong registry scope.
+
+        Ở layout per_scope collection bị xóa hẳn; tiến trình khác còn giữ handle cũ sẽ gặp
+        lỗi với scope này tới khi khởi động lại. Dung lượng trên đĩa chỉ được thu hồi sau
+        khi chạy ``python -m search_module.utilities.compact``.
+        """
+        scope = f"scope_{chunk_scope}"
+        if not self._has_scope(scope):
+            return {"deleted": 0}
+        collection = self.get_collection_by_scope(scope)
+        with _CHROMA_SECONDS.labels("count").time():
+            deleted = collection.count()
+        try:
+            if self._scope_log is not None:
+                with _CHROMA_SECONDS.labels("delete").time():
+                    collection.delete()
+                self._scope_log.remove(scope)
+            else:
+                self.client.delete_collection(f"scope_{scope}")
+        finally:
+            with self._registry_lock:
+                self._collections.pop(scope, None)
+                self._scopes.pop(scope, None)
+                self._new_scopes.pop(scope, None)
+            self._bump_scope_version(scope)
+        self.keyword_index.drop(scope)
+        logger.info("scope deleted", extra={"scope": scope, "chunks": deleted})
+        return {"deleted": deleted}
+
+    def embed_texts(
+        self,
+        texts: List[str],
+        batch_size: Optional[int] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+        token_ids: Optional[List[Optional[List[int]]]] = None,
+    ) -> List[List[float]]:
+        """Embed danh sách text theo batch, bỏ qua ONNX với nội dung đã có trong cache trên đĩa.
+
+        token_ids[i] (nếu có) là token id đã tính sẵn của texts[i]; text không có token id
+        mới phải tokenize.
+        """
+        batch_size = max(1, batch_size or self.embed_batch_size)
+        hashes = [content_hash(text) for text in texts]
+        token_ids = token_ids or [None] * len(texts)
+        vectors: Dict[str, List[float]] = {}
+        if self.embedding_cache is not None:
+            vectors = self.embedding_cache.get_many(hashes)
+
+        # Nội dung trùng nhau trong cùng một lần gọi cũng chỉ embed một lần
+        missing: Dict[str, Tuple[str, Optional[List[int]]]] = {}
+        for key, text, ids in zip(hashes, texts, token_ids):
+            if key not in vectors and key not in missing:
+                missing[key] = (text, ids)
+        missing_keys = list(missing)
+        cached = len(texts) - len(missing_keys)
+        # Gửi cả cửa sổ lớn để engine sắp theo độ dài rồi tự chia batch_size
+        window = max(batch_size, EMBED_SORT_WINDOW)
+        for start in range(0, len(missing_keys), window):
+            keys = missing_keys[start:start + window]
+            untokenized = [key for key in keys if missing[key][1] is None]
+            encoded = dict(zip(untokenized, self.embedding_fn.tokenize([missing[key][0] for key in untokenized])))
+            batch_ids = [missing[key][1] if missing[key][1] is not None else encoded[key] for key in keys]
+            batch_vectors = self.embedding_fn.embed_token_ids(batch_ids, batch_size)
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(keys, batch_vectors)
+            vectors.update(zip(keys, batch_vectors))
+            if progress:
+                progress(min(len(texts), cached + start + len(keys)), len(texts))
+        if progress:
+            progress(len(texts), len(texts))
+
+        return [vectors[key] for key in hashes]
+
+    def _ensure_keyword_index(self, scope: str, collection) -> None:
+        """Dựng index từ khóa một lần cho scope đã có dữ liệu từ trước khi có index."""
+        if self.keyword_index.exists(scope):
+            return
+        self.keyword_index.build(scope, self._iter_documents(collection))
+
+    def _iter_documents(self, collection):
+        page_size = self.client.get_max_batch_size()
+        offset = 0
+        while True:
+            page = collection.get(include=["documents"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                return
+            yield from zip(page["ids"], page["documents"])
+            offset += len(page["ids"])
+
+    @staticmethod
+    def _chunk_id(scope: str, chunk: Dict[str, Any]) -> str:
+        # sha256 của nội dung thay cho hash() (bị salt theo từng tiến trình) để id ổn định qua các lần chạy;
+        # thêm hash của chunk_source để hai nguồn có cùng text ở cùng vị trí không ghi đè lên nhau
+        source = content_hash(chunk.get("chunk_source") or "")[:8]
+        return f"{scope}_{chunk.get('chunk_id')}_{source}_{content_hash(chunk.get('text', ''))[:16]}"
+
+    @staticmethod
+    def _chunk_metadata(chunk: Dict[str, Any]) -> Dict[str, Any]:
+        metadata = {
+            "location": chunk.get("location"),
+            "chunk_source": chunk.get("chunk_source"),
+            "chunk_scope": chunk.get("chunk_scope"),
+            "chunk_source_type": chunk.get("chunk_source_type"),
+            "chunk_id": chunk.get("chunk_id"),
+        }
+        # Khóa nguồn (registry nguồn) để chép chunk của cùng một nguồn sang scope khác
+        if chunk.get("source_key"):
+            metadata["source_key"] = chunk["source_key"]
+        return metadata
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    @classmethod
+    def _cache_query(cls, mod: str, query: str) -> str:
+        # Word search khớp chuỗi con nên khoảng trắng có nghĩa, chỉ bỏ qua hoa thường
+        return cls._normalize_query(query) if mod == "semantic" else query.lower()
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed câu truy vấn, dùng lại kết quả từ LRU cache nếu đã gặp trước đó."""
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed nhiều câu truy vấn; các câu chưa có trong LRU cache được gửi chung một lần qua batcher."""
+        # Tokenizer là uncased nên chữ hoa/thường và khoảng trắng thừa cho cùng một vector
+        keys = [self._normalize_query(query) for query in queries]
+        embeddings: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+        for key, query in zip(keys, queries):
+            embedding = self.query_cache.get(key)
+            if embedding is not None:
+                embeddings[key] = embedding
+            elif key not in missing:
+                missing[key] = query
+        if missing:
+            for key, embedding in zip(missing, self.query_batcher(list(missing.values()))):
+                self.query_cache.put(key, embedding)
+                embeddings[key] = embedding
+        return [embeddings[key] for key in keys]
+
+    def warmup(self) -> float:
+        """Chạy thử inference với vài độ dài text và nạp registry scope, trả về thời gian (ms).
+
+        Lần chạy đầu của ONNX Runtime cấp phát bộ nhớ và chọn kernel cho từng kích thước
+        input; làm trước khi nhận request để request đầu tiên không phải chịu độ trễ này.
+        """
+        start = time.perf_counter()
+        for length in WARMUP_TEXT_LENGTHS:
+            self.embedding_fn.embed(["warmup " * length])
+        self.refresh_scopes()
+        return (time.perf_counter() - start) * 1000
+
+    def counts(self) -> Dict[str, int]:
+        """Số scope và tổng số chunk trên mọi scope."""
+        scopes = self.get_all_scopes()
+        chunks = 0
+        if self._scope_log is not None:
+            for index in range(self.shard_count):
+                with _CHROMA_SECONDS.labels("count").time():
+                    chunks += self._shard(index).count()
+            return {"scopes": len(scopes), "chunks": chunks}
+        for scope in scopes:
+            with _CHROMA_SECONDS.labels("count").time():
+                chunks += self.get_collection_by_scope(scope).count()
+        return {"scopes": len(scopes), "chunks": chunks}
+
+    def result_cache_stats(self) -> Dict[str, Any]:
+        return self.result_cache.stats()
+
+    def query_cache_stats(self) -> Dict[str, Any]:
+        """Số hit/miss của cache embedding câu truy vấn."""
+        return self.query_cache.stats()
+
+    def _ordered_scopes(self, scope: str) -> List[str]:
+        """Danh sách scope cần tìm, scope của người gọi luôn đứng đầu."""
+        all_scopes = self.get_all_scopes()  # ví dụ trả về ['scope1', 'scope2', ...]
+        scope = f"scope_{scope}"
+        return [scope] + [s for s in all_scopes if s != scope]
+
+    @staticmethod
+    def _hit(doc: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "text": doc,
+            "location": meta.get("location"),
+            "chunk_id": meta.get("chunk_id"),
+            "chunk_source": meta.get("chunk_source"),
+            "chunk_scope": meta.get("chunk_scope"),
+            "chunk_source_type": meta.get("chunk_source_type")
+        }
+
+    def _semantic_hits(self, collection, query_embedding: List[float], k: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """Top-k theo vector trong một collection, trả về cặp (id Chroma, kết quả)."""
+        return self._semantic_hits_many(collection, [query_embedding], k)[0]
+
+    def _semantic_hits_many(
+        self, collection, query_embeddings: List[List[float]], k: int
+    ) -> List[List[Tuple[str, Dict[str, Any]]]]:
+        """Top-k cho nhiều vector truy vấn bằng một lần collection.query, mỗi truy vấn một danh sách."""
+        with _CHROMA_SECONDS.labels("query").time():
+            res = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=k,
+                include=["documents", "metadatas", "distances"]
+            )
+        results = []
+        for ids, docs, metas, distances in zip(res["ids"], res["documents"], res["metadatas"], res["distances"]):
+            hits = []
+            for chunk_id, doc, meta, distance in zip(ids, docs, metas, distances):
+                hit = self._hit(doc, meta)
+                hit["similarity_score"] = round(1 - distance, 4)
+                hits.append((chunk_id, hit))
+            results.append(hits)
+        return results
+
+    def _word_hits(self, sc: str, collection, query: str, k: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """Tối đa k chunk chứa query (chuỗi con, không phân biệt hoa thường) trong một scope,
+        trả về cặp (id Chroma, kết quả)."""
+        return self._word_hits_many(sc, collection, [query], k)[0]
+
+    def _word_hits_many(
+        self, sc: str, collection, queries: List[str], k: int
+    ) -> List[List[Tuple[str, Dict[str, Any]]]]:
+        """Như _word_hits cho nhiều truy vấn; mỗi vòng lấy chunk ứng viên của mọi truy vấn bằng một lần get."""
+        self._ensure_keyword_index(sc, collection)
+        hits: List[List[Tuple[str, Dict[str, Any]]]] = [[] for _ in queries]
+        if k <= 0:
+            return hits
+        # Index chỉ thu hẹp ứng viên, text của từng ứng viên được kiểm tra lại như cách quét cũ
+        candidates = [self.keyword_index.candidates(sc, query) for query in queries]
+        needles = [query.lower() for query in queries]
+        batch = [k] * len(queries)
+        max_batch = self.client.get_max_batch_size()
+        pending = list(range(len(queries)))
+        while pending:
+            wanted = {i: list(islice(candidates[i], batch[i])) for i in pending}
+            ids = list(dict.fromkeys(chunk_id for i in pending for chunk_id in wanted[i]))
+            if not ids:
+                break
+            with _CHROMA_SECONDS.labels("get").time():
+                found = collection.get(ids=ids, include=["documents", "metadatas"])
+            by_id = {
+                chunk_id: (doc, meta)
+                for chunk_id, doc, meta in zip(found["ids"], found["documents"], found["metadatas"])
+            }
+            remaining = []
+            for i in pending:
+                for chunk_id in wanted[i]:
+                    doc, meta = by_id.get(chunk_id, (None, None))
+                    if doc is not None and needles[i] in doc.lower():
+                        hits[i].append((chunk_id, self._hit(doc, meta)))
+                        if len(hits[i]) >= k:
                             break
+                # Còn thiếu và index còn ứng viên: vòng sau lấy gấp đôi
+                if len(hits[i]) < k and len(wanted[i]) == batch[i]:
+                    batch[i] = min(batch[i] * 2, max_batch)
+                    remaining.append(i)
+            pending = remaining
+        return hits
 
-                results_by_scope[sc] = hits
+    def _scope_tasks(self, ordered_scopes, search_fn) -> Dict[str, Callable[[], Any]]:
+        def task(sc):
+            return lambda: search_fn(sc, self.get_collection_by_scope(sc))
 
-            except Exception as e:
-                results_by_scope[sc] = [{"status": "error", "message": str(e)}]
+        return {sc: task(sc) for sc in ordered_scopes}
+
+    def _fanout(self, scope: str, search_fn, deadline_s: Optional[float] = None):
+        """Chạy search_fn(sc, collection) trên mọi scope song song, scope của người gọi đứng đầu."""
+        ordered_scopes = self._ordered_scopes(scope)
+        results, errors, timed_out = self.fanout.run(self._scope_tasks(ordered_scopes, search_fn), deadline_s)
+        return ordered_scopes, results, errors, timed_out
+
+    def _fanout_shards(self, scope: str, search_fn, deadline_s: Optional[float] = None):
+        """Layout shard: chạy search_fn(collection) một lần cho mỗi shard, lọc theo mọi scope trong shard.
 
+        Trả về (tên shard theo thứ tự, kết quả theo shard, lỗi theo scope, các scope timed out);
+        shard chứa scope của người gọi đứng đầu.
+        """
+        groups: Dict[int, List[str]] = {}
+        for sc in self._ordered_scopes(scope):
+            groups.setdefault(shard_index(sc, self.shard_count), []).append(sc)
+
+        def task(index, scopes):
+            return lambda: search_fn(ScopedCollection(self._shard(index), scopes))
+
+        tasks = {shard_name(index): task(index, scopes) for index, scopes in groups.items()}
+        results, errors, timed_out = self.fanout.run(tasks, deadline_s)
+        scopes_of = {shard_name(index): scopes for index, scopes in groups.items()}
+        scope_errors = {sc: e for name, e in errors.items() for sc in scopes_of[name]}
+        timed_out_scopes = [sc for name in timed_out for sc in scopes_of[name]]
+        return list(tasks), results, scope_errors, timed_out_scopes
+
+    @staticmethod
+    def _scope_entry(status: str, value: Any) -> List[Dict[str, Any]]:
+        """Kết quả của một scope trong response theo scope: các hit, hoặc một mục lỗi / timeout."""
+        if status == "ok":
+            return [hit for _, hit in value]
+        if status == "error":
+            # Nếu lỗi thì vẫn báo về scope đó
+            return [{"status": "error", "message": str(value)}]
+        return [{"status": "timeout", "message": "Scope không trả kết quả trước deadline"}]
+
+    @classmethod
+    def _by_scope(cls, ordered_scopes, results, errors, timed_out) -> Dict[str, List[Dict[str, Any]]]:
+        results_by_scope = {}
+        for sc in ordered_scopes:
+            if sc in results:
+                results_by_scope[sc] = cls._scope_entry("ok", results[sc])
+            elif sc in errors:
+                results_by_scope[sc] = cls._scope_entry("error", errors[sc])
+            else:
+                results_by_scope[sc] = cls._scope_entry("timeout", None)
         return results_by_scope
 
+    def _cached(self, key: Tuple, scope: str, compute: Callable[[], Any], complete: Callable[[Any], bool]) -> Any:
+        """Trả kết quả từ cache nếu mọi scope nó đã đọc chưa có dữ liệu mới, nếu không thì tính lại.
+
+        Khóa gồm danh sách scope được tìm, nên scope mới xuất hiện cũng làm khóa đổi.
+        Kết quả thiếu (scope lỗi hoặc timed out) không được cache.
+        """
+        return self._cached_many([key], scope, lambda indexes: [compute()], complete)[0]
+
+    def _cached_many(
+        self,
+        keys: List[Tuple],
+        scope: str,
+        compute: Callable[[List[int]], List[Any]],
+        complete: Callable[[Any], bool],
+    ) -> List[Any]:
+        """Như _cached cho nhiều khóa: compute(các vị trí chưa có trong cache) tính chung một lượt.
+
+        Khóa trùng nhau trong cùng lượt chỉ được tính một lần.
+        """
+        ordered_scopes = tuple(self._ordered_scopes(scope))
+        # Lấy version trước khi tìm: dữ liệu được ghi trong lúc tìm sẽ làm entry bị loại
+        versions = self._scope_version_snapshot(list(ordered_scopes))
+        is_valid = lambda entry: entry[0] == self._scope_version_snapshot(list(ordered_scopes))
+        results: List[Any] = [None] * len(keys)
+        missing: Dict[Tuple, List[int]] = {}
+        for i, key in enumerate(keys):
+            if key + (ordered_scopes,) in missing:
+                missing[key + (ordered_scopes,)].append(i)
+                continue
+            cached = self.result_cache.get(key + (ordered_scopes,), is_valid)
+            if cached is not None:
+                results[i] = copy.deepcopy(cached[1])
+            else:
+                missing[key + (ordered_scopes,)] = [i]
+        if missing:
+            computed = compute([indexes[0] for indexes in missing.values()])
+            for (key, indexes), result in zip(missing.items(), computed):
+                if complete(result):
+                    self.result_cache.put(key, (versions, copy.deepcopy(result)))
+                results[indexes[0]] = result
+                for i in indexes[1:]:
+                    results[i] = copy.deepcopy(result)
+        return results
+
+    @staticmethod
+    def _complete_by_scope(results: Dict[str, List[Dict[str, Any]]]) -> bool:
+        return not any(hit.get("status") in ("error", "timeout") for hits in results.values() for hit in hits)
+
+    @staticmethod
+    def _complete_merged(response: Dict[str, Any]) -> bool:
+        return not response["timed_out_scopes"] and "errors" not in response
+
+    def semantic_search(
+        self, query: str, scope: str, k: int = 5, deadline_s: Optional[float] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Tìm kiếm semantic vector embedding trên nhiều scope cùng lúc."""
+        def compute():
+            # Chỉ embed câu truy vấn một lần rồi dùng vector cho mọi collection
+            query_embedding = self.embed_query(query)
+            return self._by_scope(*self._fanout(
+                scope, lambda sc, collection: self._semantic_hits(collection, query_embedding, k), deadline_s
+            ))
+
+        key = ("semantic", self._normalize_query(query), k)
+        return self._cached(key, scope, compute, self._complete_by_scope)
+
+    def word_search(
+        self, query: str, scope: str, k: int = 5, deadline_s: Optional[float] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Tìm kiếm theo từ khóa (exact match: chuỗi con, không phân biệt hoa thường) trên nhiều scope cùng lúc.
+
+        Vd. "earning" và "ning basics" khớp "Machine learning basics", còn "c++" không khớp
+        "I love C programming". Index từ khóa chỉ dùng để thu hẹp các chunk cần kiểm tra.
+        """
+        def compute():
+            return self._by_scope(*self._fanout(
+                scope, lambda sc, collection: self._word_hits(sc, collection, query, k), deadline_s
+            ))
+
+        key = ("word", self._cache_query("word", query), k)
+        return self._cached(key, scope, compute, self._complete_by_scope)
+
+    def iter_search(
+        self, query: str, scope: str, mod: str = "word", k: int = 5, deadline_s: Optional[float] = None
+    ) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """Sinh (scope, kết quả của scope) ngay khi từng scope xong, để trả về dạng streaming.
+
+        Scope của người gọi luôn được sinh đầu tiên (kết quả các scope khác xong trước được
+        giữ lại tới lúc đó), sau đó theo thứ tự hoàn thành. Kết quả giống semantic_search /
+        word_search và dùng chung cache: lượt đã có trong cache được phát lại ngay, lượt đủ
+        mọi scope được ghi vào cache.
+        """
+        if mod not in ("word", "semantic"):
+            raise ValueError(f"mod không hỗ trợ streaming: {mod}")
+        ordered_scopes = tuple(self._ordered_scopes(scope))
+        key = (mod, self._cache_query(mod, query), k, ordered_scopes)
+        versions = self._scope_version_snapshot(list(ordered_scopes))
+        cached = self.result_cache.get(key, lambda entry: entry[0] == self._scope_version_snapshot(list(ordered_scopes)))
+        if cached is not None:
+            yield from copy.deepcopy(cached[1]).items()
+            return
+
+        if mod == "semantic":
+            query_embedding = self.embed_query(query)
+            search_fn = lambda sc, collection: self._semantic_hits(collection, query_embedding, k)
+        else:
+            search_fn = lambda sc, collection: self._word_hits(sc, collection, query, k)
+
+        own = ordered_scopes[0]
+        held: List[str] = []
+        collected: Dict[str, List[Dict[str, Any]]] = {}
+        tasks = self._scope_tasks(ordered_scopes, search_fn)
+        for sc, status, value in self.fanout.iter_completed(tasks, deadline_s):
+            collected[sc] = self._scope_entry(status, value)
+            if own not in collected:
+                held.append(sc)
+                continue
+            for ready in ([own] + held if sc == own else [sc]):
+                yield ready, copy.deepcopy(collected[ready])
+            held = []
+
+        results = {sc: collected[sc] for sc in ordered_scopes}
+        if self._complete_by_scope(results):
+            self.result_cache.put(key, (versions, results))
+
+    def global_search(
+        self, query: str, scope: str, k: int = 5, mod: str = "semantic", deadline_s: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Tìm trên mọi scope song song rồi gộp thành một top-k toàn cục.
+
+        Semantic được xếp theo similarity; từ khóa (không có điểm) theo thứ hạng trong
+        scope, hòa thì scope của người gọi trước. Trả về thêm các scope lỗi/timed out.
+        """
+        if mod == "hybrid":
+            return self.hybrid_search(query, scope, k, deadline_s=deadline_s)
+        key = ("global", mod, self._cache_query(mod, query), k)
+        return self._cached(
+            key, scope, lambda: self._global_search(query, scope, k, mod, deadline_s), self._complete_merged
+        )
+
+    def _global_search(
+        self, query: str, scope: str, k: int, mod: str, deadline_s: Optional[float]
+    ) -> Dict[str, Any]:
+        if mod == "semantic":
+            query_embedding = self.embed_query(query)
+            if self._scope_log is not None:
+                # Top-k toàn cục chỉ cần top-k của từng shard: số truy vấn theo số shard, không theo số scope
+                fanout = self._fanout_shards(
+                    scope, lambda collection: self._semantic_hits(collection, query_embedding, k), deadline_s
+                )
+            else:
+                fanout = self._fanout(
+                    scope, lambda sc, collection: self._semantic_hits(collection, query_embedding, k), deadline_s
+                )
+        else:
+            fanout = self._fanout(scope, lambda sc, collection: self._word_hits(sc, collection, query, k), deadline_s)
+        return self._merge_global(mod, k, *fanout)
+
+    @staticmethod
+    def _merge_global(mod: str, k: int, ordered_scopes, results, errors, timed_out) -> Dict[str, Any]:
+        """Gộp kết quả theo scope (hoặc theo shard) thành một top-k toàn cục."""
+        if mod == "semantic":
+            hits = [hit for sc in ordered_scopes for _, hit in results.get(sc, [])]
+            hits.sort(key=lambda hit: hit["similarity_score"], reverse=True)
+        else:
+            ranked = [
+                (rank, scope_rank, hit)
+                for scope_rank, sc in enumerate(ordered_scopes)
+                for rank, (_, hit) in enumerate(results.get(sc, []))
+            ]
+            ranked.sort(key=lambda item: (item[0], item[1]))
+            hits = [hit for _, _, hit in ranked]
+
+        response: Dict[str, Any] = {"results": hits[:k], "timed_out_scopes": timed_out}
+        if errors:
+            response["errors"] = {sc: str(e) for sc, e in errors.items()}
+        return response
+
+    def hybrid_search(
+        self, query: str, scope: str, k: int = 5, rrf_k: int = RRF_K, deadline_s: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Tìm kiếm kết hợp từ khóa + semantic trong một lượt, gộp bằng reciprocal-rank fusion.
+
+        Hai bộ tìm kiếm dùng chung danh sách scope và collection. Mỗi danh sách được xếp
+        hạng toàn cục (semantic theo similarity, từ khóa theo thứ hạng trong scope rồi thứ
+        tự scope), điểm của một chunk là tổng 1 / (rrf_k + hạng) qua các danh sách chứa nó.
+        """
+        key = ("hybrid", self._cache_query("hybrid", query), k, rrf_k)
+        return self._cached(
+            key, scope, lambda: self._hybrid_search(query, scope, k, rrf_k, deadline_s), self._complete_merged
+        )
+
+    def _hybrid_search(
+        self, query: str, scope: str, k: int, rrf_k: int, deadline_s: Optional[float]
+    ) -> Dict[str, Any]:
+        query_embedding = self.embed_query(query)
+
+        def search_fn(sc, collection):
+            return (
+                self._semantic_hits(collection, query_embedding, k),
+                self._word_hits(sc, collection, query, k),
+            )
+
+        return self._fuse_hybrid(k, rrf_k, *self._fanout(scope, search_fn, deadline_s))
+
+    @staticmethod
+    def _fuse_hybrid(k: int, rrf_k: int, ordered_scopes, results, errors, timed_out) -> Dict[str, Any]:
+        """Gộp (hit semantic, hit từ khóa) của từng scope bằng reciprocal-rank fusion."""
+        semantic: List[Tuple[str, Dict[str, Any]]] = []
+        word: List[Tuple[int, int, str, Dict[str, Any]]] = []
+        for scope_rank, sc in enumerate(ordered_scopes):
+            if sc not in results:
+                continue
+            semantic_hits, word_hits = results[sc]
+            semantic.extend(semantic_hits)
+            for rank, (chunk_id, hit) in enumerate(word_hits):
+                word.append((rank, scope_rank, chunk_id, hit))
+
+        semantic.sort(key=lambda item: item[1]["similarity_score"], reverse=True)
+        word.sort(key=lambda item: (item[0], item[1]))
+
+        fused: Dict[str, Dict[str, Any]] = {}
+        rankings = [("semantic", semantic), ("word", [(chunk_id, hit) for _, _, chunk_id, hit in word])]
+        for name, ranking in rankings:
+            for rank, (chunk_id, hit) in enumerate(ranking, start=1):
+                entry = fused.setdefault(chunk_id, dict(hit, rrf_score=0.0, matched_by=[]))
+                entry.update(hit)
+                entry["rrf_score"] += 1.0 / (rrf_k + rank)
+                entry["matched_by"].append(name)
+
+        results_list = sorted(fused.values(), key=lambda hit: hit["rrf_score"], reverse=True)[:k]
+        for hit in results_list:
+            hit["rrf_score"] = round(hit["rrf_score"], 6)
+        response: Dict[str, Any] = {"results": results_list, "timed_out_scopes": timed_out}
+        if errors:
+            response["errors"] = {sc: str(e) for sc, e in errors.items()}
+        return response
+
+
+    def batch_search(
+        self,
+        queries: List[str],
+        scope: str,
+        k: int = 5,
+        mod: str = "word",
+        merge: Optional[str] = None,
+        rrf_k: int = RRF_K,
+        deadline_s: Optional[float] = None,
+    ) -> List[Any]:
+        """Nhiều truy vấn trong một lượt, kết quả theo đúng thứ tự truy vấn.
+
+        Mỗi kết quả có cùng dạng với lời gọi đơn lẻ tương ứng (semantic_search /
+        word_search, global_search khi merge="global", hybrid_search) và dùng chung cache
+        kết quả với chúng. Các truy vấn chưa có trong cache được embed chung một batch
+        và mỗi collection chỉ được truy vấn một lần (một collection.query nhiều vector).
+        """
+        if mod not in ("word", "semantic", "hybrid"):
+            raise ValueError(f"mod không hợp lệ: {mod}")
+        normalized = [self._cache_query(mod, query) for query in queries]
+        if mod == "hybrid":
+            keys = [("hybrid", query, k, rrf_k) for query in normalized]
+            complete = self._complete_merged
+        elif merge == "global":
+            keys = [("global", mod, query, k) for query in normalized]
+            complete = self._complete_merged
+        else:
+            keys = [(mod, query, k) for query in normalized]
+            complete = self._complete_by_scope
+
+        def compute(indexes):
+            return self._batch_search([queries[i] for i in indexes], scope, k, mod, merge, rrf_k, deadline_s)
+
+        return self._cached_many(keys, scope, compute, complete)
+
+    def _batch_search(
+        self,
+        queries: List[str],
+        scope: str,
+        k: int,
+        mod: str,
+        merge: Optional[str],
+        rrf_k: int,
+        deadline_s: Optional[float],
+    ) -> List[Any]:
+        embeddings = self.embed_queries(queries) if mod in ("semantic", "hybrid") else None
+        if mod == "semantic" and merge == "global" and self._scope_log is not None:
+            # Layout shard: mỗi shard một lần query cho mọi truy vấn và mọi scope trong shard
+            names, results, errors, timed_out = self._fanout_shards(
+                scope, lambda collection: self._semantic_hits_many(collection, embeddings, k), deadline_s
+            )
+            return [
+                self._merge_global(mod, k, names, {name: hits[i] for name, hits in results.items()}, errors, timed_out)
+                for i in range(len(queries))
+            ]
+
+        def search_fn(sc, collection):
+            return (
+                self._semantic_hits_many(collection, embeddings, k) if embeddings is not None else None,
+                self._word_hits_many(sc, collection, queries, k) if mod in ("word", "hybrid") else None,
+            )
+
+        ordered_scopes, results, errors, timed_out = self._fanout(scope, search_fn, deadline_s)
+        responses = []
+        for i in range(len(queries)):
+            if mod == "hybrid":
+                per_scope = {sc: (semantic[i], word[i]) for sc, (semantic, word) in results.items()}
+                responses.append(self._fuse_hybrid(k, rrf_k, ordered_scopes, per_scope, errors, timed_out))
+                continue
+            position = 0 if mod == "semantic" else 1
+            per_scope = {sc: hits[position][i] for sc, hits in results.items()}
+            if merge == "global":
+                responses.append(self._merge_global(mod, k, ordered_scopes, per_scope, errors, timed_out))
+            else:
+                responses.append(self._by_scope(ordered_scopes, per_scope, errors, timed_out))
+        return responses
 
 # ✅ Test đơn giản
 if __name__ == "__main__":
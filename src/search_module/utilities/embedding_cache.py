@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from search_module.utilities.filelock import file_lock
+
+# Thư mục mặc định của cache embedding, nằm cạnh ./vector_storage
+EMBEDDING_CACHE_PATH = "./embedding_cache"
+
+# Số dòng tối thiểu được cấp thêm mỗi khi file vector đầy
+_GROW_ROWS = 1024
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hóa unicode và khoảng trắng để cùng một nội dung luôn cho cùng một hash."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def content_hash(text: str) -> str:
+    """sha256 của nội dung đã chuẩn hóa, ổn định giữa các lần chạy (khác với hash())."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Cache embedding trên đĩa, khóa theo content hash và phiên bản mô hình.
+
+    Vector được lưu liên tiếp trong một file float memory-mapped (``vectors.bin``),
+    ``index.tsv`` ánh xạ hash → số thứ tự dòng và chỉ được ghi thêm (append-only).
+    Nhiều tiến trình có thể dùng chung một thư mục: việc ghi được khóa bằng ``flock``
+    và mỗi instance đọc thêm phần index mà tiến trình khác vừa ghi.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, model_version: str = "default", dtype: str = "float32"):
+        # dtype="float16" giảm một nửa dung lượng; mỗi dtype có thư mục riêng
+        self.dir = os.path.join(path, model_version if dtype == "float32" else f"{model_version}-{dtype}")
+        os.makedirs(self.dir, exist_ok=True)
+        self._vectors_path = os.path.join(self.dir, "vectors.bin")
+        self._index_path = os.path.join(self.dir, "index.tsv")
+        self._meta_path = os.path.join(self.dir, "meta.json")
+        self._lock_path = os.path.join(self.dir, ".lock")
+        self._lock = threading.Lock()
+        self._index: Dict[str, int] = {}
+        self._index_offset = 0
+        self._next_row = 0
+        self._vectors: Optional[np.memmap] = None
+        self._capacity = 0
+        self.dim = 0
+        self.dtype = np.dtype(dtype)
+        with self._lock:
+            self._refresh()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def _refresh(self) -> None:
+        """Đọc phần index mới được ghi thêm (kể cả bởi tiến trình khác)."""
+        if not self.dim and os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+        if not os.path.exists(self._index_path) or os.path.getsize(self._index_path) <= self._index_offset:
+            return
+        with open(self._index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        # Dòng cuối có thể đang được ghi dở, để lại cho lần đọc sau
+        data = data[:data.rfind(b"\n") + 1]
+        self._index_offset += len(data)
+        for line in data.decode("utf-8").splitlines():
+            key, _, row = line.partition("\t")
+            if row:
+                self._index[key] = int(row)
+                self._next_row = max(self._next_row, int(row) + 1)
+
+    def _open_vectors(self) -> None:
+        row_bytes = self.dim * self.dtype.itemsize
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        self._capacity = size // row_bytes if row_bytes else 0
+        self._vectors = None
+        if self._capacity:
+            self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r+", shape=(self._capacity, self.dim))
+
+    def _ensure_capacity(self, rows: int) -> None:
+        if rows <= self._capacity:
+            return
+        # File có thể đã được tiến trình khác nới rộng
+        self._open_vectors()
+        if rows <= self._capacity:
+            return
+        new_capacity = max(rows, self._capacity * 2, _GROW_ROWS)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * self.dtype.itemsize)
+        self._open_vectors()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """Trả về các vector đã có trong cache, bỏ qua key chưa có."""
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            self._refresh()
+            rows = {key: self._index[key] for key in keys if key in self._index}
+            if not rows:
+                return found
+            self._ensure_capacity(max(rows.values()) + 1)
+            for key, row in rows.items():
+                found[key] = self._vectors[row].astype(np.float32).tolist()
+        return found
+
+    def put_many(self, keys: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Ghi thêm các vector mới; key đã có thì bỏ qua."""
+        with self._lock, file_lock(self._lock_path):
+            self._refresh()
+            new_keys: List[str] = []
+            new_vectors: List[Sequence[float]] = []
+            seen = set()
+            for key, vector in zip(keys, vectors):
+                if key in self._index or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_vectors.append(vector)
+            if not new_keys:
+                return
+
+            if not self.dim:
+                self.dim = len(new_vectors[0])
+                with open(self._meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+
+            start = self._next_row
+            self._ensure_capacity(start + len(new_keys))
+            self._vectors[start:start + len(new_keys)] = np.asarray(new_vectors, dtype=self.dtype)
+            self._vectors.flush()
+
+            # Chỉ ghi index sau khi vector đã nằm trên đĩa
+            lines = "".join(f"{key}\t{start + offset}\n" for offset, key in enumerate(new_keys))
+            with open(self._index_path, "ab") as f:
+                # Đang giữ khóa ghi nên phần dư sau dòng cuối là rác của tiến trình đã chết
+                if f.tell() > self._index_offset:
+                    f.truncate(self._index_offset)
+                f.write(lines.encode("utf-8"))
+            self._refresh()
@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Số thread tối đa dùng để truy vấn các scope song song
+FANOUT_WORKERS = 8
+
+# Thời gian tối đa (giây) mặc định cho một lượt truy vấn tất cả scope; None = chờ mọi scope
+# (request chỉ có deadline khi client gửi "deadline_ms")
+SEARCH_DEADLINE_S: Optional[float] = None
+
+
+class _DeadlineExpired(Exception):
+    """Task tới lượt chạy khi lượt truy vấn của nó đã hết deadline."""
+
+
+class ScopeFanout:
+    """Chạy truy vấn trên nhiều scope song song trên một thread pool có giới hạn.
+
+    Lượt có deadline thì scope nào chưa xong khi hết hạn được báo là timed out thay vì
+    làm chậm cả request; task còn xếp hàng của lượt đó bị hủy / bỏ qua để không chiếm
+    thread của các request sau.
+    """
+
+    def __init__(self, max_workers: int = FANOUT_WORKERS, deadline_s: Optional[float] = SEARCH_DEADLINE_S):
+        self.deadline_s = deadline_s
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="scope-fanout")
+
+    def iter_completed(
+        self, tasks: Dict[str, Callable[[], Any]], deadline_s: Optional[float] = None
+    ) -> Iterator[Tuple[str, str, Any]]:
+        """Sinh (scope, trạng thái, giá trị) theo thứ tự hoàn thành.
+
+        Trạng thái là ``"ok"`` (giá trị là kết quả), ``"error"`` (giá trị là exception)
+        hoặc ``"timeout"`` (giá trị là None) cho các scope chưa xong khi hết deadline.
+        deadline_s None thì dùng deadline mặc định của fanout (None = không giới hạn).
+        """
+        if deadline_s is None:
+            deadline_s = self.deadline_s
+        deadline = None if deadline_s is None else time.monotonic() + deadline_s
+
+        def guarded(fn):
+            def run():
+                # Tới lượt khi đã hết deadline (pool đang bận): bỏ qua, không truy vấn nữa
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise _DeadlineExpired()
+                return fn()
+            return run
+
+        futures: Dict[Future, str] = {self._executor.submit(guarded(fn)): scope for scope, fn in tasks.items()}
+        pending = set(futures)
+        finished = False
+        try:
+            while pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    error = future.exception()
+                    if isinstance(error, _DeadlineExpired):
+                        yield futures[future], "timeout", None
+                    elif error is not None:
+                        yield futures[future], "error", error
+                    else:
+                        yield futures[future], "ok", future.result()
+            finished = True
+        finally:
+            # Người dùng dừng sớm (vd. client streaming ngắt kết nối): bỏ các scope chưa chạy
+            if not finished:
+                for future in pending:
+                    future.cancel()
+        for future in pending:
+            # Task chưa chạy thì hủy luôn, task đang chạy sẽ bị bỏ qua kết quả
+            future.cancel()
+            yield futures[future], "timeout", None
+
+    def run(
+        self, tasks: Dict[str, Callable[[], Any]], deadline_s: Optional[float] = None
+    ) -> Tuple[Dict[str, Any], Dict[str, Exception], List[str]]:
+        """Chạy toàn bộ task, trả về (kết quả theo scope, lỗi theo scope, các scope timed out)."""
+        results: Dict[str, Any] = {}
+        errors: Dict[str, Exception] = {}
+        timed_out: List[str] = []
+        for scope, status, value in self.iter_completed(tasks, deadline_s):
+            if status == "ok":
+                results[scope] = value
+            elif status == "error":
+                errors[scope] = value
+            else:
+                timed_out.append(scope)
+        return results, errors, timed_out
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,20 @@
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khóa trong cùng tiến trình
+    fcntl = None  # type: ignore[assignment]
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Khóa độc quyền giữa các tiến trình dùng chung một thư mục dữ liệu."""
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
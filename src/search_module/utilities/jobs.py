@@ -0,0 +1,135 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Số worker nền xử lý ingestion
+INGEST_WORKERS = 2
+
+# Số job tối đa được xếp hàng; vượt quá thì request bị từ chối (HTTP 429)
+INGEST_QUEUE_SIZE = 16
+
+# Số job đã kết thúc được giữ lại để tra cứu trạng thái
+MAX_FINISHED_JOBS = 1000
+
+
+class JobQueueFull(Exception):
+    """Hàng đợi ingestion đã đầy."""
+
+
+class Job:
+    """Một job ingestion: trạng thái, tiến độ, kết quả hoặc lỗi."""
+
+    def __init__(self, kind: str, fn: Callable[["Job"], Dict[str, Any]]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.fn = fn
+        self.status = "queued"
+        self.stage: Optional[str] = None
+        self.done = 0
+        self.total: Optional[int] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def progress(self, stage: str, done: int, total: Optional[int] = None) -> None:
+        """Cập nhật tiến độ (vd. số trang đã đọc / tổng số trang)."""
+        self.stage = stage
+        self.done = done
+        self.total = total
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": {"stage": self.stage, "done": self.done, "total": self.total},
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class JobManager:
+    """Hàng đợi có giới hạn + pool worker nền cho các job ingestion.
+
+    Worker chỉ được khởi động ở lần submit đầu tiên. Hàm của job nhận chính Job để
+    báo tiến độ và trả về dict kết quả; nếu kết quả có ``"status": "error"`` hoặc
+    hàm ném exception thì job được đánh dấu ``failed``.
+    """
+
+    def __init__(self, num_workers: int = INGEST_WORKERS, max_queue: int = INGEST_QUEUE_SIZE):
+        self.num_workers = max(1, num_workers)
+        self._queue: "queue.Queue[Job]" = queue.Queue(maxsize=max(1, max_queue))
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+
+    def _start_workers(self) -> None:
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, kind: str, fn: Callable[[Job], Dict[str, Any]]) -> Job:
+        """Xếp job vào hàng đợi, ném JobQueueFull nếu hàng đợi đã đầy."""
+        self._start_workers()
+        job = Job(kind, fn)
+        # Ghi nhận job trước khi xếp hàng để worker xong sớm vẫn tra cứu được
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise JobQueueFull(f"Ingestion queue is full ({self._queue.maxsize} jobs)")
+        with self._lock:
+            self._evict_finished()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def _evict_finished(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = job.fn(job)
+                if job.result.get("status") == "error":
+                    job.status = "failed"
+                    job.error = job.result.get("message")
+                else:
+                    job.status = "succeeded"
+            except Exception as e:
+                logger.exception("job failed", extra={"job_id": job.id, "kind": job.kind})
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
@@ -0,0 +1,340 @@
+import hashlib
+import heapq
+import json
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+from search_module.utilities.filelock import file_lock
+
+# Thư mục lưu index từ khóa, nằm cạnh ./vector_storage
+KEYWORD_INDEX_PATH = "./keyword_index"
+
+# Số term tối đa được mở rộng cho một từ của câu truy vấn (tiền tố / hậu tố / chuỗi con);
+# nhiều hơn thì vị trí đó không được dùng để lọc ứng viên
+MAX_TERM_EXPANSIONS = 64
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách text thành các term viết thường."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _contains(postings: array, ordinal: int) -> bool:
+    i = bisect_left(postings, ordinal)
+    return i < len(postings) and postings[i] == ordinal
+
+
+class ScopeIndex:
+    """Inverted index của một scope: term → posting list (số thứ tự chunk, tăng dần).
+
+    Vị trí của từng term được lấy từ dãy term id của chunk (``_docs``), dùng để kiểm
+    tra cụm từ liên tiếp. Mọi thay đổi được ghi thêm vào một file log JSON lines nên
+    việc cập nhật luôn là tăng dần, không phải ghi lại toàn bộ index.
+    """
+
+    def __init__(self, scope: str, log_path: str):
+        self.scope = scope
+        self.log_path = log_path
+        self._lock = threading.RLock()
+        self._terms: Dict[str, int] = {}
+        self._term_list: List[str] = []
+        self._postings: List[array] = []
+        self._sorted_terms: Optional[List[str]] = None
+        self._vocab: Optional[str] = None
+        self._vocab_starts = array("I")
+        self._ids: List[str] = []
+        self._docs: List[array] = []
+        self._ordinals: Dict[str, int] = {}
+        self._deleted: Set[int] = set()
+        self._log_offset = 0
+        self._refresh()
+
+    def __len__(self) -> int:
+        return len(self._ordinals)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._ordinals
+
+    def _term_id(self, term: str) -> int:
+        tid = self._terms.get(term)
+        if tid is None:
+            tid = len(self._term_list)
+            self._terms[term] = tid
+            self._term_list.append(term)
+            self._postings.append(array("I"))
+            self._sorted_terms = None
+            self._vocab = None
+        return tid
+
+    def _apply(self, record: Dict) -> None:
+        if "del" in record:
+            ordinal = self._ordinals.pop(record["del"], None)
+            if ordinal is not None:
+                self._deleted.add(ordinal)
+                self._docs[ordinal] = array("I")
+            return
+        chunk_id = record["id"]
+        if chunk_id in self._ordinals:
+            return
+        ordinal = len(self._ids)
+        doc = array("I", (self._term_id(term) for term in record["tokens"]))
+        for tid in set(doc):
+            self._postings[tid].append(ordinal)
+        self._ids.append(chunk_id)
+        self._docs.append(doc)
+        self._ordinals[chunk_id] = ordinal
+
+    def _refresh(self) -> None:
+        """Đọc phần log mới được ghi thêm (kể cả bởi tiến trình khác)."""
+        if not os.path.exists(self.log_path) or os.path.getsize(self.log_path) <= self._log_offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        # Dòng cuối có thể đang được ghi dở, để lại cho lần đọc sau
+        data = data[:data.rfind(b"\n") + 1]
+        self._log_offset += len(data)
+        for line in data.decode("utf-8").splitlines():
+            if line:
+                self._apply(json.loads(line))
+
+    def _append(self, records: List[Dict]) -> None:
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with file_lock(self.log_path + ".lock"):
+            self._refresh()
+            with open(self.log_path, "ab") as f:
+                # Đang giữ khóa ghi nên phần dư sau dòng cuối là rác của tiến trình đã chết
+                if f.tell() > self._log_offset:
+                    f.truncate(self._log_offset)
+                f.write(lines.encode("utf-8"))
+            self._refresh()
+
+    def add(self, chunk_ids: Sequence[str], texts: Sequence[str]) -> int:
+        """Thêm chunk vào index. Id đã có thì bỏ qua (id chứa hash nội dung)."""
+        with self._lock:
+            self._refresh()
+            records = []
+            seen = set()
+            for chunk_id, text in zip(chunk_ids, texts):
+                if chunk_id in self._ordinals or chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+                records.append({"id": chunk_id, "tokens": tokenize(text)})
+            if records:
+                self._append(records)
+            return len(records)
+
+    def delete(self, chunk_ids: Sequence[str]) -> int:
+        """Xóa chunk khỏi index (ghi bản ghi ``del``). Id không có trong index thì bỏ qua."""
+        with self._lock:
+            self._refresh()
+            records = [{"del": chunk_id} for chunk_id in dict.fromkeys(chunk_ids) if chunk_id in self._ordinals]
+            if records:
+                self._append(records)
+            return len(records)
+
+    def _prefix_terms(self, prefix: str) -> List[int]:
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._terms)
+        terms = self._sorted_terms
+        tids = []
+        i = bisect_left(terms, prefix)
+        while i < len(terms) and terms[i].startswith(prefix) and len(tids) <= MAX_TERM_EXPANSIONS:
+            tids.append(self._terms[terms[i]])
+            i += 1
+        return tids
+
+    def _vocab_terms(self, needle: str) -> List[int]:
+        # Hậu tố / chuỗi con không dùng được thứ tự sắp xếp: tìm bằng str.find (tốc độ C) trên
+        # chuỗi nối mọi term, mỗi term kết thúc bằng "\n"
+        if self._vocab is None:
+            self._vocab = "".join(term + "\n" for term in self._term_list)
+            self._vocab_starts = array("I")
+            offset = 0
+            for term in self._term_list:
+                self._vocab_starts.append(offset)
+                offset += len(term) + 1
+        tids = []
+        pos = self._vocab.find(needle)
+        while pos != -1 and len(tids) <= MAX_TERM_EXPANSIONS:
+            tid = bisect_right(self._vocab_starts, pos) - 1
+            tids.append(tid)
+            # Mỗi term chỉ tính một lần: tìm tiếp từ term kế tiếp
+            pos = self._vocab.find(needle, self._vocab_starts[tid] + len(self._term_list[tid]) + 1)
+        return tids
+
+    def _expand(self, token: str, open_left: bool, open_right: bool) -> Optional[List[int]]:
+        """Term id có thể chứa từ token của query; None khi quá MAX_TERM_EXPANSIONS term."""
+        if not open_left and not open_right:
+            tid = self._terms.get(token)
+            return [] if tid is None else [tid]
+        if not open_left:
+            tids = self._prefix_terms(token)
+        else:
+            tids = self._vocab_terms(token if open_right else token + "\n")
+        return tids if len(tids) <= MAX_TERM_EXPANSIONS else None
+
+    def _plan(self, query: str) -> List[Optional[List[int]]]:
+        # Query là chuỗi con của text nên từ đầu có thể là phần cuối của một term, từ cuối
+        # có thể là phần đầu của một term (khi query không bắt đầu / kết thúc bằng dấu cách
+        # hay dấu câu); các từ ở giữa phải trùng nguyên term
+        lowered = query.lower()
+        matches = list(_TOKEN_RE.finditer(lowered))
+        return [
+            self._expand(
+                m.group(),
+                i == 0 and m.start() == 0,
+                i == len(matches) - 1 and m.end() == len(lowered),
+            )
+            for i, m in enumerate(matches)
+        ]
+
+    @staticmethod
+    def _has_phrase(doc: array, pattern: bytes, first: Optional[Set[int]], last: Optional[Set[int]]) -> bool:
+        # first / last: term id được phép ở từ đầu / cuối (None: term bất kỳ)
+        if not pattern:
+            return any(
+                (first is None or a in first) and (last is None or b in last) for a, b in zip(doc, doc[1:])
+            )
+        # Tìm dãy term id của các từ giữa ngay trên bytes (chạy ở tốc độ C), rồi kiểm tra hai đầu
+        data = doc.tobytes()
+        width = doc.itemsize
+        n = len(pattern) // width
+        pos = data.find(pattern)
+        while pos != -1:
+            if pos % width == 0:
+                start = pos // width
+                end = start + n
+                if (
+                    start > 0
+                    and end < len(doc)
+                    and (first is None or doc[start - 1] in first)
+                    and (last is None or doc[end] in last)
+                ):
+                    return True
+            pos = data.find(pattern, pos + 1)
+        return False
+
+    def _merged(self, tids: List[int]) -> Iterator[int]:
+        previous = -1
+        for ordinal in heapq.merge(*(self._postings[tid] for tid in tids)):
+            if ordinal != previous:
+                yield ordinal
+                previous = ordinal
+
+    def _candidates(self, positions: List[Optional[List[int]]]) -> Iterator[int]:
+        # Duyệt hợp các posting list ngắn nhất trong các vị trí lọc được, lọc nhanh bằng các
+        # vị trí còn lại; không vị trí nào lọc được thì mọi chunk đều là ứng viên
+        usable = [tids for tids in positions if tids is not None]
+        if not usable:
+            yield from range(len(self._ids))
+            return
+        driver = min(usable, key=lambda tids: sum(len(self._postings[tid]) for tid in tids))
+        others = [[self._postings[tid] for tid in tids] for tids in usable if tids is not driver]
+        for ordinal in self._merged(driver):
+            if all(any(_contains(postings, ordinal) for postings in lists) for lists in others):
+                yield ordinal
+
+    def candidates(self, query: str) -> Iterator[str]:
+        """Chunk id có thể chứa query (chuỗi con, không phân biệt hoa thường), theo thứ tự được thêm vào.
+
+        Index chỉ thu hẹp ứng viên: dấu câu giữa các từ không được lưu, nên người gọi phải
+        kiểm tra lại ``query.lower() in text.lower()`` trên text của chunk. Query không có
+        từ nào (vd. chỉ có dấu câu) thì mọi chunk đều là ứng viên.
+        """
+        with self._lock:
+            self._refresh()
+            positions = self._plan(query)
+        if any(tids == [] for tids in positions):
+            return iter(())
+        return self._iter_candidates(positions)
+
+    def _iter_candidates(self, positions: List[Optional[List[int]]]) -> Iterator[str]:
+        check = len(positions) >= 2
+        if check:
+            first = None if positions[0] is None else set(positions[0])
+            last = None if positions[-1] is None else set(positions[-1])
+            pattern = array("I", (tids[0] for tids in positions[1:-1])).tobytes()
+        ordinals = self._candidates(positions)
+        while True:
+            # Chỉ giữ khóa trong lúc tìm ứng viên kế tiếp, người gọi có thể đọc Chroma giữa hai lần
+            with self._lock:
+                for ordinal in ordinals:
+                    if ordinal in self._deleted:
+                        continue
+                    # Truy vấn một từ: mọi ứng viên từ posting list đều đã khớp
+                    if not check or self._has_phrase(self._docs[ordinal], pattern, first, last):
+                        chunk_id = self._ids[ordinal]
+                        break
+                else:
+                    return
+            yield chunk_id
+
+
+class KeywordIndex:
+    """Tập các ScopeIndex, mỗi scope một file log trong ``path``; nạp lười khi cần."""
+
+    def __init__(self, path: str = KEYWORD_INDEX_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._scopes: Dict[str, ScopeIndex] = {}
+        self._lock = threading.Lock()
+
+    def _log_path(self, scope: str) -> str:
+        safe = re.sub(r"[^\w.-]", "_", scope)[:80]
+        digest = hashlib.sha256(scope.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.path, f"{safe}_{digest}.jsonl")
+
+    def exists(self, scope: str) -> bool:
+        """Scope đã có index (trong bộ nhớ hoặc trên đĩa) hay chưa."""
+        return scope in self._scopes or os.path.exists(self._log_path(scope))
+
+    def get(self, scope: str) -> ScopeIndex:
+        with self._lock:
+            index = self._scopes.get(scope)
+            if index is None:
+                index = ScopeIndex(scope, self._log_path(scope))
+                self._scopes[scope] = index
+            return index
+
+    def add(self, scope: str, chunk_ids: Sequence[str], texts: Sequence[str]) -> int:
+        return self.get(scope).add(chunk_ids, texts)
+
+    def delete(self, scope: str, chunk_ids: Sequence[str]) -> int:
+        if not chunk_ids or not self.exists(scope):
+            return 0
+        return self.get(scope).delete(chunk_ids)
+
+    def candidates(self, scope: str, query: str) -> Iterator[str]:
+        return self.get(scope).candidates(query)
+
+    def drop(self, scope: str) -> None:
+        """Xóa toàn bộ index của scope (file log và bản trong bộ nhớ)."""
+        with self._lock:
+            self._scopes.pop(scope, None)
+            for path in (self._log_path(scope), self._log_path(scope) + ".lock"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def build(self, scope: str, records: Iterable[Sequence[str]]) -> int:
+        """Dựng index cho scope từ các cặp (chunk_id, text) đã có sẵn."""
+        added = 0
+        batch_ids: List[str] = []
+        batch_texts: List[str] = []
+        for chunk_id, text in records:
+            batch_ids.append(chunk_id)
+            batch_texts.append(text)
+            if len(batch_ids) >= 1000:
+                added += self.add(scope, batch_ids, batch_texts)
+                batch_ids, batch_texts = [], []
+        added += self.add(scope, batch_ids, batch_texts)
+        # Scope rỗng vẫn cần file log để không phải dựng lại ở lần sau
+        if not os.path.exists(self._log_path(scope)):
+            open(self._log_path(scope), "a").close()
+        return added
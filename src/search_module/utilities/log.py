@@ -0,0 +1,38 @@
+import json
+import logging
+import os
+
+# Mức log mặc định của package (DEBUG, INFO, WARNING, ...), đổi bằng biến môi trường LOG_LEVEL
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+
+# Các thuộc tính có sẵn của LogRecord; thuộc tính khác là trường truyền qua ``extra``
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Mỗi bản ghi là một dòng JSON: thời gian, level, logger, message và các trường trong ``extra``."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str = LOG_LEVEL) -> logging.Logger:
+    """Gắn handler JSON (stderr) cho logger ``search_module``; gọi lại nhiều lần vẫn chỉ có một handler."""
+    logger = logging.getLogger("search_module")
+    logger.setLevel(level.upper())
+    if not any(isinstance(handler.formatter, JsonFormatter) for handler in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+    return logger
@@ -0,0 +1,191 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bucket mặc định cho thời gian (mili giây)
+LATENCY_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Bucket cho thời gian tính bằng giây (đơn vị chuẩn của Prometheus)
+LATENCY_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Bucket mặc định cho kích thước batch
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class Histogram:
+    """Histogram với bucket cố định (giới hạn trên, cộng dồn như Prometheus), an toàn đa luồng."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS_MS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # phần tử cuối là +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Ghi thời gian chạy của khối lệnh (giây)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def collect(self) -> Tuple[List[int], float, int]:
+        """(số quan sát cộng dồn theo bucket, kể cả +Inf), sum, count."""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        running = 0
+        cumulative = []
+        for n in counts:
+            running += n
+            cumulative.append(running)
+        return cumulative, total, count
+
+    def snapshot(self) -> Dict[str, Any]:
+        """count, sum, mean và số quan sát cộng dồn theo từng bucket (``le``)."""
+        counts, total, count = self.collect()
+        cumulative = {str(bound): n for bound, n in zip([*self.buckets, "+Inf"], counts)}
+        return {
+            "count": count,
+            "sum": round(total, 4),
+            "mean": round(total / count, 4) if count else 0.0,
+            "buckets": cumulative,
+        }
+
+
+class Counter:
+    """Bộ đếm chỉ tăng, an toàn đa luồng."""
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+class HistogramFamily:
+    """Các Histogram cùng tên, phân biệt bằng giá trị label (vd. ``mode``)."""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> Histogram:
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} cần label {self.labelnames}, nhận {values}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, Histogram(self.buckets))
+        return child
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, child in sorted(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            counts, total, count = child.collect()
+            for bound, n in zip([*child.buckets, float("inf")], counts):
+                bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {n}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Tập metric của tiến trình, xuất ra định dạng text của Prometheus.
+
+    Gauge được tính lúc scrape qua một hàm; hàm trả về None (vd. DB chưa được khởi
+    tạo) hoặc lỗi thì gauge bị bỏ qua, các metric khác vẫn được xuất.
+    """
+
+    def __init__(self):
+        self._histograms: Dict[str, HistogramFamily] = {}
+        self._counters: Dict[str, Tuple[str, Counter]] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], Optional[float]]]] = {}
+        self._lock = threading.Lock()
+
+    def histogram(
+        self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS_S, labelnames: Sequence[str] = ()
+    ) -> HistogramFamily:
+        with self._lock:
+            family = self._histograms.get(name)
+            if family is None:
+                family = self._histograms[name] = HistogramFamily(name, help, buckets, labelnames)
+            return family
+
+    def counter(self, name: str, help: str) -> Counter:
+        with self._lock:
+            if name not in self._counters:
+                self._counters[name] = (help, Counter())
+            return self._counters[name][1]
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Optional[float]]) -> None:
+        with self._lock:
+            self._gauges[name] = (help, fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in list(self._histograms.values()):
+            lines.extend(family.render())
+        for name, (help, counter) in list(self._counters.items()):
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} counter", f"{name} {_format_value(counter.value)}"]
+        for name, (help, fn) in list(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                logger.warning("gauge failed", extra={"gauge": name, "error": str(e)})
+                continue
+            if value is not None:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+        return "\n".join(lines) + "\n"
+
+
+# Registry mặc định, dùng chung cho cả tiến trình và được xuất qua GET /metrics
+METRICS = MetricsRegistry()
@@ -0,0 +1,74 @@
+import argparse
+import json
+from typing import Any, Callable, Dict, Optional
+
+from search_module.utilities.db_helper import SHARD_COUNT, VectorDatabase
+
+# Số bản ghi đọc/ghi mỗi lần khi chép một collection
+MIGRATE_PAGE_SIZE = 1000
+
+
+def migrate_to_sharded(
+    storage_path: str = "./vector_storage",
+    shard_count: int = SHARD_COUNT,
+    drop_source: bool = False,
+    page_size: int = MIGRATE_PAGE_SIZE,
+    progress: Optional[Callable[[str, int], None]] = None,
+) -> Dict[str, Any]:
+    """Chép mọi collection ``scope_*`` (layout per_scope) sang các shard trong cùng storage.
+
+    Vector được chép nguyên (không embed lại), id giữ nguyên nên index từ khóa vẫn dùng
+    được và chạy lại nhiều lần không tạo bản trùng. Collection nguồn chỉ bị xóa khi
+    drop_source=True và số bản ghi ở đích khớp với nguồn. progress(scope, số chunk đã chép).
+    """
+    db = VectorDatabase(storage_path=storage_path, layout="sharded", shard_count=shard_count, embedding_cache_path=None)
+    names = [getattr(col, "name", col) for col in db.client.list_collections()]
+    report: Dict[str, Any] = {"scopes": 0, "chunks": 0, "dropped": 0, "mismatched": []}
+    for name in names:
+        if not name.startswith("scope_"):
+            continue
+        scope = name[len("scope_"):]
+        source = db.client.get_collection(name, embedding_function=db.embedding_fn)
+        target = db.get_collection_by_scope(scope)
+        copied = 0
+        offset = 0
+        while True:
+            page = source.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            if not len(page["ids"]):
+                break
+            target.upsert(
+                ids=page["ids"],
+                documents=page["documents"],
+                embeddings=page["embeddings"],
+                metadatas=page["metadatas"],
+            )
+            copied += len(page["ids"])
+            offset += len(page["ids"])
+            if progress:
+                progress(scope, copied)
+
+        report["scopes"] += 1
+        report["chunks"] += copied
+        if target.count() != source.count():
+            report["mismatched"].append(scope)
+        elif drop_source:
+            db.client.delete_collection(name)
+            report["dropped"] += 1
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chuyển vector storage từ layout mỗi scope một collection sang layout shard.")
+    parser.add_argument("--storage-path", default="./vector_storage")
+    parser.add_argument("--shard-count", type=int, default=SHARD_COUNT)
+    parser.add_argument("--drop-source", action="store_true", help="Xóa collection scope_* sau khi chép và kiểm tra xong")
+    parser.add_argument("--page-size", type=int, default=MIGRATE_PAGE_SIZE)
+    args = parser.parse_args()
+
+    report = migrate_to_sharded(args.storage_path, args.shard_count, args.drop_source, args.page_size)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    print("Đặt STORAGE_LAYOUT = \"sharded\" (và SHARD_COUNT tương ứng) trong db_helper để dùng layout mới.")
+
+
+if __name__ == "__main__":
+    main()
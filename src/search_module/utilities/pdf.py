@@ -1,24 +1,122 @@
 import os
 import json
+import logging
 import re
-import PyPDF2
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_text_by_page(pdf_path):
-    try:
-        with open(pdf_path, "rb") as file:
-            reader = PyPDF2.PdfReader(file)
-            pages_text = []
+from search_module.utilities import chunker
+
+# Số tiến trình đọc PDF song song và số trang mỗi tiến trình xử lý một lần
+PDF_WORKERS = os.cpu_count() or 1
+PAGES_PER_TASK = 8
+
+# PDF ít trang hơn ngưỡng này được đọc tuần tự (không đáng chi phí khởi tạo tiến trình)
+PDF_PARALLEL_MIN_PAGES = 32
+
+# Số chunk gom lại trước khi embed + ghi trong pipeline ingestion
+INGEST_WINDOW = 256
+
+# Số từ mỗi chunk khi chia theo từ (chunker.CHUNK_MODE = "words")
+CHUNK_SIZE = 250
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+def _get_pool():
+    # Dùng "spawn" vì tiến trình cha có nhiều thread (ONNX, worker ingestion), fork không an toàn
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _extract_range(pdf_path, start, end):
+    """Đọc text các trang [start, end) trong tiến trình con."""
+    import PyPDF2
+
+    pages = []
+    with open(pdf_path, "rb") as file:
+        reader = PyPDF2.PdfReader(file)
+        for i in range(start, end):
+            text = reader.pages[i].extract_text()
+            pages.append((i + 1, text))  # page numbers start at 1
+    return pages
+
+
+def iter_pages(pdf_path, progress=None, workers=None, pages_per_task=PAGES_PER_TASK):
+    """Sinh (số trang, text) theo đúng thứ tự trang, bỏ qua trang không có text.
+
+    PDF lớn được chia thành các khoảng trang đọc song song trong process pool; chỉ tối
+    đa ``2 * workers`` khoảng được xử lý cùng lúc nên bộ nhớ bị chặn bởi cửa sổ này
+    chứ không phải cả cuốn sách. progress(done, total) báo số trang đã đọc.
+    """
+    # PyPDF2 chỉ được import khi ingest PDF lần đầu, giữ cho việc import app nhẹ
+    import PyPDF2
+
+    workers = PDF_WORKERS if workers is None else workers
+    with open(pdf_path, "rb") as file:
+        reader = PyPDF2.PdfReader(file)
+        total = len(reader.pages)
+        if workers <= 1 or total < PDF_PARALLEL_MIN_PAGES:
             for i, page in enumerate(reader.pages):
                 text = page.extract_text()
+                if progress:
+                    progress(i + 1, total)
                 if text:
-                    pages_text.append((i + 1, text))  # page numbers start at 1
-            return pages_text
+                    yield i + 1, text  # page numbers start at 1
+            return
+
+    pool = _get_pool()
+    starts = iter(range(0, total, pages_per_task))
+    pending = deque()
+
+    def submit_next():
+        start = next(starts, None)
+        if start is None:
+            return False
+        pending.append(pool.submit(_extract_range, pdf_path, start, min(start + pages_per_task, total)))
+        return True
+
+    while len(pending) < 2 * workers and submit_next():
+        pass
+    done = 0
+    try:
+        while pending:
+            pages = pending.popleft().result()
+            # Giữ cửa sổ đầy: gửi khoảng trang tiếp theo trước khi trả các trang hiện tại ra ngoài
+            submit_next()
+            for page_num, text in pages:
+                done += 1
+                if progress:
+                    progress(done, total)
+                if text:
+                    yield page_num, text
+    finally:
+        # Người dùng dừng sớm (hoặc lỗi): hủy các khoảng trang chưa chạy
+        for future in pending:
+            future.cancel()
+
+
+def extract_text_by_page(pdf_path, progress=None):
+    # progress(done, total): callback báo số trang đã đọc
+    try:
+        return list(iter_pages(pdf_path, progress))
     except Exception as e:
-        print(f"Error reading PDF: {e}")
+        logger.warning("read pdf failed", extra={"path": pdf_path, "error": str(e)})
         return []
 
-def chunk_text_by_page(pages_text, chunk_size=250):
-    chunks = []
+
+def extraction_params():
+    """Tham số ảnh hưởng tới chunk sinh ra từ một PDF, dùng trong khóa của registry nguồn."""
+    return chunker.chunk_params(CHUNK_SIZE)
+
+
+def iter_chunks_by_page(pages_text, chunk_size=CHUNK_SIZE):
+    """Như chunk_text_by_page nhưng sinh chunk ngay khi từng trang được đọc xong."""
     for page_num, text in pages_text:
         words = text.split()
         current_chunk = []
@@ -26,36 +124,64 @@ def chunk_text_by_page(pages_text, chunk_size=250):
         for word in words:
             current_chunk.append(word)
             if len(current_chunk) >= chunk_size:
-                chunks.append({
+                yield {
                     "text": " ".join(current_chunk),
                     "location": page_num
-                })
+                }
                 current_chunk = []
 
         if current_chunk:
-            chunks.append({
+            yield {
                 "text": " ".join(current_chunk),
                 "location": page_num
-            })
+            }
+
 
-    return chunks
+def chunk_text_by_page(pages_text, chunk_size=CHUNK_SIZE):
+    return list(iter_chunks_by_page(pages_text, chunk_size))
 
 def sanitize_filename(name):
     name = name.strip().replace(" ", "_")
     return re.sub(r'[\\/*?:"<>|]', "", name)
 
-def process_pdf(pdf_path, scope):
-    pages_text = extract_text_by_page(pdf_path)
-    if not pages_text:
-        return None, os.path.basename(pdf_path)
+def iter_process_pdf(pdf_path, scope, progress=None):
+    """Pipeline streaming: đọc trang (song song) → chunk → gắn metadata, sinh từng chunk.
 
-    all_text = "\n".join([text for _, text in pages_text])
-    chunks = chunk_text_by_page(pages_text)
+    Ở chế độ chia theo token, chunk mang theo ``token_ids`` để DB embed không cần tokenize lại.
+    """
+    pages = iter_pages(pdf_path, progress)
+    if chunker.CHUNK_MODE == "words":
+        chunks = iter_chunks_by_page(pages)
+    else:
+        chunks = chunker.TokenChunker().chunk_pages(pages)
     for c_idx, chunk in enumerate(chunks):
-        chunks[c_idx]["chunk_source"] = pdf_path
-        chunks[c_idx]["chunk_scope"] = scope
-        chunks[c_idx]["chunk_source_type"] = "pdf"
-        chunks[c_idx]["chunk_id"] = c_idx + 1
+        chunk["chunk_source"] = pdf_path
+        chunk["chunk_scope"] = scope
+        chunk["chunk_source_type"] = "pdf"
+        chunk["chunk_id"] = c_idx + 1
+        yield chunk
+
+
+def iter_chunk_windows(chunks, window=INGEST_WINDOW):
+    """Gom chunk thành từng cửa sổ để embed + ghi trong khi các trang sau vẫn đang được đọc."""
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= window:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def process_pdf(pdf_path, scope, progress=None):
+    try:
+        chunks = list(iter_process_pdf(pdf_path, scope, progress))
+    except Exception as e:
+        logger.warning("read pdf failed", extra={"path": pdf_path, "error": str(e)})
+        chunks = []
+    if not chunks:
+        return None, os.path.basename(pdf_path)
     # print(chunks)
     base_name = os.path.splitext(os.path.basename(pdf_path))[0]
     return chunks, base_name
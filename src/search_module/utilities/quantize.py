@@ -0,0 +1,40 @@
+import argparse
+import os
+
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+# Mô hình fp32 đi kèm repo và bản INT8 được tạo ra từ nó
+FP32_MODEL_PATH = "./onnx_model/model.onnx"
+INT8_MODEL_PATH = "./onnx_model/model.int8.onnx"
+
+
+def quantize_model(model_path=FP32_MODEL_PATH, output_path=INT8_MODEL_PATH, per_channel=False):
+    """Lượng tử hóa động (dynamic quantization) trọng số sang INT8, activation vẫn tính lúc chạy.
+
+    Không cần dữ liệu hiệu chỉnh; phù hợp với node chỉ có CPU. Trả về (kích thước fp32,
+    kích thước int8) tính theo byte.
+    """
+    if not os.path.exists(model_path):
+        raise ValueError(f"Mô hình ONNX không tìm thấy tại {model_path}")
+    quantize_dynamic(
+        model_input=model_path,
+        model_output=output_path,
+        per_channel=per_channel,
+        weight_type=QuantType.QInt8,
+    )
+    return os.path.getsize(model_path), os.path.getsize(output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tạo bản INT8 của mô hình embedding ONNX.")
+    parser.add_argument("--model", default=FP32_MODEL_PATH)
+    parser.add_argument("--output", default=INT8_MODEL_PATH)
+    parser.add_argument("--per-channel", action="store_true")
+    args = parser.parse_args()
+
+    fp32_size, int8_size = quantize_model(args.model, args.output, args.per_channel)
+    print(f"Quantized model saved to '{args.output}' ({fp32_size / 1e6:.1f} MB -> {int8_size / 1e6:.1f} MB).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from search_module.utilities.keyword_index import tokenize
+
+# Độ dài (kí tự) tối đa của snippet quanh đoạn khớp
+SNIPPET_CHARS = 200
+
+# Các trường của một hit mà client có thể chọn bằng "fields"
+HIT_FIELDS = (
+    "text", "snippet", "highlights", "location", "chunk_id", "chunk_source", "chunk_scope",
+    "chunk_source_type", "similarity_score", "rrf_score", "matched_by",
+)
+
+_WORD_RE = re.compile(r"\w+")
+
+try:
+    # orjson đi kèm chromadb; thiếu thì dùng json chuẩn
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    # Số numpy (vd. điểm similarity) → số Python
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize JSON nhanh (orjson nếu có), giữ nguyên kí tự Unicode."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def _matches(text: str, query: str) -> List[Tuple[int, int]]:
+    """Vị trí (start, end) của query trong text (cùng quy tắc với word search: chuỗi con, không phân biệt hoa thường).
+
+    Không có chỗ nào khớp (vd. hit semantic) thì trả về vị trí của từng từ trong truy vấn
+    (từ cuối khớp tiền tố).
+    """
+    needle = query.lower()
+    lowered = text.lower()
+    # lower() có thể đổi độ dài vài kí tự Unicode, khi đó vị trí không còn khớp với text
+    if needle.strip() and len(lowered) == len(text):
+        spans = []
+        pos = lowered.find(needle)
+        while pos != -1:
+            spans.append((pos, pos + len(needle)))
+            pos = lowered.find(needle, pos + len(needle))
+        if spans:
+            return spans
+    terms = tokenize(query)
+    if not terms:
+        return []
+    words = [(m.start(), m.end(), m.group().lower()) for m in _WORD_RE.finditer(text)]
+    term_set = set(terms)
+    return [(start, end) for start, end, word in words if word in term_set or word.startswith(terms[-1])]
+
+
+def make_snippet(text: str, query: str, width: int = SNIPPET_CHARS) -> Dict[str, Any]:
+    """Đoạn text dài tối đa ~width kí tự chứa nhiều chỗ khớp nhất, kèm vị trí highlight trong snippet.
+
+    Không khớp từ nào (vd. hit semantic thuần) thì lấy phần đầu chunk.
+    """
+    matches = _matches(text, query)
+    start = 0
+    if matches:
+        # Cửa sổ bắt đầu ngay trước một chỗ khớp và chứa nhiều chỗ khớp nhất
+        best = max(
+            matches,
+            key=lambda anchor: sum(1 for s, e in matches if s >= anchor[0] and e <= anchor[0] + width),
+        )
+        start = max(0, best[0] - width // 5)
+    end = min(len(text), start + width)
+    # Không cắt giữa từ
+    while start > 0 and text[start - 1].isalnum():
+        start -= 1
+    while end < len(text) and text[end].isalnum():
+        end += 1
+    snippet = text[start:end]
+    highlights = [[s - start, e - start] for s, e in matches if s >= start and e <= end]
+    return {"snippet": snippet, "highlights": highlights}
+
+
+def _shape_hit(hit: Dict[str, Any], query: str, snippet: bool, fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    if "status" in hit:
+        # Mục lỗi / timeout của một scope giữ nguyên
+        return hit
+    if snippet:
+        hit.update(make_snippet(hit.get("text") or "", query))
+        if not fields:
+            hit.pop("text", None)
+    if fields:
+        hit = {field: hit[field] for field in fields if field in hit}
+    return hit
+
+
+def shape_hits(
+    hits: List[Dict[str, Any]],
+    query: str,
+    offset: int = 0,
+    k: Optional[int] = None,
+    snippet: bool = False,
+    fields: Optional[Sequence[str]] = None,
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """Trang [offset, offset + k) của danh sách hit, rút gọn bằng snippet và/hoặc chọn trường.
+
+    Trả về thêm cờ còn hit sau trang này (danh sách được lấy dư một phần tử để biết).
+    """
+    more = False
+    if hits and "status" not in hits[0]:
+        end = offset + k if k is not None else len(hits)
+        more = len(hits) > end
+        hits = hits[offset:end]
+    return [_shape_hit(hit, query, snippet, fields) for hit in hits], more
+
+
+def shape_results(results: Any, query: str, offset: int = 0, k: Optional[int] = None, **kwargs) -> Tuple[Any, Optional[int]]:
+    """Áp dụng shape_hits cho kết quả theo scope ({scope: [hit]}) hoặc kết quả gộp ({"results": [hit], ...}).
+
+    Trả về (kết quả, next_offset); next_offset là None khi không còn trang sau. Kết quả
+    gộp có thêm trường ``next_offset``.
+    """
+    if isinstance(results, dict) and isinstance(results.get("results"), list):
+        hits, more = shape_hits(results["results"], query, offset, k, **kwargs)
+        next_offset = offset + k if more else None
+        return dict(results, results=hits, next_offset=next_offset), next_offset
+    shaped = {}
+    any_more = False
+    for sc, hits in results.items():
+        shaped[sc], more = shape_hits(hits, query, offset, k, **kwargs)
+        any_more = any_more or more
+    return shaped, (offset + k if any_more else None)
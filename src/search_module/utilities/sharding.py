@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from search_module.utilities.filelock import file_lock
+
+# Tiền tố tên các collection shard: shard_000, shard_001, ...
+SHARD_PREFIX = "shard_"
+
+
+def shard_index(scope: str, shard_count: int) -> int:
+    """Shard chứa scope, ổn định giữa các tiến trình (không dùng hash() vì bị salt)."""
+    digest = hashlib.sha256(scope.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def shard_name(index: int) -> str:
+    return f"{SHARD_PREFIX}{index:03d}"
+
+
+def scope_filter(scopes: Sequence[str], where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Điều kiện ``where`` của Chroma chỉ lấy bản ghi thuộc các scope đã cho."""
+    condition: Dict[str, Any] = {"scope": scopes[0]} if len(scopes) == 1 else {"scope": {"$in": list(scopes)}}
+    return {"$and": [condition, where]} if where else condition
+
+
+class ScopedCollection:
+    """Một (hoặc vài) scope bên trong một collection shard, dùng như một collection Chroma.
+
+    Bản ghi được ghi thêm metadata ``scope``; mọi lệnh đọc/xóa đều được lọc theo
+    ``scope`` nên các tenant dùng chung shard không thấy dữ liệu của nhau.
+    """
+
+    def __init__(self, collection, scopes: Sequence[str], on_write=None):
+        self.collection = collection
+        self.scopes = list(scopes)
+        self._on_write = on_write
+
+    @property
+    def name(self) -> str:
+        return f"{self.collection.name}/{','.join(self.scopes)}"
+
+    def upsert(self, ids, documents=None, embeddings=None, metadatas=None) -> None:
+        if len(self.scopes) != 1:
+            raise ValueError("Chỉ ghi được vào một scope")
+        scope = self.scopes[0]
+        metadatas = [dict(meta or {}, scope=scope) for meta in (metadatas or [{} for _ in ids])]
+        self.collection.upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+        if self._on_write:
+            self._on_write(scope)
+
+    def query(self, where: Optional[Dict[str, Any]] = None, **kwargs):
+        return self.collection.query(where=scope_filter(self.scopes, where), **kwargs)
+
+    def get(self, ids=None, where: Optional[Dict[str, Any]] = None, **kwargs):
+        return self.collection.get(ids=ids, where=scope_filter(self.scopes, where), **kwargs)
+
+    def delete(self, ids=None, where: Optional[Dict[str, Any]] = None) -> None:
+        self.collection.delete(ids=ids, where=scope_filter(self.scopes, where))
+
+    def count(self) -> int:
+        return len(self.collection.get(where=scope_filter(self.scopes), include=[])["ids"])
+
+
+class ScopeLog:
+    """Danh sách scope của layout shard, lưu dạng file append-only (mỗi dòng một scope).
+
+    Layout shard không có một collection cho mỗi scope nên không thể liệt kê scope
+    bằng list_collections; file này đóng vai trò registry, đọc tiếp từ offset cũ để
+    thấy scope do tiến trình khác ghi thêm. Scope bị xóa được ghi thành ``{"del": scope}``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._scopes: Dict[str, None] = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Dòng cuối có thể đang được ghi dở, để lại cho lần đọc sau
+        data = data[:data.rfind(b"\n") + 1]
+        self._offset += len(data)
+        for line in data.decode("utf-8").splitlines():
+            if line:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    self._scopes.pop(record["del"], None)
+                else:
+                    self._scopes[record] = None
+
+    def scopes(self) -> List[str]:
+        with self._lock:
+            self._refresh()
+            return list(self._scopes)
+
+    def _append(self, record: Any) -> None:
+        with open(self.path, "ab") as f:
+            if f.tell() > self._offset:
+                f.truncate(self._offset)
+            f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._refresh()
+
+    def add(self, scope: str) -> None:
+        with self._lock:
+            if scope in self._scopes:
+                return
+            with file_lock(self.path + ".lock"):
+                self._refresh()
+                if scope not in self._scopes:
+                    self._append(scope)
+
+    def remove(self, scope: str) -> None:
+        with self._lock, file_lock(self.path + ".lock"):
+            self._refresh()
+            if scope in self._scopes:
+                self._append({"del": scope})
+
+
+def check_layout(storage_path: str, shard_count: int) -> None:
+    """Ghi lại số shard lần đầu dùng layout shard; báo lỗi nếu sau đó số shard bị đổi.
+
+    Scope được gán shard theo hash % shard_count nên đổi số shard sẽ làm dữ liệu cũ
+    nằm sai chỗ.
+    """
+    path = os.path.join(storage_path, "layout.json")
+    os.makedirs(storage_path, exist_ok=True)
+    with file_lock(path + ".lock"):
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("shard_count") != shard_count:
+                raise ValueError(
+                    f"Storage tại {storage_path} dùng {stored.get('shard_count')} shard, không phải {shard_count}"
+                )
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"layout": "sharded", "shard_count": shard_count}, f)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from search_module.utilities.filelock import file_lock
+
+# File registry nguồn đã ingest (JSON lines, chỉ ghi thêm), nằm cạnh ./vector_storage
+SOURCE_REGISTRY_PATH = "./source_registry.jsonl"
+
+
+def source_key(kind: str, identity: str, params: Dict[str, Any]) -> str:
+    """Khóa của một nguồn: loại + định danh (video id, sha256 của PDF) + hash tham số trích xuất.
+
+    Đổi cách chunk (kích thước, ngôn ngữ transcript, ...) cho khóa khác, nên nguồn sẽ
+    được xử lý lại thay vì dùng kết quả cũ.
+    """
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{kind}:{identity}:{digest}"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SourceRegistry:
+    """Nguồn (video, PDF) đã được ingest vào những scope nào, kèm tóm tắt chunk.
+
+    Mỗi bản ghi ``{"key", "scope", "summary"}`` là một dòng trong file log; các tiến
+    trình khác thấy bản ghi mới nhờ đọc tiếp từ offset cũ. Tóm tắt gồm số chunk và
+    chunk đầu tiên, đủ để trả response mà không phải đọc lại dữ liệu. Nguồn bị xóa
+    khỏi một scope (hoặc cả scope bị xóa) được ghi thành bản ghi ``"removed"``.
+    """
+
+    def __init__(self, path: str = SOURCE_REGISTRY_PATH):
+        self.path = path
+        self._sources: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Dòng cuối có thể đang được ghi dở, để lại cho lần đọc sau
+        data = data[:data.rfind(b"\n") + 1]
+        self._offset += len(data)
+        for line in data.decode("utf-8").splitlines():
+            if line:
+                record = json.loads(line)
+                if not record.get("removed"):
+                    self._sources.setdefault(record["key"], {})[record["scope"]] = record["summary"]
+                elif "key" in record:
+                    self._sources.get(record["key"], {}).pop(record["scope"], None)
+                else:
+                    for scopes in self._sources.values():
+                        scopes.pop(record["scope"], None)
+
+    def get(self, key: str) -> Dict[str, Dict[str, Any]]:
+        """scope → tóm tắt, cho mọi scope đã có nguồn này."""
+        with self._lock:
+            self._refresh()
+            return dict(self._sources.get(key, {}))
+
+    def lookup(self, key: str, scope: str) -> Optional[Dict[str, Any]]:
+        return self.get(key).get(scope)
+
+    def add(self, key: str, scope: str, summary: Dict[str, Any]) -> None:
+        self._append({"key": key, "scope": scope, "summary": summary})
+
+    def remove(self, key: str, scope: str) -> None:
+        """Nguồn không còn trong scope (đã bị xóa hoặc thay bằng nội dung khác)."""
+        if self.lookup(key, scope) is not None:
+            self._append({"key": key, "scope": scope, "removed": True})
+
+    def remove_scope(self, scope: str) -> None:
+        """Bỏ mọi nguồn của một scope đã bị xóa."""
+        self._append({"scope": scope, "removed": True})
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, file_lock(self.path + ".lock"):
+            self._refresh()
+            with open(self.path, "ab") as f:
+                # Đang giữ khóa ghi nên phần dư sau dòng cuối là rác của tiến trình đã chết
+                if f.tell() > self._offset:
+                    f.truncate(self._offset)
+                f.write(line.encode("utf-8"))
+            self._refresh()
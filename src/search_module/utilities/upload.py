@@ -0,0 +1,151 @@
+import hashlib
+import os
+import tempfile
+from typing import Any, Dict, Optional
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# Tổng kích thước tối đa của các field không phải file (user, scope, async)
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadError(Exception):
+    """Upload không hợp lệ; status_code là mã HTTP nên trả về cho client."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class PdfUploadReceiver:
+    """Parse body multipart/form-data theo từng khối nhận được từ client.
+
+    Field thường được giữ trong bộ nhớ (tối đa MAX_FIELD_BYTES), part ``file`` được ghi
+    thẳng vào một file tạm riêng trong dest_dir (sha256 tính trong lúc ghi). Vượt quá
+    max_bytes thì dừng ngay với UploadError 413, không đọc phần còn lại của body.
+    """
+
+    def __init__(self, content_type: str, dest_dir: str, max_bytes: int):
+        content_type, params = parse_options_header(content_type or "")
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise UploadError("Body phải là multipart/form-data")
+        self.dest_dir = dest_dir
+        self.max_bytes = max_bytes
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.size = 0
+        self.tmp_path: Optional[str] = None
+        self._digest = hashlib.sha256()
+        self._file = None
+        self._head = b""
+        self._field_bytes = 0
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._part_name: Optional[str] = None
+        self._part_is_file = False
+        self._part_data = bytearray()
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+
+    def write(self, data: bytes) -> None:
+        """Đưa thêm một khối body vào parser (ghi đĩa, nên gọi ngoài event loop)."""
+        try:
+            self._parser.write(data)
+        except UploadError:
+            raise
+        except Exception as e:
+            raise UploadError(f"Body multipart không hợp lệ: {e}")
+
+    def finish(self) -> Dict[str, Any]:
+        """Kết thúc body; trả về field, tên file, đường dẫn file tạm, kích thước và sha256."""
+        self._parser.finalize()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.tmp_path is None:
+            raise UploadError("Thiếu file trong field 'file'")
+        if self.size == 0:
+            raise UploadError("File rỗng")
+        if not self._head.startswith(b"%PDF"):
+            raise UploadError("File không phải PDF")
+        return {
+            "fields": self.fields,
+            "filename": self.filename,
+            "tmp_path": self.tmp_path,
+            "size": self.size,
+            "sha256": self._digest.hexdigest(),
+        }
+
+    def cleanup(self) -> None:
+        """Xóa file tạm (upload lỗi, hoặc file tạm chưa được chuyển đi)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.tmp_path is not None and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def _on_part_begin(self) -> None:
+        self._disposition = b""
+        self._part_name = None
+        self._part_is_file = False
+        self._part_data = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise UploadError("Part multipart thiếu 'name'")
+        self._part_name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" not in options:
+            return
+        if self._part_name != "file" or self.tmp_path is not None:
+            raise UploadError("Chỉ nhận một file trong field 'file'")
+        self._part_is_file = True
+        self.filename = options[b"filename"].decode("utf-8", "replace")
+        # Mỗi upload một file tạm riêng, upload đồng thời cùng tên file không ghi đè nhau
+        fd, self.tmp_path = tempfile.mkstemp(dir=self.dest_dir, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        block = data[start:end]
+        if not self._part_is_file:
+            self._field_bytes += len(block)
+            if self._field_bytes > MAX_FIELD_BYTES:
+                raise UploadError(f"Các field vượt quá {MAX_FIELD_BYTES} bytes", 413)
+            self._part_data.extend(block)
+            return
+        self.size += len(block)
+        if self.size > self.max_bytes:
+            raise UploadError(f"File vượt quá {self.max_bytes} bytes", 413)
+        if len(self._head) < 4:
+            self._head += block[:4 - len(self._head)]
+            if len(self._head) == 4 and self._head != b"%PDF":
+                raise UploadError("File không phải PDF")
+        self._digest.update(block)
+        self._file.write(block)
+
+    def _on_part_end(self) -> None:
+        if self._part_is_file:
+            self._file.close()
+            self._file = None
+        elif self._part_name is not None:
+            self.fields[self._part_name] = self._part_data.decode("utf-8", "replace")
@@ -1,21 +1,111 @@
-import yt_dlp
+import gzip
 import json
+import logging
 import re
 import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qs, urlparse
 
-def get_youtube_transcript(url, lang="en"):
-    ydl_opts = {
-        "quiet": True,
-        "writesubtitles": True,
-        "subtitleslangs": [lang, "en"],
-        "skip_download": True,
-        "extractor_args": {
-            "youtube": {"player_client": ["web"]}
-        },
-    }
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        try:
+from search_module.utilities import chunker
+from search_module.utilities.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+_FETCH_SECONDS = METRICS.histogram("youtube_fetch_seconds", "Thời gian lấy thông tin video và transcript từ YouTube (giây)")
+_CACHE_HITS = METRICS.counter("transcript_cache_hits_total", "Số lần transcript được đọc từ cache")
+_CACHE_MISSES = METRICS.counter("transcript_cache_misses_total", "Số lần transcript phải lấy từ nguồn")
+
+# Thư mục cache transcript đã tách (theo video id + ngôn ngữ)
+TRANSCRIPT_CACHE_PATH = "./transcript_cache"
+
+# Số từ mỗi chunk transcript khi chia theo từ (chunker.CHUNK_MODE = "words")
+CHUNK_SIZE = 250
+
+# Số video được lấy transcript song song khi ingest nhiều URL / playlist
+YOUTUBE_FETCH_WORKERS = 4
+
+_VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+
+def youtube_video_id(url):
+    """Video id chuẩn (11 kí tự) từ các dạng URL watch?v=, youtu.be/, /shorts/, /embed/, /live/; None nếu không nhận ra."""
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or "").lower()
+    if host.startswith("www.") or host.startswith("m."):
+        host = host.split(".", 1)[1]
+    candidate = None
+    if host == "youtu.be":
+        candidate = parsed.path.lstrip("/").split("/")[0]
+    elif host in ("youtube.com", "music.youtube.com", "youtube-nocookie.com"):
+        parts = parsed.path.strip("/").split("/")
+        if parts[0] == "watch":
+            candidate = parse_qs(parsed.query).get("v", [None])[0]
+        elif len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+            candidate = parts[1]
+    if candidate and _VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+
+def youtube_playlist_id(url):
+    """Playlist id của URL dạng ``/playlist?list=...``; None nếu không phải playlist.
+
+    URL ``watch?v=...&list=...`` được coi là một video (video đang mở trong playlist).
+    """
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or "").lower()
+    if host.startswith("www.") or host.startswith("m."):
+        host = host.split(".", 1)[1]
+    if host not in ("youtube.com", "music.youtube.com") or parsed.path.rstrip("/") != "/playlist":
+        return None
+    playlist_id = parse_qs(parsed.query).get("list", [None])[0]
+    return playlist_id if playlist_id and re.match(r"^[A-Za-z0-9_-]+$", playlist_id) else None
+
+
+def video_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def extraction_params(lang="en"):
+    """Tham số ảnh hưởng tới chunk sinh ra từ một video, dùng trong khóa của registry nguồn."""
+    return dict(chunker.chunk_params(CHUNK_SIZE), lang=lang)
+
+class TranscriptFetcher(ABC):
+    """Nguồn lấy caption của video: trả về (dữ liệu caption dạng json3 có "events", title).
+
+    Ghép bản cài đặt khác (thư mục caption đã ghi sẵn, server fixture cục bộ, ...) bằng
+    set_fetcher() hoặc tham số fetcher= để chạy test và benchmark không cần mạng.
+    """
+
+    @abstractmethod
+    def fetch(self, url, lang="en"):
+        """(dữ liệu caption, title) của một video."""
+
+    @abstractmethod
+    def playlist(self, url):
+        """URL các video trong playlist, theo thứ tự của playlist."""
+
+
+class YtDlpFetcher(TranscriptFetcher):
+    """Lấy caption từ YouTube qua yt_dlp (ưu tiên phụ đề thật, rồi tới phụ đề tự động)."""
+
+    def fetch(self, url, lang="en"):
+        # yt_dlp nặng, chỉ import khi ingest YouTube lần đầu
+        import yt_dlp
+
+        ydl_opts = {
+            "quiet": True,
+            "writesubtitles": True,
+            "subtitleslangs": [lang, "en"],
+            "skip_download": True,
+            "extractor_args": {
+                "youtube": {"player_client": ["web"]}
+            },
+        }
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             info_dict = ydl.extract_info(url, download=False)
             title = info_dict.get("title", "youtube_transcript")
             subtitles = info_dict.get("subtitles", {})
@@ -30,16 +120,155 @@ def get_youtube_transcript(url, lang="en"):
             elif "en" in automatic_captions:
                 subtitle_url = automatic_captions["en"][0]["url"]
             else:
-                print("No subtitles found")
                 return None, title
 
             transcript = ydl.urlopen(subtitle_url).read().decode("utf-8")
-            transcript_dict = json.loads(transcript)
-            return extract_utf_from_events(transcript_dict), title
+            return json.loads(transcript), title
 
-        except Exception as e:
-            print(f"Error occurred while fetching subtitles: {e}")
+    def playlist(self, url):
+        import yt_dlp
+
+        # extract_flat: chỉ lấy danh sách id, không mở từng video
+        with yt_dlp.YoutubeDL({"quiet": True, "extract_flat": "in_playlist", "skip_download": True}) as ydl:
+            info_dict = ydl.extract_info(url, download=False)
+        return [video_url(entry["id"]) for entry in info_dict.get("entries") or [] if entry and entry.get("id")]
+
+
+class DirectoryFetcher(TranscriptFetcher):
+    """Caption đã ghi sẵn: ``{video_id}.{lang}.json`` (json3, có thể thêm khóa "title"), thiếu thì dùng bản "en"."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, url, lang="en"):
+        video_id = youtube_video_id(url)
+        for candidate in dict.fromkeys([lang, "en"]):
+            file_path = os.path.join(self.path, f"{video_id}.{candidate}.json")
+            if video_id and os.path.exists(file_path):
+                with open(file_path, encoding="utf-8") as f:
+                    data = json.load(f)
+                return data, data.get("title", video_id)
+        return None, "youtube_transcript"
+
+    def playlist(self, url):
+        # ``{playlist_id}.playlist.json``: danh sách video id hoặc URL
+        with open(os.path.join(self.path, f"{youtube_playlist_id(url)}.playlist.json"), encoding="utf-8") as f:
+            entries = json.load(f)
+        return [entry if "/" in entry else video_url(entry) for entry in entries]
+
+
+class HttpFetcher(TranscriptFetcher):
+    """Caption từ một server HTTP (vd. server fixture cục bộ): GET ``{base_url}/{video_id}/{lang}.json``."""
+
+    def __init__(self, base_url, timeout_s=10.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout_s = timeout_s
+
+    def fetch(self, url, lang="en"):
+        from urllib.error import HTTPError
+        from urllib.request import urlopen
+
+        video_id = youtube_video_id(url)
+        if not video_id:
             return None, "youtube_transcript"
+        try:
+            with urlopen(f"{self.base_url}/{video_id}/{lang}.json", timeout=self.timeout_s) as response:
+                data = json.loads(response.read().decode("utf-8"))
+        except HTTPError as e:
+            if e.code == 404:
+                return None, video_id
+            raise
+        return data, data.get("title", video_id)
+
+    def playlist(self, url):
+        from urllib.request import urlopen
+
+        with urlopen(f"{self.base_url}/playlist/{youtube_playlist_id(url)}.json", timeout=self.timeout_s) as response:
+            entries = json.loads(response.read().decode("utf-8"))
+        return [entry if "/" in entry else video_url(entry) for entry in entries]
+
+
+class TranscriptCache:
+    """Transcript đã tách (``extract_utf_from_events``) và title, mỗi (video, ngôn ngữ) một file gzip JSON."""
+
+    def __init__(self, path=TRANSCRIPT_CACHE_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, video_id, lang):
+        return os.path.join(self.path, f"{video_id}.{sanitize_filename(lang)}.json.gz")
+
+    def get(self, video_id, lang):
+        """(transcript, title) hoặc None nếu chưa có (hoặc file hỏng)."""
+        try:
+            with gzip.open(self._file(video_id, lang), "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data["segments"], data["title"]
+
+    def put(self, video_id, lang, segments, title):
+        file_path = self._file(video_id, lang)
+        # Ghi ra file tạm rồi đổi tên để tiến trình khác không đọc phải file ghi dở
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"title": title, "segments": segments}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, file_path)
+
+
+_fetcher = None
+_cache = None
+
+
+def set_fetcher(fetcher):
+    """Đổi nguồn lấy caption mặc định (None để quay về yt_dlp)."""
+    global _fetcher
+    _fetcher = fetcher
+
+
+def get_fetcher():
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = YtDlpFetcher()
+    return _fetcher
+
+
+def get_transcript_cache():
+    global _cache
+    if _cache is None:
+        _cache = TranscriptCache()
+    return _cache
+
+
+def get_youtube_transcript(url, lang="en", fetcher=None, cache=None):
+    """(transcript [[tStartMs, text], ...], title); đọc từ cache nếu video đã được lấy trước đó.
+
+    Transcript chỉ được cache khi lấy thành công; lỗi hoặc video không có phụ đề sẽ
+    được thử lại ở lần sau.
+    """
+    video_id = youtube_video_id(url)
+    cache = get_transcript_cache() if cache is None else cache
+    if video_id and cache:
+        cached = cache.get(video_id, lang)
+        if cached is not None:
+            _CACHE_HITS.inc()
+            return cached
+        _CACHE_MISSES.inc()
+
+    try:
+        with _FETCH_SECONDS.time():
+            data, title = (fetcher or get_fetcher()).fetch(url, lang)
+    except Exception as e:
+        logger.warning("fetch subtitles failed", extra={"url": url, "error": str(e)})
+        return None, "youtube_transcript"
+    if not data:
+        logger.info("no subtitles found", extra={"url": url})
+        return None, title
+
+    segments = extract_utf_from_events(data)
+    if video_id and cache and segments:
+        cache.put(video_id, lang, segments, title)
+    return segments, title
 
 def extract_utf_from_events(data):
     utf_scripts = []
@@ -53,7 +282,7 @@ def extract_utf_from_events(data):
                 utf_scripts.append([event["tStartMs"], " ".join(utf_event)])
     return utf_scripts
 
-def chunk_text(data, chunk_size=250):
+def chunk_text(data, chunk_size=CHUNK_SIZE):
     chunks = []
     current_chunk = []
     current_chunk_word_count = 0
@@ -85,6 +314,15 @@ def chunk_text(data, chunk_size=250):
 
     return chunks
 
+def chunk_transcript(data):
+    """Chunk transcript [[tStartMs, text], ...] theo chunker.CHUNK_MODE, location là mốc thời gian."""
+    if chunker.CHUNK_MODE == "words":
+        return chunk_text(data)
+    return [
+        dict(chunk, location=time_output(chunk["location"]))
+        for chunk in chunker.TokenChunker().chunk_spans(data)
+    ]
+
 def time_output(time_ms):
     hours = time_ms // 3600000
     minutes = (time_ms // 60000) % 60
@@ -95,12 +333,12 @@ def sanitize_filename(name):
     name = name.strip().replace(" ", "_")
     return re.sub(r'[\\/*?:"<>|]', "", name)
 
-def process_youtube(url = "http://youtube.com/watch?v=9vM4p9NN0Ts", scope= "IT3190E", lang="en"): # test hamf nayf
-    transcript_data, title = get_youtube_transcript(url, lang)
+def process_youtube(url = "http://youtube.com/watch?v=9vM4p9NN0Ts", scope= "IT3190E", lang="en", fetcher=None): # test hamf nayf
+    transcript_data, title = get_youtube_transcript(url, lang, fetcher)
 
     if transcript_data:
         transcript = " ".join([x[1] for x in transcript_data])
-        chunks = chunk_text(transcript_data)
+        chunks = chunk_transcript(transcript_data)
         for c_id in range(len(chunks)):
             chunks[c_id]["chunk_source"] = url
             chunks[c_id]["chunk_scope"] = scope
@@ -111,6 +349,60 @@ def process_youtube(url = "http://youtube.com/watch?v=9vM4p9NN0Ts", scope= "IT31
     else:
         return None, "youtube_transcript"
 
+def expand_youtube_urls(urls, fetcher=None):
+    """Danh sách URL video từ URL video và URL playlist, bỏ video trùng (giữ lần xuất hiện đầu).
+
+    Trả về (urls, errors); errors là {url playlist: lỗi} cho playlist không đọc được.
+    """
+    expanded = []
+    errors = {}
+    for url in urls:
+        if youtube_playlist_id(url):
+            try:
+                expanded.extend((fetcher or get_fetcher()).playlist(url))
+            except Exception as e:
+                logger.warning("read playlist failed", extra={"url": url, "error": str(e)})
+                errors[url] = str(e)
+        else:
+            expanded.append(url)
+    seen = set()
+    unique = []
+    for url in expanded:
+        key = youtube_video_id(url) or url
+        if key not in seen:
+            seen.add(key)
+            unique.append(url)
+    return unique, errors
+
+
+def iter_process_youtube(urls, scope, lang="en", fetcher=None, workers=YOUTUBE_FETCH_WORKERS):
+    """Lấy transcript và chunk nhiều video song song (tối đa ``workers`` video cùng lúc).
+
+    Sinh (url, chunks, title) theo thứ tự video xong trước; chunks là None nếu video lỗi
+    hoặc không có phụ đề. Lỗi của một video không làm dừng các video khác.
+    """
+    if not urls:
+        return
+
+    def task(url):
+        try:
+            return process_youtube(url, scope, lang, fetcher)
+        except Exception as e:
+            logger.warning("process youtube failed", extra={"url": url, "error": str(e)})
+            return None, "youtube_transcript"
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls))), thread_name_prefix="youtube-fetch") as pool:
+        futures = {pool.submit(task, url): url for url in urls}
+        try:
+            for future in as_completed(futures):
+                chunks, title = future.result()
+                yield futures[future], chunks, title
+        finally:
+            # Người dùng dừng sớm: bỏ các video chưa bắt đầu lấy
+            for future in futures:
+                future.cancel()
+
+
 def quick_test_youtube():
     url = "https://www.youtube.com/watch?v=Rvppog1HZJY&t=3s"
     scope = "IT3190E"
@@ -2,9 +2,13 @@ import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 import pytest
-from search_module.utilities.db_helper import VectorDatabase
+from search_module.utilities.db_helper import EmbeddingBatcher, LocalEmbeddingFunction, VectorDatabase
 from search_module.utilities.youtube import process_youtube
 from search_module.utilities.pdf import process_pdf
+from benchmarks.sample_pdf import make_pdf
+from search_module.utilities.embedding_cache import EmbeddingCache, content_hash
+from search_module.utilities.keyword_index import KeywordIndex
+from search_module.utilities.jobs import JobManager, JobQueueFull
 import os
 
 
@@ -227,3 +231,936 @@ def test_word_search_multiple_scopes(db_with_chunks):
             # Kiểm tra không có giá trị None
             for field in required_fields:
                 assert item[field] is not None, f"Giá trị của '{field}' trong word_search không được None"
+
+def test_add_chunks_bulk(youtube_chunks_sample):
+    """Test add_chunks thêm cả list chunk trong một lần ghi và bỏ qua chunk rỗng."""
+    db = VectorDatabase()
+    chunks = youtube_chunks_sample + [dict(youtube_chunks_sample[0], text="   ", chunk_id=51)]
+    res = db.add_chunks(chunks, batch_size=1)
+    assert res["status"] == "success", f"Failed to add chunks: {res.get('errors')}"
+    assert res["added"] == 2
+    assert res["skipped"] == 1
+    assert len(res["chunk_ids"]) == 2
+
+def test_embed_query_uses_cache():
+    """Test câu truy vấn giống nhau chỉ embed một lần, hit/miss được đếm."""
+    db = VectorDatabase(query_cache_size=8)
+    first = db.embed_query("Machine  Learning")
+    second = db.embed_query("machine learning")
+    assert first == second
+    stats = db.query_cache_stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+    res = client.get("/stats")
+    assert res.status_code == 200
+    assert "query_cache" in res.json()
+
+def test_embedding_cache_persists_across_instances(tmp_path):
+    """Test cache embedding trên đĩa: mở lại vẫn đọc được vector, key trùng không ghi thêm."""
+    assert content_hash("see  you\nnext time") == content_hash("see you next time")
+
+    cache = EmbeddingCache(str(tmp_path), model_version="test")
+    keys = [content_hash(f"chunk {i}") for i in range(1500)]
+    cache.put_many(keys, [[float(i), 1.0, 2.0] for i in range(1500)])
+    cache.put_many(keys[:1], [[9.0, 9.0, 9.0]])
+
+    reopened = EmbeddingCache(str(tmp_path), model_version="test")
+    assert len(reopened) == 1500
+    # Instance mở trước vẫn thấy vector do instance khác ghi thêm
+    reopened.put_many(["other"], [[7.0, 7.0, 7.0]])
+    assert cache.get_many(["other"])["other"] == [7.0, 7.0, 7.0]
+    found = reopened.get_many([keys[0], keys[1499], "missing"])
+    assert found[keys[0]] == [0.0, 1.0, 2.0]
+    assert found[keys[1499]] == [1499.0, 1.0, 2.0]
+    assert "missing" not in found
+
+
+def test_embedding_cache_float16_is_compact_and_separate(tmp_path):
+    """Test cache float16: thư mục riêng, file vector nhỏ bằng nửa, sai số nhỏ."""
+    import numpy as np
+
+    keys = [content_hash(f"chunk {i}") for i in range(100)]
+    vectors = np.random.default_rng(0).normal(size=(100, 384)).astype(np.float32)
+    full = EmbeddingCache(str(tmp_path), model_version="test")
+    half = EmbeddingCache(str(tmp_path), model_version="test", dtype="float16")
+    full.put_many(keys, vectors.tolist())
+    half.put_many(keys, vectors.tolist())
+
+    assert half.dir != full.dir
+    assert os.path.getsize(os.path.join(half.dir, "vectors.bin")) * 2 == os.path.getsize(os.path.join(full.dir, "vectors.bin"))
+    found = EmbeddingCache(str(tmp_path), model_version="test", dtype="float16").get_many(keys)
+    assert np.allclose([found[key] for key in keys], vectors, atol=1e-2)
+
+
+def test_add_chunks_is_idempotent(youtube_chunks_sample):
+    """Test upload lại cùng nội dung cho cùng chunk id, không tạo bản trùng."""
+    db = VectorDatabase()
+    first = db.add_chunks(youtube_chunks_sample)
+    second = db.add_chunks(youtube_chunks_sample)
+    assert first["chunk_ids"] == second["chunk_ids"]
+    collection = db.get_collection_by_scope("scope_IT3190E")
+    assert len(collection.get(ids=first["chunk_ids"])["ids"]) == len(youtube_chunks_sample)
+
+
+def test_chunk_ids_distinguish_sources(tmp_path):
+    """Test hai nguồn có cùng text ở cùng chunk_id trong một scope không ghi đè lên nhau."""
+    db = VectorDatabase(storage_path=str(tmp_path / "db"), keyword_index_path=str(tmp_path / "kw"),
+                        embedding_cache_path=None)
+
+    def chunk(source, scope="CP01"):
+        return {"text": "Introduction", "location": 1, "chunk_source": source, "chunk_scope": scope,
+                "chunk_source_type": "pdf", "chunk_id": 1, "source_key": source}
+
+    ids = db.add_chunks([chunk("a.pdf"), chunk("b.pdf")])["chunk_ids"]
+    assert len(set(ids)) == 2
+    assert db.delete_source("CP01", "a.pdf")["deleted"] == 1
+    hits = db.word_search("introduction", "CP01")["scope_CP01"]
+    assert [hit["chunk_source"] for hit in hits] == ["b.pdf"]
+
+    # Chunk được chép sang scope khác có cùng id như khi add_chunks nguồn đó
+    copied = db.copy_source("b.pdf", "CP01", "CP02")
+    assert copied["ids"] == db.add_chunks([chunk("b.pdf", scope="CP02")])["chunk_ids"]
+
+
+def test_keyword_index_phrase_prefix_and_persistence(tmp_path):
+    """Test index từ khóa: khớp cụm từ liên tiếp, từ đầu/cuối khớp một phần term, và nạp lại từ log."""
+    index = KeywordIndex(str(tmp_path))
+    index.add("scope_A", ["c1", "c2", "c3"], [
+        "See you next time.",
+        "you see, next time we will see",
+        "Machine learning is fun",
+    ])
+    assert list(index.candidates("scope_A", "see you")) == ["c1"]
+    assert list(index.candidates("scope_A", "SEE")) == ["c1", "c2"]
+    assert list(index.candidates("scope_A", "machine learn")) == ["c3"]
+    assert list(index.candidates("scope_A", "earning is")) == ["c3"]
+    assert list(index.candidates("scope_A", " earning")) == []
+    assert list(index.candidates("scope_A", "unknown words")) == []
+    # Không có từ nào: mọi chunk đều là ứng viên
+    assert list(index.candidates("scope_A", "?!")) == ["c1", "c2", "c3"]
+
+    reopened = KeywordIndex(str(tmp_path))
+    assert reopened.exists("scope_A")
+    assert list(reopened.candidates("scope_A", "next time")) == ["c1", "c2"]
+    assert not reopened.exists("scope_B")
+
+
+def test_word_search_matches_substrings(youtube_chunks_sample, tmp_path):
+    """Test word_search giữ ngữ nghĩa chuỗi con không phân biệt hoa thường của cách quét cũ."""
+    db = VectorDatabase(storage_path=str(tmp_path / "db"), keyword_index_path=str(tmp_path / "kw"),
+                        embedding_cache_path=None, result_cache_size=0)
+    base = youtube_chunks_sample[0]
+    texts = ["Machine learning basics", "I love C programming", "Notes on C++ templates", "see  you later"]
+    db.add_chunks([dict(base, chunk_id=900 + i, text=text) for i, text in enumerate(texts)])
+
+    def found(query):
+        return [hit["text"] for hit in db.word_search(query, "IT3190E", k=10)["scope_IT3190E"]]
+
+    assert found("earning") == ["Machine learning basics"]
+    assert found("ning basics") == ["Machine learning basics"]
+    assert found("MACHINE LEARNING") == ["Machine learning basics"]
+    assert found("c++") == ["Notes on C++ templates"]
+    assert found("++") == ["Notes on C++ templates"]
+    # Khoảng trắng là một phần của chuỗi con
+    assert found("see  you") == ["see  you later"]
+    assert "see  you later" not in found("see you")
+
+
+def test_word_search_finds_own_scope(db_with_chunks):
+    """Test word_search trả về kết quả của chính scope hiện tại qua index."""
+    results = db_with_chunks.word_search("see you", scope="IT3190E", k=5)
+    hits = results["scope_IT3190E"]
+    assert len(hits) == 1
+    assert hits[0]["chunk_id"] == 50
+
+def test_hybrid_search_fuses_rankings(db_with_chunks):
+    """Test hybrid_search trả về một danh sách top-k toàn cục có rrf_score giảm dần."""
+    results = db_with_chunks.hybrid_search("see you", scope="IT3190E", k=3)["results"]
+    assert 0 < len(results) <= 3
+    scores = [hit["rrf_score"] for hit in results]
+    assert scores == sorted(scores, reverse=True)
+    # Chunk khớp cả từ khóa lẫn semantic phải đứng đầu
+    assert results[0]["chunk_id"] == 50
+    assert set(results[0]["matched_by"]) == {"semantic", "word"}
+
+    res = client.post("/", files=create_upload_file({"user": "tester", "search": "see you", "mod": "hybrid", "scope": "IT3190E"}))
+    assert res.status_code == 200
+    assert "results" in res.json()
+
+def test_global_search_merges_scopes_and_reports_timeouts(db_with_chunks):
+    """Test global_search gộp top-k của mọi scope và báo scope hết deadline."""
+    res = db_with_chunks.global_search("tokenizer", scope="IT3190E", k=2, mod="semantic")
+    assert len(res["results"]) <= 2
+    assert res["timed_out_scopes"] == []
+    scores = [hit["similarity_score"] for hit in res["results"]]
+    assert scores == sorted(scores, reverse=True)
+
+    assert "scope_IT3190E" in db_with_chunks.get_all_scopes()
+    res = db_with_chunks.global_search("see you", scope="IT3190E", k=2, mod="word", deadline_s=0)
+    assert res["results"] == []
+    assert "scope_IT3190E" in res["timed_out_scopes"]
+
+
+def test_fanout_deadline_is_optional_and_skips_queued_tasks():
+    """Test fanout: không có deadline thì chờ mọi scope; hết deadline thì task còn xếp hàng không chạy."""
+    import threading
+    import time
+    from search_module.utilities.fanout import SEARCH_DEADLINE_S, ScopeFanout
+
+    assert SEARCH_DEADLINE_S is None
+    fanout = ScopeFanout(max_workers=1)
+    results, errors, timed_out = fanout.run({"slow": lambda: time.sleep(0.3) or "done"})
+    assert results == {"slow": "done"} and not errors and not timed_out
+
+    ran = []
+    release = threading.Event()
+    tasks = {"busy": lambda: release.wait(1) and "busy", "queued": lambda: ran.append("queued")}
+    results, errors, timed_out = fanout.run(tasks, deadline_s=0.05)
+    assert sorted(timed_out) == ["busy", "queued"]
+    release.set()
+    time.sleep(0.1)
+    assert ran == []
+    fanout.shutdown()
+
+
+def test_job_manager_runs_jobs_and_rejects_when_full():
+    """Test job chạy nền báo tiến độ/kết quả, hàng đợi đầy thì ném JobQueueFull."""
+    import threading
+    import time
+
+    release = threading.Event()
+    manager = JobManager(num_workers=1, max_queue=1)
+
+    def blocking(job):
+        job.progress("embedding", 1, 2)
+        release.wait(5)
+        return {"status": "success"}
+
+    running = manager.submit("pdf", blocking)
+    while running.status == "queued":
+        time.sleep(0.01)
+    manager.submit("pdf", lambda job: {"status": "error", "message": "boom"})
+    with pytest.raises(JobQueueFull):
+        manager.submit("pdf", blocking)
+
+    release.set()
+    deadline = time.time() + 5
+    while manager.get(running.id).finished_at is None and time.time() < deadline:
+        time.sleep(0.01)
+    status = manager.get(running.id).to_dict()
+    assert status["status"] == "succeeded"
+    assert status["progress"] == {"stage": "embedding", "done": 1, "total": 2}
+
+
+def test_async_pdf_ingestion_returns_job_id():
+    """Test thêm PDF trả về job id ngay, trạng thái job tra cứu được qua /jobs."""
+    import base64
+    import time
+
+    payload = {"user": "tester", "add": "pdf", "scope": "IT3190E", "filename": "broken.pdf",
+               "data": base64.b64encode(b"not a pdf").decode()}
+    res = client.post("/", files=create_upload_file(payload))
+    assert res.status_code == 202
+    job_id = res.json()["job_id"]
+
+    deadline = time.time() + 10
+    status = client.get(f"/jobs/{job_id}").json()
+    while status["status"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.05)
+        status = client.get(f"/jobs/{job_id}").json()
+    assert status["status"] == "failed"
+    assert client.get("/jobs/unknown").status_code == 404
+
+def test_upload_pdf_multipart_streams_to_disk(monkeypatch):
+    """Test upload multipart: tính sha256, từ chối file không phải PDF và file quá lớn."""
+    import hashlib
+    import io
+    import search_module.app as app_module
+
+    body = b"%PDF-1.4\n" + b"0" * 5000
+    res = client.post(
+        "/upload/pdf",
+        files={"file": ("lecture.pdf", io.BytesIO(body), "application/pdf")},
+        data={"user": "tester", "scope": "IT3190E", "async": "false"},
+    )
+    # Nội dung không đọc được như PDF thật nhưng file vẫn được lưu và hash đúng
+    assert res.json()["sha256"] == hashlib.sha256(body).hexdigest()
+    assert res.json()["size"] == len(body)
+
+    res = client.post(
+        "/upload/pdf",
+        files={"file": ("notes.pdf", io.BytesIO(b"hello"), "application/pdf")},
+        data={"user": "tester", "scope": "IT3190E"},
+    )
+    assert res.status_code == 400
+
+    monkeypatch.setattr(app_module, "MAX_UPLOAD_BYTES", 1000)
+    monkeypatch.setattr(app_module, "UPLOAD_CHUNK_SIZE", 256)
+    res = client.post(
+        "/upload/pdf",
+        files={"file": ("big.pdf", io.BytesIO(body), "application/pdf")},
+        data={"user": "tester", "scope": "IT3190E"},
+    )
+    assert res.status_code == 413
+    assert not os.path.exists(os.path.join(app_module.CACHE_DIR, app_module.salt_user("tester"), "big.pdf"))
+    # Content-Length vượt giới hạn bị từ chối trước khi đọc body; không còn file tạm sót lại
+    monkeypatch.setattr(app_module, "UPLOAD_FORM_OVERHEAD", 0)
+    res = client.post(
+        "/upload/pdf",
+        files={"file": ("big.pdf", io.BytesIO(body), "application/pdf")},
+        data={"user": "tester", "scope": "IT3190E"},
+    )
+    assert res.status_code == 413
+    assert not [name for name in os.listdir(app_module.CACHE_DIR) if name.endswith(".part")]
+
+
+def test_concurrent_uploads_of_same_filename_do_not_mix():
+    """Test hai upload đồng thời cùng tên file: mỗi upload có file tạm riêng, file cuối cùng nguyên vẹn."""
+    import hashlib
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+    import search_module.app as app_module
+
+    bodies = [b"%PDF-1.4\n" + bytes([ord("a") + i]) * 3_000_000 for i in range(2)]
+
+    def upload(body):
+        return client.post(
+            "/upload/pdf",
+            files={"file": ("same.pdf", io.BytesIO(body), "application/pdf")},
+            data={"user": "upload-u", "scope": "UP01", "async": "false"},
+        ).json()["sha256"]
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        digests = list(pool.map(upload, bodies))
+    assert digests == [hashlib.sha256(body).hexdigest() for body in bodies]
+    with open(os.path.join(app_module.CACHE_DIR, app_module.salt_user("upload-u"), "same.pdf"), "rb") as f:
+        assert hashlib.sha256(f.read()).hexdigest() in digests
+
+
+def test_parallel_pdf_extraction_keeps_page_order(tmp_path, monkeypatch):
+    """Test đọc PDF song song cho cùng kết quả, cùng thứ tự trang với đọc tuần tự."""
+    from search_module.utilities import pdf
+
+    pdf_path = tmp_path / "book.pdf"
+    pdf_path.write_bytes(make_pdf([f"page {i} word{i}" for i in range(1, 21)]))
+
+    serial = list(pdf.iter_pages(str(pdf_path), workers=1))
+    assert [page for page, _ in serial] == list(range(1, 21))
+    assert "word7" in serial[6][1]
+
+    monkeypatch.setattr(pdf, "PDF_PARALLEL_MIN_PAGES", 4)
+    seen = []
+    parallel = list(pdf.iter_pages(str(pdf_path), progress=lambda done, total: seen.append((done, total)),
+                                   workers=2, pages_per_task=3))
+    assert parallel == serial
+    assert seen[-1] == (20, 20)
+
+    chunks, title = pdf.process_pdf(str(pdf_path), scope="IT3190E")
+    assert [chunk["chunk_id"] for chunk in chunks] == list(range(1, 21))
+    assert chunks[0]["location"] == 1
+
+
+def test_embedding_batcher_coalesces_concurrent_callers():
+    """Test các caller đồng thời được gom chung một lần inference, vector trả về đúng caller."""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    calls = []
+
+    def fake_embed(texts):
+        calls.append(len(texts))
+        time.sleep(0.01)
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(fake_embed, max_batch_size=64, max_wait_ms=50)
+    texts = ["x" * i for i in range(1, 21)]
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        results = list(pool.map(lambda text: batcher([text])[0], texts))
+
+    assert results == [[float(i)] for i in range(1, 21)]
+    assert sum(calls) == 20
+    assert len(calls) < 20
+    stats = batcher.stats()
+    assert stats["batch_size"]["count"] == len(calls)
+    assert stats["queue_wait_ms"]["count"] == 20
+
+    failing = EmbeddingBatcher(lambda texts: 1 / 0, max_wait_ms=0)
+    with pytest.raises(ZeroDivisionError):
+        failing(["boom"])
+
+
+def test_concurrent_http_searches_share_embedding_batches():
+    """Test search đồng thời qua HTTP chạy song song nên query embedding được gom batch (mean > 1)."""
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from search_module.app import get_db
+
+    batcher = get_db().query_batcher
+    before = batcher.stats()["batch_size"]
+    barrier = threading.Barrier(16)
+
+    def search(i):
+        barrier.wait()
+        payload = {"user": "batch-u", "search": f"concurrent query number {i}", "scope": "CB01", "mod": "semantic"}
+        return shared_loop.post("/", files=create_upload_file(payload)).status_code
+
+    # Client trong "with" dùng một event loop cho mọi request, như server thật
+    with TestClient(app) as shared_loop, ThreadPoolExecutor(max_workers=16) as pool:
+        assert list(pool.map(search, range(16))) == [200] * 16
+
+    after = batcher.stats()["batch_size"]
+    batches = after["count"] - before["count"]
+    assert after["sum"] - before["sum"] == 16
+    assert 16 / batches > 1
+
+
+def test_embedding_ignores_padding_and_keeps_input_order():
+    """Test vector của một text không đổi khi được embed chung batch với text dài hơn."""
+    import numpy as np
+
+    engine = LocalEmbeddingFunction(batch_size=2)
+    texts = ["see you next time. " * 30, "tokenizer", "machine learning is fun", "a"]
+    together = engine(texts)
+    alone = [engine([text])[0] for text in texts]
+    assert len(together) == len(texts)
+    for a, b in zip(together, alone):
+        assert np.allclose(a, b, atol=1e-5)
+
+
+def test_import_app_is_lazy():
+    """Test import app không tạo DB và không import chromadb, transformers, yt_dlp, PyPDF2."""
+    import subprocess
+    import sys
+
+    code = (
+        "import sys, search_module.app as app; "
+        "assert app._db is None; "
+        "heavy = {'chromadb', 'transformers', 'yt_dlp', 'PyPDF2'} & set(sys.modules); "
+        "assert not heavy, heavy"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_healthz_and_readyz_after_warmup():
+    """Test liveness luôn 200, readiness 200 sau khi warmup xong."""
+    import time
+
+    assert client.get("/healthz").json() == {"status": "ok"}
+    # Lifespan chạy warmup nền khi TestClient được mở bằng context manager
+    with TestClient(app) as started:
+        deadline = time.time() + 30
+        res = started.get("/readyz")
+        while res.status_code == 503 and res.json()["status"] == "starting" and time.time() < deadline:
+            time.sleep(0.05)
+            res = started.get("/readyz")
+        assert res.status_code == 200
+        assert res.json()["warmup_ms"] is not None
+
+
+def test_routes_return_503_while_warming_up(example_search):
+    """Test trong lúc warmup nền chưa xong: search/ingest trả 503 ngay, /healthz vẫn 200."""
+    import threading
+    import search_module.app as app_module
+
+    # Chờ warmup của các test trước (lifespan của TestClient) xong, tránh nó clear cờ giữa chừng
+    for thread in threading.enumerate():
+        if thread.name == "warmup":
+            thread.join()
+    app_module._warming.set()
+    try:
+        res = client.post("/", files=create_upload_file(example_search | {"user": "warm-u"}))
+        assert res.status_code == 503 and res.headers["retry-after"] == "1"
+        assert client.post("/upload/pdf", data={"user": "warm-u"},
+                           files={"file": ("a.pdf", b"%PDF-1.4", "application/pdf")}).status_code == 503
+        assert client.get("/healthz").status_code == 200
+    finally:
+        app_module._warming.clear()
+    assert client.post("/", files=create_upload_file(example_search | {"user": "warm-u"})).status_code == 200
+
+
+def test_metrics_endpoint_exports_stage_histograms(db_with_chunks):
+    """Test /metrics: định dạng Prometheus, có histogram theo mode/giai đoạn và số scope/chunk."""
+    payload = {"user": "tester", "search": "tokenizer", "scope": "IT3190E", "mod": "semantic"}
+    assert client.post("/", files=create_upload_file(payload)).status_code == 200
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    text = res.text
+    assert "# TYPE request_duration_seconds histogram" in text
+    assert 'request_duration_seconds_count{mode="semantic"}' in text
+    assert 'request_duration_seconds_bucket{mode="semantic",le="+Inf"}' in text
+    for name in ("embedding_tokenize_seconds_count", "onnx_inference_seconds_count",
+                 "onnx_inference_batch_size_count", 'chroma_operation_seconds_count{op="query"}',
+                 'chroma_operation_seconds_count{op="upsert"}', "vector_db_scopes ", "vector_db_chunks "):
+        assert name in text, name
+
+    # Gauge lỗi (vd. collection đã bị tiến trình khác xóa) chỉ bị bỏ qua, /metrics vẫn trả về
+    from search_module.utilities.metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Số request").inc()
+    registry.gauge("broken", "Gauge lỗi", lambda: 1 / 0)
+    rendered = registry.render()
+    assert "requests_total 1" in rendered and "broken" not in rendered
+
+
+def test_request_logging_never_dumps_payload(caplog):
+    """Test log của request chỉ có key và kích thước, không có nội dung payload."""
+    import base64
+    import logging
+
+    caplog.set_level(logging.DEBUG, logger="search_module")
+    secret = "SECRET-PAYLOAD-" * 20
+    payload = {"user": "tester", "add": "pdf", "scope": "IT3190E", "filename": "secret.pdf", "async": False,
+               "data": base64.b64encode(secret.encode()).decode()}
+    client.post("/", files=create_upload_file(payload))
+    assert any(record.message == "request received" for record in caplog.records)
+    assert "SECRET-PAYLOAD" not in caplog.text
+    assert base64.b64encode(secret.encode()).decode()[:40] not in caplog.text
+
+
+def test_result_cache_invalidated_by_scope_version(youtube_chunks_sample):
+    """Test cache kết quả: lặp lại truy vấn là hit, thêm chunk vào scope làm entry bị loại."""
+    db = VectorDatabase(query_cache_size=0)
+    db.add_chunks(youtube_chunks_sample)
+
+    first = db.word_search("SEE You", scope="IT3190E")
+    second = db.word_search("see you", scope="IT3190E")
+    assert second == first
+    assert db.result_cache_stats()["hits"] == 1
+
+    # Kết quả trả về là bản sao, sửa không ảnh hưởng cache
+    second["scope_IT3190E"].clear()
+    assert db.word_search("see you", scope="IT3190E") == first
+
+    new_chunk = dict(youtube_chunks_sample[1], chunk_id=51, text="see you in the next lecture")
+    db.add_chunk(new_chunk)
+    fresh = db.word_search("see you", scope="IT3190E")
+    assert db.result_cache_stats()["stale"] == 1
+    assert any(hit["text"] == new_chunk["text"] for hit in fresh["scope_IT3190E"])
+
+
+def test_ttl_cache_expiry_and_byte_limit():
+    """Test TTLCache: entry hết hạn theo TTL, entry cũ bị loại khi vượt giới hạn byte."""
+    import time
+    from search_module.utilities.cache import TTLCache
+
+    cache = TTLCache(maxsize=10, max_bytes=25, ttl_s=0.05, sizeof=len)
+    cache.put("a", "x" * 10)
+    cache.put("b", "y" * 10)
+    assert cache.get("a") == "x" * 10
+    cache.put("c", "z" * 10)  # vượt 25 byte → loại "b" (ít dùng gần đây nhất)
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1 and cache.bytes == 20
+    cache.put("huge", "h" * 100)  # lớn hơn cả giới hạn thì không cache
+    assert cache.get("huge") is None
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_sharded_layout_and_migration(tmp_path, youtube_chunks_sample):
+    """Test layout shard: migrate từ per_scope, số collection cố định, truy vấn lọc theo scope."""
+    from search_module.utilities.migrate_layout import migrate_to_sharded
+
+    storage = str(tmp_path / "vector_storage")
+    old = VectorDatabase(storage_path=storage, keyword_index_path=str(tmp_path / "kw"), embedding_cache_path=None)
+    other = dict(youtube_chunks_sample[1], chunk_scope="IT4000E", chunk_id=7, text="see you at the exam")
+    assert old.add_chunks(youtube_chunks_sample + [other])["added"] == 3
+
+    report = migrate_to_sharded(storage, shard_count=4, drop_source=True)
+    assert report == {"scopes": 2, "chunks": 3, "dropped": 2, "mismatched": []}
+
+    db = VectorDatabase(storage_path=storage, layout="sharded", shard_count=4,
+                        keyword_index_path=str(tmp_path / "kw"), embedding_cache_path=None)
+    names = {getattr(col, "name", col) for col in db.client.list_collections()}
+    assert not any(name.startswith("scope_") for name in names)
+    assert db.counts() == {"scopes": 2, "chunks": 3}
+
+    results = db.word_search("see you", scope="IT3190E")
+    assert [hit["text"] for hit in results["scope_IT3190E"]] == ["see you next time."]
+    assert [hit["text"] for hit in results["scope_IT4000E"]] == ["see you at the exam"]
+    assert {hit["chunk_scope"] for hit in db.semantic_search("tokenizer", "IT4000E")["scope_IT4000E"]} == {"IT4000E"}
+    assert len(db.global_search("see you", "IT3190E", k=5)["results"]) == 3
+
+    with pytest.raises(ValueError):
+        VectorDatabase(storage_path=storage, layout="sharded", shard_count=8)
+
+
+def test_repeat_sources_are_deduplicated(monkeypatch, youtube_chunks_sample):
+    """Test registry nguồn: gửi lại cùng scope trả kết quả cũ, scope khác thì chép vector, không xử lý lại."""
+    import base64
+    import copy
+    import search_module.app as app_module
+    from search_module.utilities.youtube import youtube_video_id
+
+    assert youtube_video_id("https://youtu.be/Rvppog1HZJY?t=5") == "Rvppog1HZJY"
+
+    calls = []
+
+    def fake_process_youtube(url, scope):
+        calls.append(url)
+        chunks = copy.deepcopy(youtube_chunks_sample)
+        for chunk in chunks:
+            chunk["chunk_scope"] = scope
+        return chunks, "title"
+
+    monkeypatch.setattr(app_module, "process_youtube", fake_process_youtube)
+    url = "https://www.youtube.com/watch?v=Rvppog1HZJY&t=3s"
+    first = client.post("/", files=create_upload_file(
+        {"user": "dedupe-a", "add": "youtube", "data": url, "scope": "DD01", "async": False})).json()
+    assert first["num_chunks"] == 2 and "deduplicated" not in first
+
+    again = client.post("/", files=create_upload_file(
+        {"user": "dedupe-a", "add": "youtube", "data": "https://youtu.be/Rvppog1HZJY", "scope": "DD01"}))
+    assert again.status_code == 200 and again.json()["deduplicated"] == "existing"
+
+    other = client.post("/", files=create_upload_file(
+        {"user": "dedupe-b", "add": "youtube", "data": url, "scope": "DD01", "async": False})).json()
+    assert other["deduplicated"] == "copied" and other["num_chunks"] == 2
+    assert len(calls) == 1
+
+    hits = client.post("/", files=create_upload_file(
+        {"user": "dedupe-b", "search": "see you", "scope": "DD01", "mod": "word"})).json()
+    own = [scope for scope in hits if scope.startswith("scope_DD01_dedupe-b")][0]
+    assert [hit["text"] for hit in hits[own]] == ["see you next time."]
+
+    pdf = base64.b64encode(make_pdf(["tokenizer lecture " * 20, "see you next time"])).decode()
+    payload = {"user": "dedupe-a", "add": "pdf", "scope": "DD01", "filename": "a.pdf", "data": pdf, "async": False}
+    assert "deduplicated" not in client.post("/", files=create_upload_file(payload)).json()
+    res = client.post("/", files=create_upload_file(dict(payload, filename="renamed.pdf")))
+    assert res.status_code == 200 and res.json()["deduplicated"] == "existing"
+
+
+def test_transcript_cache_and_fetcher(tmp_path):
+    """Test transcript cache: lần lấy thứ hai đọc từ cache, không gọi lại fetcher; lỗi không bị cache."""
+    import json
+    from search_module.utilities import youtube
+    from search_module.utilities.youtube import DirectoryFetcher, TranscriptCache, process_youtube
+
+    captions = tmp_path / "captions"
+    captions.mkdir()
+    events = {"title": "Lecture 1", "events": [
+        {"tStartMs": 0, "segs": [{"utf8": "what is"}, {"utf8": " a tokenizer"}]},
+        {"tStartMs": 61000, "segs": [{"utf8": "see you next time."}]},
+    ]}
+    (captions / "Rvppog1HZJY.en.json").write_text(json.dumps(events), encoding="utf-8")
+
+    class CountingFetcher(DirectoryFetcher):
+        calls = 0
+
+        def fetch(self, url, lang="en"):
+            CountingFetcher.calls += 1
+            return super().fetch(url, lang)
+
+    fetcher = CountingFetcher(str(captions))
+    cache = TranscriptCache(str(tmp_path / "transcripts"))
+
+    first = youtube.get_youtube_transcript("https://youtu.be/Rvppog1HZJY", "en", fetcher, cache)
+    second = youtube.get_youtube_transcript("https://www.youtube.com/watch?v=Rvppog1HZJY&t=3s", "en", fetcher, cache)
+    assert first == second == ([[0, "what is a tokenizer"], [61000, "see you next time."]], "Lecture 1")
+    assert CountingFetcher.calls == 1
+
+    # Không có phụ đề: không cache, lần sau vẫn hỏi lại nguồn
+    assert youtube.get_youtube_transcript("https://youtu.be/aaaaaaaaaaa", "en", fetcher, cache)[0] is None
+    youtube.get_youtube_transcript("https://youtu.be/aaaaaaaaaaa", "en", fetcher, cache)
+    assert CountingFetcher.calls == 3
+
+    youtube.set_fetcher(fetcher)
+    try:
+        chunks, title = process_youtube("https://youtu.be/Rvppog1HZJY", "IT3190E", "vi")
+    finally:
+        youtube.set_fetcher(None)
+    assert title == "Lecture 1" and chunks[0]["text"] == "what is a tokenizer see you next time."
+    assert chunks[0]["chunk_scope"] == "IT3190E"
+
+    # Fetcher thiếu phương thức bị từ chối ngay khi khởi tạo
+    class NoPlaylistFetcher(youtube.TranscriptFetcher):
+        def fetch(self, url, lang="en"):
+            return None, None
+
+    with pytest.raises(TypeError):
+        NoPlaylistFetcher()
+
+
+def test_youtube_many_urls_and_playlist(tmp_path):
+    """Test ingest nhiều video / playlist: mỗi video một trạng thái, video lỗi không làm dừng video khác."""
+    import json
+    from search_module.utilities import youtube
+
+    for video_id, text in [("AAAAAAAAAAA", "gradient descent lecture"), ("BBBBBBBBBBB", "attention layers lecture")]:
+        events = {"title": video_id, "events": [{"tStartMs": 0, "segs": [{"utf8": text}]}]}
+        (tmp_path / f"{video_id}.en.json").write_text(json.dumps(events), encoding="utf-8")
+    (tmp_path / "PLcourse.playlist.json").write_text(
+        json.dumps(["AAAAAAAAAAA", "https://youtu.be/BBBBBBBBBBB", "CCCCCCCCCCC"]), encoding="utf-8")
+
+    youtube.set_fetcher(youtube.DirectoryFetcher(str(tmp_path)))
+    try:
+        res = client.post("/", files=create_upload_file({
+            "user": "multi-yt", "add": "youtube", "scope": "MY01", "async": False,
+            "data": ["https://www.youtube.com/watch?v=AAAAAAAAAAA", "https://youtu.be/CCCCCCCCCCC"],
+        }))
+        assert res.status_code == 200
+        body = res.json()
+        assert body["status"] == "partial" and body["num_videos"] == 2
+        assert [video["status"] for video in body["videos"]] == ["warning", "error"]
+
+        playlist = client.post("/", files=create_upload_file({
+            "user": "multi-yt", "add": "youtube", "scope": "MY01", "async": False,
+            "data": "https://www.youtube.com/playlist?list=PLcourse",
+        })).json()
+        statuses = {video["url"]: video for video in playlist["videos"]}
+        assert statuses["https://www.youtube.com/watch?v=AAAAAAAAAAA"]["deduplicated"] == "existing"
+        assert statuses["https://youtu.be/BBBBBBBBBBB"]["num_chunks"] == 1
+        assert statuses["https://www.youtube.com/watch?v=CCCCCCCCCCC"]["status"] == "error"
+    finally:
+        youtube.set_fetcher(None)
+
+    hits = client.post("/", files=create_upload_file(
+        {"user": "multi-yt", "search": "lecture", "scope": "MY01", "mod": "word"})).json()
+    own = [scope for scope in hits if scope.startswith("scope_MY01_multi-yt")][0]
+    assert sorted(hit["text"] for hit in hits[own]) == ["attention layers lecture", "gradient descent lecture"]
+
+
+def test_token_chunker_reuses_token_ids():
+    """Test chunk theo token: không vượt ngân sách, cắt ở ranh giới từ, giữ location và token id dùng lại được."""
+    import numpy as np
+    from search_module.utilities.chunker import TokenChunker, get_tokenizer
+    from search_module.utilities.youtube import chunk_transcript
+
+    tokenizer = get_tokenizer()
+    chunker = TokenChunker(max_tokens=16, overlap=4)
+    segments = [[0, "Tokenization splits unbelievably long words into subwords."],
+                [4000, "Gradient descent minimizes the loss, step by step."],
+                [65000, "See you next time, everyone!"]]
+    chunks = list(chunker.chunk_spans(segments))
+    assert len(chunks) == 3
+    for chunk in chunks:
+        assert len(chunk["token_ids"]) <= 16
+        assert chunk["token_ids"] == tokenizer(chunk["text"])["input_ids"]
+    # location là mốc của đoạn chứa token đầu tiên của chunk
+    assert [chunk["location"] for chunk in chunks] == [0, 0, 4000]
+    # Có chồng lấn: chunk sau bắt đầu bằng phần cuối của chunk trước
+    assert chunks[1]["text"].split()[0] in chunks[0]["text"]
+
+    pages = list(TokenChunker(max_tokens=256).chunk_pages([(1, "first page"), (3, "third page")]))
+    assert [(c["text"], c["location"]) for c in pages] == [("first page", 1), ("third page", 3)]
+    assert chunk_transcript(segments)[0]["location"] == "00:00:00"
+
+    db = VectorDatabase(embedding_cache_path=None)
+    chunk = dict(chunks[0], chunk_scope="IT3190E", chunk_source="x", chunk_source_type="youtube", chunk_id=1)
+    single = dict(chunks[2], chunk_scope="IT3190E", chunk_source="x", chunk_source_type="youtube", chunk_id=3)
+    # token_ids chỉ dùng để embed: chunk của người gọi giữ nguyên, metadata không chứa token_ids
+    ids = db.add_chunks([chunk])["chunk_ids"] + [db.add_chunk(single)["chunk_id"]]
+    assert chunk["token_ids"] == chunks[0]["token_ids"] and single["token_ids"] == chunks[2]["token_ids"]
+    stored = db.get_collection_by_scope("scope_IT3190E").get(ids=ids, include=["metadatas"])
+    assert len(stored["ids"]) == 2 and all("token_ids" not in meta for meta in stored["metadatas"])
+    reused = db.embed_texts([chunks[1]["text"]], token_ids=[chunks[1]["token_ids"]])[0]
+    fresh = db.embed_texts([chunks[1]["text"]])[0]
+    assert np.allclose(reused, fresh, atol=1e-5)
+
+
+def test_replace_delete_and_compact(tmp_path):
+    """Test thay / xóa nguồn, xóa scope và compaction thu hồi chỗ của dữ liệu đã xóa."""
+    from search_module.utilities.compact import compact_storage
+
+    storage = str(tmp_path / "vector_storage")
+    keywords = str(tmp_path / "keyword_index")
+    db = VectorDatabase(storage_path=storage, embedding_cache_path=None, keyword_index_path=keywords)
+
+    def chunks(source, texts, scope="CP01"):
+        return [{"text": text, "location": 1, "chunk_source": source, "chunk_scope": scope,
+                 "chunk_source_type": "pdf", "chunk_id": i + 1} for i, text in enumerate(texts)]
+
+    db.add_chunks(chunks("a.pdf", ["old tokenizer notes", "old exam notes"]))
+    db.add_chunks(chunks("b.pdf", ["gradient descent notes"]))
+    db.add_chunks(chunks("c.pdf", [f"bulk filler chunk {i}" for i in range(200)], scope="CP02"))
+
+    replaced = db.replace_source(chunks("a.pdf", ["new tokenizer notes"]))
+    assert replaced["added"] == 1 and replaced["deleted"] == 2
+    hits = db.word_search("notes", "CP01", k=10)["scope_CP01"]
+    assert sorted(hit["text"] for hit in hits) == ["gradient descent notes", "new tokenizer notes"]
+
+    assert db.delete_source("CP01", "b.pdf")["deleted"] == 1
+    assert db.delete_source("CP01", "b.pdf")["deleted"] == 0
+    assert db.delete_source("NOPE", "b.pdf")["deleted"] == 0 and "scope_NOPE" not in db.get_all_scopes()
+    assert [hit["text"] for hit in db.word_search("notes", "CP01", k=10)["scope_CP01"]] == ["new tokenizer notes"]
+
+    other = VectorDatabase(storage_path=storage, embedding_cache_path=None, keyword_index_path=keywords)
+    assert "scope_CP02" in other.get_all_scopes()
+    assert db.delete_scope("CP02")["deleted"] == 200
+    assert "scope_CP02" not in db.refresh_scopes()
+    # Tiến trình khác thấy scope đã bị xóa ở lần đọc registry sau
+    assert "scope_CP02" not in other.refresh_scopes() and "scope_CP01" in other.get_all_scopes()
+    del other
+    assert db.word_search("bulk", "CP02")["scope_CP02"] == []
+
+    # Lần compaction trước bị ngắt sau khi xóa bản gốc, trước khi đổi tên bản tạm
+    import json
+    from search_module.utilities.compact import COMPACT_STATE_FILE, _copy_collection, temp_name
+
+    original = db.client.get_collection("scope_scope_CP01", embedding_function=db.embedding_fn)
+    temp = db.client.create_collection(temp_name(original.name), embedding_function=db.embedding_fn)
+    _copy_collection(original, temp, 100)
+    with open(os.path.join(storage, COMPACT_STATE_FILE), "w", encoding="utf-8") as f:
+        json.dump({temp.name: original.name}, f)
+    db.client.delete_collection(original.name)
+    del db
+
+    report = compact_storage(storage, keywords)
+    assert not report["mismatched"] and report["orphan_segments"] >= 1
+    assert not os.path.exists(os.path.join(storage, COMPACT_STATE_FILE))
+    assert report["reclaimed_bytes"] > 0
+    after = VectorDatabase(storage_path=storage, embedding_cache_path=None, keyword_index_path=keywords)
+    assert [hit["text"] for hit in after.word_search("notes", "CP01", k=10)["scope_CP01"]] == ["new tokenizer notes"]
+    assert after.semantic_search("tokenizer", "CP01", k=1)["scope_CP01"][0]["text"] == "new tokenizer notes"
+
+
+def test_pdf_reupload_replaces_and_delete_requests():
+    """Test upload lại PDF cùng tên thì thay bản cũ; request delete xóa nguồn và cả scope."""
+    import base64
+
+    def upload(pages, scope="RP01"):
+        pdf = base64.b64encode(make_pdf(pages)).decode()
+        return client.post("/", files=create_upload_file({
+            "user": "replace-u", "add": "pdf", "scope": scope, "filename": "notes.pdf", "data": pdf, "async": False}))
+
+    def search(query, scope="RP01"):
+        hits = client.post("/", files=create_upload_file(
+            {"user": "replace-u", "search": query, "scope": scope, "mod": "word"})).json()
+        own = [sc for sc in hits if sc.startswith(f"scope_{scope}_replace-u")]
+        return [hit["text"] for hit in hits[own[0]]] if own else []
+
+    assert upload(["first draft about tokenizers"]).status_code == 200
+    assert upload(["second draft about embeddings"]).status_code == 200
+    assert search("draft") == ["second draft about embeddings"]
+
+    # Nội dung mới đã có ở scope khác: chép sang và vẫn thay bản cũ cùng tên file
+    assert upload(["third draft about vectors"], "RP02").status_code == 200
+    assert upload(["second draft about embeddings"], "RP02").json()["deduplicated"] == "copied"
+    assert search("draft", "RP02") == ["second draft about embeddings"]
+    assert "deduplicated" not in upload(["third draft about vectors"], "RP02").json()
+    assert search("draft", "RP02") == ["third draft about vectors"]
+
+    res = client.post("/", files=create_upload_file(
+        {"user": "replace-u", "delete": "pdf", "scope": "RP01", "filename": "notes.pdf"}))
+    assert res.status_code == 200 and res.json()["deleted"] == 1
+    assert search("draft") == []
+    # Registry nguồn đã quên bản bị xóa: upload lại là ingest thật, không phải "existing"
+    assert "deduplicated" not in upload(["second draft about embeddings"]).json()
+
+    bad = client.post("/", files=create_upload_file(
+        {"user": "replace-u", "delete": "pdf", "scope": "RP01", "filename": "../x.pdf"}))
+    assert bad.status_code == 400
+    res = client.post("/", files=create_upload_file({"user": "replace-u", "delete": "scope", "scope": "RP01"}))
+    assert res.json() == {"status": "success", "deleted": 1}
+    assert search("draft") == []
+
+
+def test_batch_search_matches_single_queries(youtube_chunks_sample):
+    """Test search nhiều truy vấn: một lần inference, một lần query mỗi collection, kết quả giống gọi từng câu."""
+    db = VectorDatabase(query_cache_size=0, result_cache_size=0)
+    db.add_chunks(youtube_chunks_sample)
+    queries = ["tokenizer", "see you", "Tokenizer", "integers"]
+
+    runs = []
+    run = db.embedding_fn._run
+    db.embedding_fn._run = lambda token_ids: runs.append(len(token_ids)) or run(token_ids)
+    collection = db.get_collection_by_scope("scope_IT3190E")
+    calls = []
+    query = collection.query
+    collection.query = lambda **kwargs: calls.append(len(kwargs["query_embeddings"])) or query(**kwargs)
+
+    batch = db.batch_search(queries, "IT3190E", mod="semantic")
+    assert runs == [3] and calls == [3]
+    assert batch == [db.semantic_search(q, "IT3190E") for q in queries]
+
+    assert db.batch_search(queries, "IT3190E", mod="word") == [db.word_search(q, "IT3190E") for q in queries]
+    assert db.batch_search(queries, "IT3190E", mod="hybrid") == [db.hybrid_search(q, "IT3190E") for q in queries]
+    assert db.batch_search(queries, "IT3190E", mod="word", merge="global") == [
+        db.global_search(q, "IT3190E", mod="word") for q in queries
+    ]
+
+    res = client.post("/", files=create_upload_file(
+        {"user": "batch-u", "search": ["see you", "tokenizer"], "scope": "BT01", "mod": "word"}))
+    assert res.status_code == 200 and len(res.json()) == 2
+    bad = client.post("/", files=create_upload_file({"user": "batch-u", "search": [1], "scope": "BT01"}))
+    assert bad.status_code == 400
+
+
+def test_streaming_search_by_scope(youtube_chunks_sample):
+    """Test streaming: scope của người gọi luôn đầu tiên, kết quả giống word_search, NDJSON và SSE."""
+    import json
+    import time
+
+    db = VectorDatabase()
+    db.add_chunks(youtube_chunks_sample)
+    db.add_chunks([dict(youtube_chunks_sample[1], chunk_scope="ST02", chunk_id=3, text="see you at the exam")])
+    word_hits = db._word_hits
+
+    def slow_own_scope(sc, collection, query, k):
+        if sc == "scope_IT3190E":
+            time.sleep(0.2)
+        return word_hits(sc, collection, query, k)
+
+    db._word_hits = slow_own_scope
+    streamed = list(db.iter_search("see you", "IT3190E", "word"))
+    assert streamed[0][0] == "scope_IT3190E"
+    assert dict(streamed) == db.word_search("see you", "IT3190E")
+    assert db.result_cache_stats()["hits"] == 1
+    # Lượt thứ hai phát lại từ cache theo thứ tự scope
+    replayed = list(db.iter_search("see you", "IT3190E", "word"))
+    assert replayed[0][0] == "scope_IT3190E" and dict(replayed) == dict(streamed)
+
+    payload = {"user": "stream-u", "search": "see you", "scope": "ST01", "mod": "semantic", "stream": "ndjson"}
+    res = client.post("/", files=create_upload_file(payload))
+    assert res.status_code == 200 and res.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert lines[0]["scope"].startswith("scope_ST01_stream-u") and lines[-1]["done"] is True
+    assert lines[-1]["scopes"] == len(lines) - 1
+
+    res = client.post("/", files=create_upload_file(dict(payload, stream="sse")))
+    events = [block.split("\n")[0] for block in res.text.strip().split("\n\n")]
+    assert res.headers["content-type"].startswith("text/event-stream") and events[-1] == "event: done"
+    assert client.post("/", files=create_upload_file(dict(payload, mod="hybrid"))).status_code == 400
+
+
+def test_compact_search_response(youtube_chunks_sample):
+    """Test snippet + highlight, chọn trường, phân trang k/offset và response serialize nhanh."""
+    import json
+
+    from search_module.utilities.response import dumps, make_snippet, shape_results
+
+    text = "intro " * 60 + "the Tokenizer maps strings to integers " + "outro " * 60
+    snippet = make_snippet(text, "tokenizer maps", width=80)
+    assert len(snippet["snippet"]) <= 90
+    start, end = snippet["highlights"][0]
+    assert snippet["snippet"][start:end] == "Tokenizer maps"
+    # Không khớp: lấy phần đầu chunk
+    assert make_snippet(text, "absent", width=20) == {"snippet": "intro intro intro intro", "highlights": []}
+    assert json.loads(dumps({"chữ": 0.5})) == {"chữ": 0.5}
+
+    results = {"scope_A": [{"text": f"see you {i}", "chunk_id": i, "location": i} for i in range(4)],
+               "scope_B": [{"status": "timeout", "message": "x"}]}
+    shaped, next_offset = shape_results(results, "see", offset=1, k=2, fields=["chunk_id", "location"])
+    assert shaped["scope_A"] == [{"chunk_id": 1, "location": 1}, {"chunk_id": 2, "location": 2}]
+    assert shaped["scope_B"] == results["scope_B"] and next_offset == 3
+
+    db = VectorDatabase()
+    db.add_chunks(youtube_chunks_sample)
+    payload = {"user": "compact-u", "search": "see you", "scope": "ST01", "mod": "word", "merge": "global"}
+    full = client.post("/", files=create_upload_file(payload)).json()["results"]
+    res = client.post("/", files=create_upload_file(dict(payload, k=1, snippet=True, fields=["chunk_id", "snippet", "highlights"])))
+    page = res.json()
+    assert res.status_code == 200 and page["results"][0]["chunk_id"] == full[0]["chunk_id"]
+    assert set(page["results"][0]) == {"chunk_id", "snippet", "highlights"}
+    assert page["next_offset"] == (1 if len(full) > 1 else None)
+    assert client.post("/", files=create_upload_file(dict(payload, k=0))).status_code == 400
+    assert client.post("/", files=create_upload_file(dict(payload, fields=["embedding"]))).status_code == 400
+    for deadline_ms in ("soon", 0, -5, True):
+        assert client.post("/", files=create_upload_file(dict(payload, deadline_ms=deadline_ms))).status_code == 400
+    assert client.post("/", files=create_upload_file(dict(payload, deadline_ms=5000))).status_code == 200